@@ -25,12 +25,14 @@ function showSidebar() {
 function runCommand(input) {
   var props = PropertiesService.getScriptProperties();
   var token = props.getProperty('API_TOKEN');
-  var url = 'https://your-api.example.com/exec';
+  var url = props.getProperty('API_URL') || 'https://your-api.example.com/exec';
   var options = {
     method: 'post',
     contentType: 'application/json',
     headers: { 'Authorization': 'Bearer ' + token },
-    payload: JSON.stringify({ cmd: input })
+    muteHttpExceptions: true,
+    // docId lets commands default to the document the sidebar is open in
+    payload: JSON.stringify({ cmd: input, docId: DocumentApp.getActiveDocument().getId() })
   };
   var response = UrlFetchApp.fetch(url, options);
   return response.getContentText();
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Compare the streaming Markdown renderer with the original string-concatenating one."""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from doc_markdown import iter_markdown, write_chunks  # noqa: E402
+
+def legacy_parse_doc_to_markdown(doc):
+    # Verbatim copy of sync_doc.parse_doc_to_markdown before the streaming renderer
+    md = ''
+    body = doc.get('body', {}).get('content', [])
+    for element in body:
+        paragraph = element.get('paragraph')
+        if not paragraph:
+            continue
+        style = paragraph.get('paragraphStyle', {}).get('namedStyleType', '')
+        text_runs = paragraph.get('elements', [])
+        text = ''.join(
+            run.get('textRun', {}).get('content', '')
+            for run in text_runs
+        )
+        text = text.rstrip('\n')
+        if style == 'HEADING_1':
+            md += f'# {text}\n\n'
+        elif style == 'HEADING_2':
+            md += f'## {text}\n\n'
+        else:
+            md += f'{text}\n'
+    return md
+
+def legacy_write(doc, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(legacy_parse_doc_to_markdown(doc))
+
+def streaming_write(doc, path):
+    write_chunks(iter_markdown(doc), path)
+
+def make_doc(paragraphs, plain=False):
+    content = []
+    index = 1
+    for i in range(paragraphs):
+        if i % 50 == 0:
+            style, runs = 'HEADING_1', [{'textRun': {'content': f'Section {i // 50}\n'}}]
+        elif i % 10 == 0:
+            style, runs = 'HEADING_2', [{'textRun': {'content': f'Topic {i}\n'}}]
+        elif plain:
+            style, runs = 'NORMAL_TEXT', [{'textRun': {'content': f'Paragraph {i} has some plain text.\n'}}]
+        else:
+            style = 'NORMAL_TEXT'
+            runs = [
+                {'textRun': {'content': f'Paragraph {i} has some ', 'textStyle': {}}},
+                {'textRun': {'content': 'bold', 'textStyle': {'bold': True}}},
+                {'textRun': {'content': ' text and a ', 'textStyle': {}}},
+                {'textRun': {'content': 'link', 'textStyle': {'link': {'url': 'https://example.com'}}}},
+                {'textRun': {'content': '.\n', 'textStyle': {}}},
+            ]
+        length = sum(len(r['textRun']['content']) for r in runs)
+        content.append({
+            'startIndex': index,
+            'endIndex': index + length,
+            'paragraph': {'paragraphStyle': {'namedStyleType': style}, 'elements': runs},
+        })
+        index += length
+    return {'body': {'content': content}}
+
+def measure(fn, doc, path, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(doc, path)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(doc, path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+        help='Synthetic document sizes in paragraphs'
+    )
+    parser.add_argument(
+        '--plain', action='store_true',
+        help='Generate unstyled paragraphs (no bold or links) for a like-for-like comparison'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is kept)')
+    args = parser.parse_args()
+    print(f'{"paragraphs":>10} {"renderer":>10} {"time ms":>10} {"peak MiB":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'out.md')
+        for size in args.sizes:
+            doc = make_doc(size, plain=args.plain)
+            for name, fn in (('legacy', legacy_write), ('streaming', streaming_write)):
+                elapsed, peak = measure(fn, doc, path, args.repeat)
+                print(f'{size:>10} {name:>10} {elapsed * 1000:>10.1f} {peak / 2**20:>10.2f}')
+
+if __name__ == '__main__':
+    main()
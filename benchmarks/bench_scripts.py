@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Run every script end to end against the local Docs/Activity emulator and report cost."""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import docs_emulator  # noqa: E402
+
+DOC_ID = 'bench-doc'
+
+def section_names(size):
+    return [f'Section {i + 1}' for i in range((size + 49) // 50)]
+
+# (script module, argv after the program name); {out} is a scratch directory
+SCENARIOS = {
+    'create_sections': ('create_sections', lambda size, out: [
+        '--doc-id', DOC_ID, '--sections', 'Section 1', 'Appendix A', 'Appendix B']),
+    'insert_section_breaks': ('insert_section_breaks', lambda size, out: ['--doc-id', DOC_ID]),
+    'insert_page_breaks': ('insert_page_breaks', lambda size, out: ['--doc-id', DOC_ID]),
+    'apply_section_headers': ('apply_section_headers', lambda size, out: ['--doc-id', DOC_ID]),
+    'tag_sections': ('tag_sections', lambda size, out: [
+        '--doc-id', DOC_ID, '--sections', *section_names(size)]),
+    'pipeline': ('pipeline', lambda size, out: ['--doc-id', DOC_ID]),
+    'sync_doc': ('sync_doc', lambda size, out: [
+        '--doc-id', DOC_ID, '--output', os.path.join(out, 'doc.md'),
+        '--state', os.path.join(out, 'state.json')]),
+    'fetch_activity': ('fetch_activity', lambda size, out: [
+        '--doc-id', DOC_ID, '--output', os.path.join(out, 'activity.jsonl'),
+        '--cursor', os.path.join(out, 'cursor.json')]),
+}
+
+def prepare(size, latency):
+    docs = docs_emulator.EmulatedDocsService(latency=latency)
+    docs.add(docs_emulator.generate_document(DOC_ID, size))
+    activity = docs_emulator.EmulatedActivityService(latency=latency)
+    activity.add(DOC_ID, docs_emulator.generate_activities(size))
+    docs_emulator.install(docs=docs, activity=activity)
+    return docs, activity
+
+def run_script(module_name, argv, out):
+    module = __import__(module_name)
+    saved_argv, saved_cwd = sys.argv, os.getcwd()
+    # Scripts write relative paths (e.g. sections/sections.json); keep them in scratch
+    sys.argv = [module_name] + argv
+    os.chdir(out)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.main()
+    finally:
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+
+def measure(name, size, latency, memory, rerun=False):
+    module_name, make_argv = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as out:
+        docs, activity = prepare(size, latency)
+        if rerun:
+            # Measure the steady state: the same job against its own output
+            run_script(module_name, make_argv(size, out), out)
+            docs.calls.clear()
+            activity.calls.clear()
+        start = time.perf_counter()
+        run_script(module_name, make_argv(size, out), out)
+        elapsed = time.perf_counter() - start
+        calls = docs.calls + activity.calls
+    peak = None
+    if memory:
+        with tempfile.TemporaryDirectory() as out:
+            prepare(size, latency)
+            if rerun:
+                run_script(module_name, make_argv(size, out), out)
+            tracemalloc.start()
+            run_script(module_name, make_argv(size, out), out)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return elapsed, calls, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+        help='Synthetic document sizes in paragraphs'
+    )
+    parser.add_argument(
+        '--scripts', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+        help='Scripts to run (default: all)'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds of simulated network latency added to every API call'
+    )
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='Skip the second, tracemalloc-instrumented run of each script'
+    )
+    parser.add_argument(
+        '--rerun', action='store_true',
+        help='Run each script once first and measure the repeat run'
+    )
+    args = parser.parse_args()
+    print(f'{"script":<24} {"paragraphs":>10} {"time ms":>10} {"get":>5} '
+          f'{"update":>6} {"query":>5} {"peak MiB":>9}')
+    try:
+        for name in args.scripts:
+            for size in args.sizes:
+                elapsed, calls, peak = measure(
+                    name, size, args.latency, not args.no_memory, args.rerun)
+                peak = '' if peak is None else f'{peak / 2**20:.2f}'
+                print(f'{name:<24} {size:>10} {elapsed * 1000:>10.1f} '
+                      f'{calls["documents.get"]:>5} {calls["documents.batchUpdate"]:>6} '
+                      f'{calls["activity.query"]:>5} {peak:>9}')
+    finally:
+        docs_emulator.uninstall()
+
+if __name__ == '__main__':
+    main()
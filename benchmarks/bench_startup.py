@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Measure cold start time (interpreter + imports + argparse) of every script via --help."""
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+import subprocess
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+
+def time_command(cmd, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), min(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per script (median is reported)')
+    parser.add_argument(
+        '--with-google', action='store_true',
+        help='Also time importing the Google client libraries, for comparison'
+    )
+    args = parser.parse_args()
+    baseline, _ = time_command([sys.executable, '-c', 'pass'], args.repeat)
+    print(f'{"script":<28} {"median ms":>10} {"min ms":>10}')
+    print(f'{"(bare interpreter)":<28} {baseline * 1000:>10.1f} {"":>10}')
+    for path in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.py'))):
+        with open(path, encoding='utf-8') as f:
+            if "if __name__ == '__main__':" not in f.read():
+                continue
+        median, best = time_command([sys.executable, path, '--help'], args.repeat)
+        print(f'{os.path.basename(path):<28} {median * 1000:>10.1f} {best * 1000:>10.1f}')
+    if args.with_google:
+        code = 'import googleapiclient.discovery, google.oauth2.service_account, google_auth_httplib2'
+        median, best = time_command([sys.executable, '-c', code], args.repeat)
+        print(f'{"(google imports)":<28} {median * 1000:>10.1f} {best * 1000:>10.1f}')
+
+if __name__ == '__main__':
+    main()
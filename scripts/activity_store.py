@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""Columnar on-disk store for Drive activity records, with time-range and per-user queries."""
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import calendar
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from functools import lru_cache
+from collections import Counter
+
+from fetch_activity import DEFAULT_OUTPUT, read_records, record_key
+import profiling
+
+DEFAULT_STORE = 'activity/store'
+# Rows per chunk file; larger appends are split
+CHUNK_SIZE = 65536
+MAGIC = b'ACOL'
+FORMAT_VERSION = 1
+# magic, format version, row count
+_HEADER = struct.Struct('<4sHI')
+# Column name and array typecode in file order; offset has one extra entry
+COLUMNS = (('ts', 'q'), ('user', 'I'), ('doc', 'I'), ('action', 'I'), ('offset', 'Q'))
+# Dictionary-encoded columns: (column, index.json list of values, record key)
+_DICTIONARIES = (
+    ('user', 'users', 'user'), ('doc', 'docs', 'docId'), ('action', 'actions', 'action'))
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+@lru_cache(maxsize=1 << 16)
+def _minute(prefix):
+    # Activity bursts share minutes, so the calendar math is done once per minute
+    return calendar.timegm((
+        int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+        int(prefix[11:13]), int(prefix[14:16]), 0, 0, 0, 0))
+
+def to_millis(timestamp):
+    """Milliseconds since the epoch for an RFC 3339 timestamp or a YYYY-MM-DD (UTC) date."""
+    if len(timestamp) == 10:
+        timestamp += 'T00:00:00Z'
+    tail = timestamp[19:]
+    fraction = tail[1:-1] if tail[:1] == '.' else ''
+    if tail[-1:] == 'Z' and (tail == 'Z' or fraction.isdigit()) and timestamp[10:11] == 'T':
+        # Drive's own "...Z" timestamps, the common case
+        seconds = _minute(timestamp[:16]) + int(timestamp[17:19])
+        return seconds * 1000 + int((fraction + '000')[:3])
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        raise ValueError(f'{timestamp!r} has no UTC offset')
+    return calendar.timegm(parsed.utctimetuple()) * 1000 + parsed.microsecond // 1000
+
+def partition_of(millis):
+    """(YYYY-MM name, first millisecond of the next month) for a timestamp."""
+    tm = time.gmtime(millis // 1000)
+    year, month = (tm.tm_year + 1, 1) if tm.tm_mon == 12 else (tm.tm_year, tm.tm_mon + 1)
+    return f'{tm.tm_year:04d}-{tm.tm_mon:02d}', calendar.timegm((year, month, 1, 0, 0, 0)) * 1000
+
+class ActivityStore:
+    """Append-only chunked columns under `path`, described by path/index.json."""
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        self.index = self._load_index()
+        self._codes = {
+            column: {value: code for code, value in enumerate(self.index[table])}
+            for column, table, _ in _DICTIONARIES
+        }
+
+    def _load_index(self):
+        path = os.path.join(self.path, 'index.json')
+        if not os.path.isfile(path):
+            return {'format': FORMAT_VERSION, 'users': [], 'docs': [], 'actions': [],
+                    'chunks': [], 'next': 1}
+        with open(path, encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('format') != FORMAT_VERSION:
+            raise ValueError(f'{path}: unsupported store format {index.get("format")}')
+        return index
+
+    def _save_index(self):
+        # Chunk files are written first, so a crash leaves orphans, never dangling entries
+        path = os.path.join(self.path, 'index.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def _code(self, column, table, value):
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.index[table].append(value)
+        return code
+
+    def __len__(self):
+        return sum(chunk['count'] for chunk in self.index['chunks'])
+
+    # -- writing ------------------------------------------------------------
+
+    def append(self, records):
+        """Add records (dicts with a timestamp); returns the number stored."""
+        rows = [(to_millis(r['timestamp']), r) for r in records if r.get('timestamp')]
+        rows.sort(key=lambda row: row[0])
+        start = 0
+        while start < len(rows):
+            partition, boundary = partition_of(rows[start][0])
+            stop = start
+            while stop < len(rows) and stop - start < CHUNK_SIZE and rows[stop][0] < boundary:
+                stop += 1
+            self._write_chunk(partition, rows[start:stop])
+            start = stop
+        if rows:
+            self._save_index()
+        return len(rows)
+
+    def _write_chunk(self, partition, rows):
+        name = f'{partition}/chunk-{self.index["next"]:06d}'
+        self.index['next'] += 1
+        base = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        columns = {column: array(code) for column, code in COLUMNS}
+        offset = 0
+        with open(f'{base}.jsonl', 'wb') as f:
+            for millis, record in rows:
+                columns['ts'].append(millis)
+                for column, table, key in _DICTIONARIES:
+                    columns[column].append(self._code(column, table, record.get(key)))
+                columns['offset'].append(offset)
+                line = (_encode(record) + '\n').encode('utf-8')
+                f.write(line)
+                offset += len(line)
+        columns['offset'].append(offset)
+        entry = {
+            'path': name,
+            'start': rows[0][0],
+            'end': rows[-1][0],
+            'count': len(rows),
+            'users': sorted(set(columns['user'])),
+            'docs': sorted(set(columns['doc'])),
+        }
+        with open(f'{base}.col', 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(rows)))
+            for column, _ in COLUMNS:
+                values = columns[column]
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                f.write(values.tobytes())
+        self.index['chunks'].append(entry)
+
+    def compact(self):
+        """Merge each partition's chunks into as few full chunks as possible."""
+        by_partition = {}
+        for chunk in self.index['chunks']:
+            by_partition.setdefault(chunk['path'].split('/')[0], []).append(chunk)
+        merged = 0
+        for partition, chunks in sorted(by_partition.items()):
+            if len(chunks) <= (sum(c['count'] for c in chunks) + CHUNK_SIZE - 1) // CHUNK_SIZE:
+                continue
+            rows = []
+            for chunk in chunks:
+                with open(os.path.join(self.path, f'{chunk["path"]}.jsonl'), encoding='utf-8') as f:
+                    rows.extend(json.loads(line) for line in f)
+            self.index['chunks'] = [c for c in self.index['chunks'] if c not in chunks]
+            self.append(rows)
+            for chunk in chunks:
+                for ext in ('.col', '.jsonl'):
+                    os.remove(os.path.join(self.path, chunk['path'] + ext))
+            merged += len(chunks)
+        return merged
+
+    # -- reading ------------------------------------------------------------
+
+    def _columns(self, chunk):
+        with open(os.path.join(self.path, f'{chunk["path"]}.col'), 'rb') as f:
+            data = f.read()
+        magic, version, count = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{chunk["path"]}.col: not a format {FORMAT_VERSION} column file')
+        columns = {}
+        pos = _HEADER.size
+        for column, code in COLUMNS:
+            values = array(code)
+            size = values.itemsize * (count + 1 if column == 'offset' else count)
+            values.frombytes(data[pos:pos + size])
+            if sys.byteorder != 'little':
+                values.byteswap()
+            columns[column] = values
+            pos += size
+        return columns
+
+    def _matches(self, since=None, until=None, user=None, doc=None, action=None):
+        """Yield (chunk, columns, row positions) for every chunk with matching rows."""
+        return self._scan(to_millis(since) if since else None,
+                          to_millis(until) if until else None, user, doc, action)
+
+    def _scan(self, start, end, user=None, doc=None, action=None):
+        # _matches with the time range already in milliseconds
+        user_code = self._codes['user'].get(user) if user is not None else None
+        doc_code = self._codes['doc'].get(doc) if doc is not None else None
+        if (user is not None and user_code is None) or (doc is not None and doc_code is None):
+            return
+        action_codes = None
+        if action is not None:
+            action_codes = {
+                code for value, code in self._codes['action'].items()
+                if action in (value or '').split(',')
+            }
+        for chunk in sorted(self.index['chunks'], key=lambda c: c['start']):
+            # Skip chunks the index rules out without opening them
+            if (start is not None and chunk['end'] < start) or \
+                    (end is not None and chunk['start'] >= end):
+                continue
+            if user_code is not None and user_code not in chunk['users']:
+                continue
+            if doc_code is not None and doc_code not in chunk['docs']:
+                continue
+            columns = self._columns(chunk)
+            ts = columns['ts']
+            lo = bisect_left(ts, start) if start is not None else 0
+            hi = bisect_left(ts, end) if end is not None else len(ts)
+            rows = range(lo, hi)
+            if user_code is not None:
+                users = columns['user']
+                rows = [i for i in rows if users[i] == user_code]
+            if doc_code is not None:
+                docs = columns['doc']
+                rows = [i for i in rows if docs[i] == doc_code]
+            if action_codes is not None:
+                actions = columns['action']
+                rows = [i for i in rows if actions[i] in action_codes]
+            if rows:
+                yield chunk, columns, rows
+
+    def count(self, **filters):
+        return sum(len(rows) for _, _, rows in self._matches(**filters))
+
+    def count_by_user(self, **filters):
+        counts = Counter()
+        for _, columns, rows in self._matches(**filters):
+            users = columns['user']
+            counts.update(users[i] for i in rows)
+        return Counter({self.index['users'][code]: n for code, n in counts.items()})
+
+    def query(self, **filters):
+        """Yield matching records, oldest first within each chunk and chunks by start."""
+        return self._records(self._matches(**filters))
+
+    def _records(self, matches):
+        for chunk, columns, rows in matches:
+            offsets = columns['offset']
+            first = offsets[rows[0]]
+            # One read covering the matches; rows are sliced out of it
+            with open(os.path.join(self.path, f'{chunk["path"]}.jsonl'), 'rb') as f:
+                f.seek(first)
+                blob = f.read(offsets[rows[-1] + 1] - first)
+            for i in rows:
+                yield json.loads(blob[offsets[i] - first:offsets[i + 1] - first])
+
+    def missing(self, records):
+        """The records not already stored, compared by fetch_activity.record_key."""
+        stamps = [to_millis(r['timestamp']) for r in records if r.get('timestamp')]
+        if not stamps:
+            return []
+        # Only chunks overlapping the batch's time span are read
+        seen = {record_key(r) for r in self._records(self._scan(min(stamps), max(stamps) + 1))}
+        fresh = []
+        for record in records:
+            key = record_key(record)
+            if key not in seen:
+                seen.add(key)
+                fresh.append(record)
+        return fresh
+
+def import_log(store, path, batch=CHUNK_SIZE):
+    """Stream a JSONL activity log into the store in bounded batches.
+
+    Records already in the store are skipped, so re-importing a log that
+    fetch_activity.py has since appended to adds only the new lines.
+    """
+    total = 0
+    pending = []
+    for record in read_records(path):
+        pending.append(record)
+        if len(pending) >= batch:
+            total += store.append(store.missing(pending))
+            pending = []
+    return total + store.append(store.missing(pending))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--store', default=DEFAULT_STORE, help='Store directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    imp = commands.add_parser('import', help='Append a JSONL activity log to the store')
+    imp.add_argument('log', nargs='?', default=DEFAULT_OUTPUT, help='Log from fetch_activity.py')
+    query = commands.add_parser('query', help='Print matching records as JSON lines')
+    query.add_argument('--since', help='Start (inclusive): YYYY-MM-DD or RFC 3339 timestamp')
+    query.add_argument('--until', help='End (exclusive): YYYY-MM-DD or RFC 3339 timestamp')
+    query.add_argument('--user', help='Exact user, e.g. people/123')
+    query.add_argument('--doc', help='Google Doc ID')
+    query.add_argument('--action', help='Action type, e.g. edit')
+    query.add_argument('--limit', type=int, help='Print at most this many records')
+    summary = query.add_mutually_exclusive_group()
+    summary.add_argument('--count', action='store_true', help='Print only the number of matches')
+    summary.add_argument('--by-user', action='store_true', help='Print match counts per user')
+    commands.add_parser('compact', help='Merge small chunks within each month')
+    commands.add_parser('stats', help='Describe the store')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    store = ActivityStore(args.store)
+    if args.command == 'import':
+        print(f'Imported {import_log(store, args.log)} record(s) into {args.store}')
+    elif args.command == 'compact':
+        print(f'Merged {store.compact()} chunk(s); {len(store.index["chunks"])} remain')
+    elif args.command == 'stats':
+        chunks = store.index['chunks']
+        print(f'{len(store)} record(s) in {len(chunks)} chunk(s), '
+              f'{len({c["path"].split("/")[0] for c in chunks})} month(s), '
+              f'{len(store.index["users"])} user(s), {len(store.index["docs"])} doc(s)')
+    else:
+        filters = {'since': args.since, 'until': args.until, 'user': args.user,
+                   'doc': args.doc, 'action': args.action}
+        if args.count:
+            print(store.count(**filters))
+        elif args.by_user:
+            for user, n in store.count_by_user(**filters).most_common():
+                print(f'{n:>10}  {user}')
+        else:
+            for i, record in enumerate(store.query(**filters)):
+                if args.limit is not None and i >= args.limit:
+                    break
+                sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+if __name__ == '__main__':
+    main()
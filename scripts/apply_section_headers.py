@@ -1,118 +1,148 @@
 #!/usr/bin/env python3
 """Create per-section headers and assign a global footer in a Google Doc."""
-import os
 import argparse
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+
+from doc_fields import MASKS, combine
+from doc_index import DocIndex, fetch_index, paragraph_text
+from doc_plan import Plan
+import google_clients
+import profiling
+from tag_sections import tag_name
 
 # OAuth2 scopes for Google Docs write access
 SCOPES = ['https://www.googleapis.com/auth/documents']
 
 def get_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError(
-            'Service account credentials not found. '
-            'Set GOOGLE_APPLICATION_CREDENTIALS to your key JSON.'
-        )
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    return build('docs', 'v1', credentials=creds)
+    return google_clients.get_service('docs', 'v1', SCOPES)
 
 def fetch_section_ranges(doc):
-    # Find all H1 headings, record start indices and text
-    headings = []
-    for el in doc.get('body', {}).get('content', []):
-        para = el.get('paragraph')
-        if not para:
+    # Section ranges (start, end, name) delimited by H1 headings
+    index = doc if isinstance(doc, DocIndex) else DocIndex(doc)
+    return [
+        {'start': s.start, 'end': s.end, 'name': s.name}
+        for s in index.sections
+    ]
+
+def current_header(plan, index_in_h1, heading):
+    """Return the header ID already serving this section, if any."""
+    if index_in_h1 == 0:
+        return (plan.index.doc.get('documentStyle') or {}).get('defaultHeaderId')
+    if heading.start in plan.breaks:
+        # The break is only planned, so it has no header yet
+        return None
+    existing = plan.index.break_before(heading.start)
+    return existing.header_id if existing else None
+
+def header_segment(doc, header_id):
+    # (text, start, end) of a header segment; end excludes the final newline
+    content = (doc.get('headers') or {}).get(header_id, {}).get('content', [])
+    text = ''.join(
+        paragraph_text(el['paragraph']) for el in content if 'paragraph' in el)
+    start = content[0].get('startIndex', 0) if content else 0
+    end = content[-1].get('endIndex', 1) - 1 if content else 0
+    return text, start, end
+
+def resolve_tagged(index, slugs):
+    """Heading starts of the sections tagged with the given slugs, via named ranges."""
+    starts = set()
+    for slug in slugs:
+        section = index.tagged_section(tag_name(slug))
+        if section is None:
+            print(f'Warning: no section tagged "{slug}"; skipping.')
+            continue
+        starts.add(section.start)
+    return starts
+
+def plan_headers(plan, prefix, starts=None):
+    """Queue a footer, one header per H1 section and (on reply) its text.
+
+    Sections whose header already reads prefix + heading are skipped, so a
+    re-run plans no requests. With starts, only headings starting there are
+    considered. Returns the number of sections planned.
+    """
+    doc = plan.index.doc
+    if not (doc.get('footers') or {}):
+        plan.add({'createFooter': {'type': 'DEFAULT'}})
+
+    def header_text(text):
+        def on_reply(reply):
+            header_id = reply.get('createHeader', {}).get('headerId')
+            return [_insert_header_text(header_id, text)] if header_id else []
+        return on_reply
+
+    planned = 0
+    for i, heading in enumerate(plan.h1):
+        if starts is not None and heading.start not in starts:
+            continue
+        text = f'{prefix}{heading.text}'
+        header_id = current_header(plan, i, heading)
+        if header_id:
+            current, start, end = header_segment(doc, header_id)
+            if current == text.strip():
+                continue
+            if end > start:
+                plan.add({
+                    'deleteContentRange': {
+                        'range': {'segmentId': header_id, 'startIndex': start, 'endIndex': end}
+                    }
+                })
+            plan.add(_insert_header_text(header_id, text, start))
+            planned += 1
             continue
-        style = para.get('paragraphStyle', {}).get('namedStyleType')
-        if style == 'HEADING_1':
-            text = ''.join(
-                run.get('textRun', {}).get('content', '')
-                for run in para.get('elements', [])
-            ).strip()
-            start = el.get('startIndex')
-            if isinstance(start, int):
-                headings.append((start, text))
-    headings.sort(key=lambda x: x[0])
-    # Determine document end
-    body = doc.get('body', {}).get('content', [])
-    doc_end = body[-1].get('endIndex') if body else 1
-    # Build section ranges: (start, end, name)
-    sections = []
-    for i, (start, name) in enumerate(headings):
-        end = headings[i+1][0] if i+1 < len(headings) else doc_end
-        sections.append({'start': start, 'end': end, 'name': name})
-    return sections
+        create_req = {'type': 'DEFAULT'}
+        if i > 0:
+            location = plan.break_location(heading)
+            if location is None:
+                print(f'Warning: no section break before "{heading.text}"; skipping header.')
+                continue
+            create_req['sectionBreakLocation'] = {'index': location}
+        plan.add({'createHeader': create_req}, on_reply=header_text(text), follow_ups=1)
+        planned += 1
+    return planned
+
+def _insert_header_text(header_id, text, index=0):
+    return {
+        'insertText': {
+            'location': {'segmentId': header_id, 'index': index},
+            'text': text
+        }
+    }
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--doc-id', required=True, help='Google Doc ID')
     parser.add_argument('--prefix', default='Advisor Notes - ', help='Header text prefix')
+    parser.add_argument(
+        '--sections', nargs='+', metavar='SLUG',
+        help='Only sections tagged with these tag_sections.py slugs (default: all)'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
+    )
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.start(args.profile)
     service = get_service()
-    # Fetch doc (include footers for detection)
-    # Fetch full document (includes headers, footers, and styles)
-    doc = service.documents().get(documentId=args.doc_id).execute()
-    # Gather H1 headings to define sections
-    headings = []  # list of (startIndex, headingText)
-    for el in doc.get('body', {}).get('content', []):
-        para = el.get('paragraph')
-        if not para:
-            continue
-        if para.get('paragraphStyle', {}).get('namedStyleType') == 'HEADING_1':
-            text = ''.join(
-                run.get('textRun', {}).get('content', '')
-                for run in para.get('elements', [])
-            ).strip()
-            idx = el.get('startIndex')
-            if isinstance(idx, int):
-                headings.append((idx, text))
-    if not headings:
+    # Headings plus headers, footers and the default header/footer IDs
+    fields = combine(MASKS['headers'], MASKS['tags']) if args.sections else MASKS['headers']
+    plan = Plan(fetch_index(service, args.doc_id, fields))
+    if not plan.h1:
         print('No H1 headings found; nothing to do.')
         return
-    headings.sort(key=lambda x: x[0])
-    # Ensure a default footer exists (applies globally)
-    existing_footers = doc.get('footers', {}) or {}
-    if existing_footers:
-        footer_id = next(iter(existing_footers.keys()))
-    else:
-        resp = service.documents().batchUpdate(
-            documentId=args.doc_id,
-            body={'requests': [{'createFooter': {'type': 'DEFAULT'}}]}
-        ).execute()
-        footer_id = resp.get('replies', [{}])[0].get('createFooter', {}).get('footerId')
-    # Check for existing document-level header
-    doc_style = doc.get('documentStyle', {}) or {}
-    default_header_id = doc_style.get('defaultHeaderId')
-    # Create a header for each section
-    for i, (idx, name) in enumerate(headings):
-        # Determine header creation: global header or section-specific
-        if i == 0 and default_header_id:
-            header_id = default_header_id
-        else:
-            create_req = {'type': 'DEFAULT'}
-            if i > 0:
-                create_req['sectionBreakLocation'] = {'index': idx}
-            resp = service.documents().batchUpdate(
-                documentId=args.doc_id,
-                body={'requests': [{'createHeader': create_req}]}
-            ).execute()
-            header_id = resp.get('replies', [{}])[0].get('createHeader', {}).get('headerId')
-        # Insert the header text if not empty
-        header_text = f"{args.prefix}{name}"
-        if header_id and header_text:
-            service.documents().batchUpdate(
-                documentId=args.doc_id,
-                body={'requests': [{
-                    'insertText': {
-                        'location': {'segmentId': header_id, 'index': 0},
-                        'text': header_text
-                    }
-                }]}
-            ).execute()
-    print(f'Applied headers for {len(headings)} sections and ensured footer.')
+    starts = resolve_tagged(plan.index, args.sections) if args.sections else None
+    # All createHeader requests go out together; header text follows in one
+    # more batchUpdate once the replies carry the new header IDs
+    planned = plan_headers(plan, args.prefix, starts)
+    if args.dry_run:
+        plan.print_dry_run()
+        return
+    if not plan.requests:
+        print('All section headers are up to date; no changes made.')
+        return
+    plan.execute(service, args.doc_id)
+    print(f'Applied headers for {planned} of {len(plan.h1)} sections '
+          f'in {plan.batches} batchUpdate call(s) and ensured footer.')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
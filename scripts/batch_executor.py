@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""Queue, coalesce and retry Docs batchUpdate calls with adaptive concurrency."""
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+
+# Requests per batchUpdate call; larger queues are split and chained by revision
+MAX_REQUESTS_PER_BATCH = 500
+# Statuses worth retrying; anything else (e.g. a stale requiredRevisionId) is final.
+# Throttled calls were never applied, so they are always safe to resend.
+RETRY_STATUSES = {429, 503}
+# Failures that may come after the batch was applied. They (and dropped
+# connections) are only retried when requiredRevisionId is set, which turns
+# a resend of an applied batch into a 400 instead of applying it twice.
+AMBIGUOUS_STATUSES = {500, 502, 504}
+THROTTLE_STATUSES = {429, 503}
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+def http_status(exc):
+    # googleapiclient.errors.HttpError (and look-alikes) carry an httplib2 response
+    status = getattr(getattr(exc, 'resp', None), 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+def retry_after(exc):
+    """Seconds requested by a Retry-After header, or None."""
+    resp = getattr(exc, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class Metrics:
+    """Counters and a latency histogram shared by every call an executor makes."""
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.requests = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self._lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def record(self, latency, requests=0, status=None):
+        with self._lock:
+            self.attempts += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.histogram[i] += 1
+                    break
+            if status is None:
+                self.calls += 1
+                self.requests += requests
+            elif status in THROTTLE_STATUSES:
+                self.throttled += 1
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'failures': self.failures,
+            'requests': self.requests,
+            'latency': {
+                ('inf' if bound == float('inf') else f'<={bound}s'): count
+                for bound, count in zip(LATENCY_BUCKETS, self.histogram)
+            },
+        }
+
+    def format(self):
+        return (f'{self.calls} batchUpdate call(s), {self.requests} request(s), '
+                f'{self.attempts} attempt(s), {self.retries} retr(ies), '
+                f'{self.throttled} throttled, {self.failures} failed')
+
+class AdaptiveLimiter:
+    """AIMD cap on in-flight calls: +1 after a window of successes, halved on throttling."""
+
+    def __init__(self, initial=4, minimum=1, maximum=16):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._successes = 0
+                self.limit = min(self.maximum, self.limit + 1)
+                self._cond.notify_all()
+
+    def throttle(self):
+        with self._cond:
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit // 2)
+
+class PendingBatch:
+    __slots__ = ('doc_id', 'requests', 'required_revision_id', 'replies')
+
+    def __init__(self, doc_id, requests, required_revision_id):
+        self.doc_id = doc_id
+        self.requests = requests
+        self.required_revision_id = required_revision_id
+        self.replies = []
+
+class BatchExecutor:
+    """Send queued batchUpdate requests with merging, retries and backoff.
+
+    Consecutive batches queued for the same doc with the same
+    requiredRevisionId (or none) are merged into calls of up to
+    MAX_REQUESTS_PER_BATCH requests and chained by requiredRevisionId.
+    Docs are drained concurrently, bounded by an AdaptiveLimiter.
+    """
+
+    def __init__(self, service, max_retries=5, base_delay=1.0, max_delay=64.0,
+                 limiter=None, metrics=None, sleep=time.sleep):
+        self.service = service
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter or AdaptiveLimiter()
+        self.metrics = metrics or Metrics()
+        self.sleep = sleep
+        self._pending = []
+        self._revisions = {}
+        self._lock = threading.Lock()
+
+    def revision(self, doc_id):
+        return self._revisions.get(doc_id)
+
+    def submit(self, doc_id, requests, required_revision_id=None):
+        """Queue requests; their replies appear on the returned batch after flush()."""
+        batch = PendingBatch(doc_id, list(requests), required_revision_id)
+        with self._lock:
+            self._pending.append(batch)
+        return batch
+
+    def run(self, doc_id, requests, required_revision_id=None):
+        batch = self.submit(doc_id, requests, required_revision_id)
+        self.flush()
+        return batch.replies
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        by_doc = {}
+        for batch in pending:
+            by_doc.setdefault(batch.doc_id, []).append(batch)
+        if len(by_doc) <= 1:
+            for doc_id, batches in by_doc.items():
+                self._drain(doc_id, batches)
+            return
+        with ThreadPoolExecutor(max_workers=self.limiter.maximum) as pool:
+            futures = [pool.submit(self._drain, d, b) for d, b in by_doc.items()]
+            for future in futures:
+                future.result()
+
+    def _drain(self, doc_id, batches):
+        # A pin change starts a new chain, so a batch is never sent against a
+        # revision it was not queued with; an unpinned chain's first call has no pin
+        start = 0
+        while start < len(batches):
+            pin = batches[start].required_revision_id
+            stop = start + 1
+            while stop < len(batches) and batches[stop].required_revision_id == pin:
+                stop += 1
+            self._send_chain(doc_id, batches[start:stop], pin)
+            start = stop
+
+    def _send_chain(self, doc_id, batches, revision_id):
+        items = [(batch, req) for batch in batches for req in batch.requests]
+        for i in range(0, len(items), MAX_REQUESTS_PER_BATCH):
+            chunk = items[i:i + MAX_REQUESTS_PER_BATCH]
+            body = {'requests': [req for _, req in chunk]}
+            if revision_id:
+                body['writeControl'] = {'requiredRevisionId': revision_id}
+            resp = self._call(doc_id, body)
+            revision_id = (resp.get('writeControl') or {}).get(
+                'requiredRevisionId', revision_id)
+            replies = resp.get('replies', [])
+            for j, (batch, _) in enumerate(chunk):
+                batch.replies.append(replies[j] if j < len(replies) else {})
+        if revision_id:
+            self._revisions[doc_id] = revision_id
+
+    def _backoff(self, attempt, exc):
+        # Honour Retry-After when given; otherwise full-jitter exponential backoff
+        requested = retry_after(exc)
+        if requested is not None:
+            return requested + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _call(self, doc_id, body):
+        attempt = 0
+        while True:
+            attempt += 1
+            with self.limiter:
+                start = time.monotonic()
+                profiling.count('batchUpdate.calls')
+                profiling.count('batchUpdate.requests', len(body['requests']))
+                try:
+                    with profiling.span('batchUpdate', requests=len(body['requests'])):
+                        resp = self.service.documents().batchUpdate(
+                            documentId=doc_id, body=body).execute()
+                except Exception as exc:
+                    status = http_status(exc)
+                    self.metrics.record(time.monotonic() - start, status=status or 0)
+                    if status in THROTTLE_STATUSES:
+                        self.limiter.throttle()
+                    ambiguous = status in AMBIGUOUS_STATUSES or (
+                        status is None and isinstance(exc, OSError))
+                    retryable = status in RETRY_STATUSES or (
+                        ambiguous and 'writeControl' in body)
+                    if not retryable or attempt > self.max_retries:
+                        self.metrics.add('failures')
+                        raise
+                    error = exc
+                else:
+                    self.metrics.record(
+                        time.monotonic() - start, requests=len(body['requests']))
+                    self.limiter.success()
+                    return resp
+            self.metrics.add('retries')
+            self.sleep(self._backoff(attempt, error))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Attribute Drive activity records to H1 sections and write per-section audit logs."""
+import os
+import json
+import time
+import argparse
+from bisect import bisect_left
+
+from activity_store import to_millis
+from fetch_activity import DEFAULT_OUTPUT, read_records
+import profiling
+from sync_state import DEFAULT_CHANGES_PATH
+
+DEFAULT_OUTPUT_DIR = 'activity/sections'
+# Audit log for records no section can be blamed for
+DOCUMENT_LOG = '_document'
+
+class ChangeWindows:
+    """Per doc, sorted sync times and the sections each sync found changed.
+
+    Drive Activity says when an edit happened but not where, so an edit is
+    blamed on the sections changed by the first sync at or after it.
+    """
+
+    def __init__(self, changes):
+        by_doc = {}
+        for change in changes:
+            by_doc.setdefault(change['docId'], []).append(
+                (to_millis(change['time']), change['sections']))
+        self._times = {}
+        self._sections = {}
+        for doc_id, rows in by_doc.items():
+            rows.sort(key=lambda row: row[0])
+            self._times[doc_id] = [t for t, _ in rows]
+            self._sections[doc_id] = [s for _, s in rows]
+
+    def sections_for(self, doc_id, timestamp):
+        # The first sync at or after an edit is the one that picked it up
+        times = self._times.get(doc_id)
+        if not times or not timestamp:
+            return None
+        i = bisect_left(times, to_millis(timestamp))
+        return self._sections[doc_id][i] if i < len(times) else None
+
+def correlate(records, windows=None):
+    """Yield (doc_id, slug, record, attribution) for every section a record belongs to."""
+    for record in records:
+        if windows is not None and 'edit' in (record.get('action') or '').split(','):
+            slugs = windows.sections_for(record['docId'], record.get('timestamp'))
+            if slugs:
+                for slug in slugs:
+                    yield record['docId'], slug, record, 'window'
+                continue
+        yield record['docId'], DOCUMENT_LOG, record, 'document'
+
+def write_audit_logs(grouped, output_dir):
+    """Rewrite <doc_id>/<slug>.jsonl per section; vanished sections' logs are removed.
+
+    grouped maps (doc_id, slug) to a list of (record, attribution) pairs.
+    Only the directories of docs in grouped are touched.
+    """
+    for doc_id in {doc_id for doc_id, _ in grouped}:
+        doc_dir = os.path.join(output_dir, doc_id)
+        os.makedirs(doc_dir, exist_ok=True)
+        wanted = {f'{slug}.jsonl' for d, slug in grouped if d == doc_id}
+        for name in os.listdir(doc_dir):
+            if name.endswith('.jsonl') and name not in wanted:
+                os.remove(os.path.join(doc_dir, name))
+    for (doc_id, slug), entries in grouped.items():
+        path = os.path.join(output_dir, doc_id, f'{slug}.jsonl')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record, attribution in entries:
+                f.write(json.dumps(dict(record, attribution=attribution),
+                                   separators=(',', ':')) + '\n')
+        os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--activity', default=DEFAULT_OUTPUT,
+        help='Activity log from fetch_activity.py'
+    )
+    parser.add_argument(
+        '--changes', default=DEFAULT_CHANGES_PATH,
+        help='Section change log written by sync_doc.py'
+    )
+    parser.add_argument(
+        '--output-dir', default=DEFAULT_OUTPUT_DIR,
+        help='Directory receiving one <docId>/<slug>.jsonl audit log per section'
+    )
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    windows = ChangeWindows(read_records(args.changes))
+    records = list(read_records(args.activity))
+    start = time.perf_counter()
+    grouped = {}
+    counts = {'window': 0, 'document': 0}
+    for doc_id, slug, record, attribution in correlate(records, windows):
+        counts[attribution] += 1
+        grouped.setdefault((doc_id, slug), []).append((record, attribution))
+    elapsed = time.perf_counter() - start
+    write_audit_logs(grouped, args.output_dir)
+    print(f'Correlated {len(records)} record(s) in {elapsed * 1000:.0f} ms: '
+          f'{counts["window"]} by sync window, '
+          f'{counts["document"]} document-level; {len(grouped)} log(s) in {args.output_dir}')
+
+if __name__ == '__main__':
+    main()
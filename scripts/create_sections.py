@@ -1,80 +1,65 @@
 #!/usr/bin/env python3
 """Ensure H1 section headings exist in a Google Doc."""
-import os
 import argparse
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from doc_fields import MASKS
+from doc_index import fetch_index
+from doc_plan import Plan, PlannedHeading, utf16_len
+import google_clients
+import profiling
 
 # OAuth2 scopes for Google Docs write access
 SCOPES = ['https://www.googleapis.com/auth/documents']
 
 def get_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError(
-            'Service account credentials not found. '
-            'Set GOOGLE_APPLICATION_CREDENTIALS to your key JSON.'
-        )
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    return build('docs', 'v1', credentials=creds)
+    return google_clients.get_service('docs', 'v1', SCOPES)
 
-def fetch_existing_headings(service, doc_id):
-    doc = service.documents().get(documentId=doc_id).execute()
-    headings = []
-    for el in doc.get('body', {}).get('content', []):
-        para = el.get('paragraph')
-        if not para:
-            continue
-        style = para.get('paragraphStyle', {}).get('namedStyleType')
-        if style == 'HEADING_1':
-            text = ''.join(
-                run.get('textRun', {}).get('content', '')
-                for run in para.get('elements', [])
-            )
-            headings.append(text.strip())
-    return headings, doc
+def fetch_existing_headings(service, doc_id, index=None):
+    index = index or fetch_index(service, doc_id, MASKS['sections'])
+    return [h.text for h in index.h1], index
 
-def create_sections(service, doc_id, sections):
-    existing, doc = fetch_existing_headings(service, doc_id)
-    requests = []
-    # Determine insertion index: one index before the document’s last endIndex
-    body_content = doc.get('body', {}).get('content', [])
-    if body_content:
-        raw_end = body_content[-1].get('endIndex', 1)
-        # insertText index must be less than segment endIndex
-        end_index = max(raw_end - 1, 1)
-    else:
-        end_index = 1
+def plan_sections(plan, sections):
+    # Append missing H1 headings; returns the names that will be added
+    existing = {h.text for h in plan.h1}
+    added = []
     for section in sections:
         if section in existing:
             continue
+        existing.add(section)
         # Insert a newline, the section text, and another newline
         text = f"\n{section}\n"
-        requests.append({
+        plan.add({
             'insertText': {
-                'location': {'index': end_index},
+                'location': {'index': plan.end_index},
                 'text': text
             }
         })
         # Apply HEADING_1 style to the inserted line (exclude the first newline)
-        start = end_index + 1
-        end = start + len(section)
-        requests.append({
+        start = plan.end_index + 1
+        end = start + utf16_len(section)
+        plan.add({
             'updateParagraphStyle': {
                 'range': {'startIndex': start, 'endIndex': end},
                 'paragraphStyle': {'namedStyleType': 'HEADING_1'},
                 'fields': 'namedStyleType'
             }
         })
-        end_index += len(text)
-    if not requests:
-        return None
-    return service.documents().batchUpdate(
-        documentId=doc_id,
-        body={'requests': requests}
-    ).execute()
+        plan.h1.append(PlannedHeading(start, end + 1, section, planned=True))
+        plan.end_index += utf16_len(text)
+        added.append(section)
+    return added
+
+def create_sections(service, doc_id, sections, index=None, dry_run=False):
+    _, index = fetch_existing_headings(service, doc_id, index)
+    # Insertion starts one index before the document’s last endIndex
+    plan = Plan(index)
+    added = plan_sections(plan, sections)
+    if dry_run:
+        plan.print_dry_run()
+        return added
+    if added:
+        plan.execute(service, doc_id)
+    return added
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -83,11 +68,19 @@ def main():
         '--sections', required=True, nargs='+',
         help='List of H1 section names to ensure in the Doc'
     )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
+    )
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.start(args.profile)
     service = get_service()
-    result = create_sections(service, args.doc_id, args.sections)
-    if result:
-        print(f'Added {len(args.sections)} new section(s).')
+    added = create_sections(service, args.doc_id, args.sections, dry_run=args.dry_run)
+    if args.dry_run:
+        return
+    if added:
+        print(f'Added {len(added)} new section(s).')
     else:
         print('All sections already exist; no changes made.')
 
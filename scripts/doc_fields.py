@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Smallest documents.get fields mask per operation, and a tool to measure the savings."""
+import json
+import time
+import argparse
+
+from doc_index import DocIndex
+import google_clients
+import profiling
+
+# OAuth2 scopes for Google Docs read access
+SCOPES = ['https://www.googleapis.com/auth/documents.readonly']
+
+# What DocIndex reads from body.content: indices, section breaks and their
+# headers, paragraph styles, and text runs / page breaks for heading text
+BODY_FIELDS = (
+    'body(content(startIndex,endIndex,sectionBreak(sectionStyle(defaultHeaderId)),'
+    'paragraph(paragraphStyle(namedStyleType),elements(startIndex,endIndex,'
+    'textRun(content),pageBreak))))'
+)
+STRUCTURE_FIELDS = f'revisionId,{BODY_FIELDS}'
+
+# Keyed by pipeline step where one exists
+MASKS = {
+    'revision': 'revisionId',
+    'sections': STRUCTURE_FIELDS,
+    'breaks': STRUCTURE_FIELDS,
+    'page_breaks': STRUCTURE_FIELDS,
+    'headers': f'{STRUCTURE_FIELDS},documentStyle(defaultHeaderId,defaultFooterId),headers,footers',
+    'tags': f'{STRUCTURE_FIELDS},namedRanges',
+}
+
+def _merge(tree, key, sub):
+    # None means "the whole value", which absorbs any narrower selection
+    if key in tree and tree[key] is None:
+        return
+    if sub is None or key not in tree:
+        tree[key] = sub
+        return
+    for k, v in sub.items():
+        _merge(tree[key], k, v)
+
+def _parse(mask, pos):
+    tree = {}
+    while pos < len(mask):
+        end = pos
+        while end < len(mask) and mask[end] not in ',()':
+            end += 1
+        path = mask[pos:end].split('/')
+        if not all(path):
+            raise ValueError(f'Empty field name at {pos} in {mask!r}')
+        pos = end
+        sub = None
+        if pos < len(mask) and mask[pos] == '(':
+            sub, pos = _parse(mask, pos + 1)
+            if pos >= len(mask) or mask[pos] != ')':
+                raise ValueError(f'Unbalanced parentheses in {mask!r}')
+            pos += 1
+        # a/b/c(d) is shorthand for a(b(c(d)))
+        for part in reversed(path[1:]):
+            sub = {part: sub}
+        _merge(tree, path[0], sub)
+        if pos < len(mask) and mask[pos] == ',':
+            pos += 1
+            continue
+        break
+    return tree, pos
+
+def parse_fields(mask):
+    """Parse a partial-response mask into {field: subtree or None (everything)}."""
+    mask = ''.join(mask.split())
+    tree, pos = _parse(mask, 0)
+    if pos != len(mask):
+        raise ValueError(f'Unexpected {mask[pos]!r} at {pos} in {mask!r}')
+    return tree
+
+def format_fields(tree):
+    return ','.join(
+        key if sub is None else f'{key}({format_fields(sub)})'
+        for key, sub in tree.items()
+    )
+
+def combine(*masks):
+    """One mask selecting everything any of the given masks selects."""
+    tree = {}
+    for mask in masks:
+        for key, sub in parse_fields(mask).items():
+            _merge(tree, key, sub)
+    return format_fields(tree)
+
+def apply_fields(value, tree):
+    """Project a response onto a parsed mask, as the API does server-side."""
+    if tree is None or '*' in tree:
+        return value
+    if isinstance(value, list):
+        return [apply_fields(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {k: apply_fields(value[k], sub) for k, sub in tree.items() if k in value}
+
+def payload_stats(doc, repeat=3):
+    """(bytes, best parse seconds) for a response: JSON decode plus DocIndex."""
+    raw = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        DocIndex(json.loads(raw))
+        best = min(best, time.perf_counter() - start)
+    return len(raw), best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--doc-id', help='Google Doc ID to measure')
+    source.add_argument(
+        '--emulate', type=int, metavar='PARAGRAPHS',
+        help='Measure a generated document served by docs_emulator instead'
+    )
+    parser.add_argument(
+        '--operations', nargs='+', choices=sorted(MASKS), default=sorted(MASKS),
+        help='Masks to measure (default: all)'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='Parse timings (best is kept)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    doc_id = args.doc_id
+    if args.emulate is not None:
+        import docs_emulator
+        docs = docs_emulator.EmulatedDocsService()
+        doc_id = docs.add(docs_emulator.generate_document('emulated-doc', args.emulate)).doc_id
+        docs_emulator.install(docs=docs)
+    service = google_clients.get_service('docs', 'v1', SCOPES)
+    full_bytes, full_time = payload_stats(
+        service.documents().get(documentId=doc_id).execute(), args.repeat)
+    print(f'{"operation":<12} {"bytes":>12} {"of full":>8} {"parse ms":>10}')
+    print(f'{"(no mask)":<12} {full_bytes:>12} {"100.0%":>8} {full_time * 1000:>10.1f}')
+    for operation in args.operations:
+        doc = service.documents().get(documentId=doc_id, fields=MASKS[operation]).execute()
+        size, elapsed = payload_stats(doc, args.repeat)
+        print(f'{operation:<12} {size:>12} {size / full_bytes:>8.1%} {elapsed * 1000:>10.1f}')
+
+if __name__ == '__main__':
+    main()
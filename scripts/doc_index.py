@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Parse a Google Doc once into compact records shared by every script."""
+from bisect import bisect_right
+
+import profiling
+
+class Paragraph:
+    __slots__ = ('element', 'start', 'end', 'style', 'text')
+
+    def __init__(self, element, start, end, style, text):
+        self.element = element  # position in body.content
+        self.start = start
+        self.end = end
+        self.style = style
+        self.text = text
+
+class Heading:
+    __slots__ = ('level', 'element', 'start', 'end', 'text')
+
+    def __init__(self, level, element, start, end, text):
+        self.level = level
+        self.element = element
+        self.start = start
+        self.end = end
+        self.text = text
+
+class Section:
+    __slots__ = ('name', 'start', 'end', 'heading', 'first', 'stop')
+
+    def __init__(self, name, start, end, heading, first, stop):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.heading = heading
+        # body.content[first:stop] holds the section's structural elements
+        self.first = first
+        self.stop = stop
+
+class NamedRange:
+    __slots__ = ('name', 'range_id', 'start', 'end', 'segment_id')
+
+    def __init__(self, name, range_id, start, end, segment_id):
+        self.name = name
+        self.range_id = range_id
+        self.start = start
+        self.end = end
+        self.segment_id = segment_id
+
+class Table:
+    __slots__ = ('element', 'start', 'end', 'rows', 'columns')
+
+    def __init__(self, element, start, end, rows, columns):
+        self.element = element
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.columns = columns
+
+class SectionBreak:
+    __slots__ = ('element', 'start', 'end', 'header_id')
+
+    def __init__(self, element, start, end, header_id):
+        self.element = element
+        self.start = start
+        self.end = end
+        self.header_id = header_id
+
+def paragraph_text(paragraph):
+    return ''.join(
+        run.get('textRun', {}).get('content', '')
+        for run in paragraph.get('elements', [])
+    ).strip()
+
+def _ends_with_page_break(runs):
+    # A page break followed by nothing but whitespace up to the newline
+    for run in reversed(runs):
+        if 'pageBreak' in run:
+            return True
+        if run.get('textRun', {}).get('content', '').strip():
+            return False
+    return False
+
+class DocIndex:
+    """Single walk over body.content; H1 headings delimit sections."""
+
+    @profiling.timed('index scan')
+    def __init__(self, doc):
+        self.doc = doc
+        self.revision_id = doc.get('revisionId')
+        self.content = doc.get('body', {}).get('content', [])
+        self.paragraphs = []
+        self.headings = []
+        self.tables = []
+        self.breaks = []
+        # Where visible content begins, and which indices already sit right
+        # after a section or page break (blank paragraphs in between allowed)
+        self.content_start = None
+        self._breaks_by_end = {}
+        self._page_break_ends = set()
+        opening, paged = None, False
+        for i, el in enumerate(self.content):
+            para = el.get('paragraph')
+            if para is not None:
+                style = para.get('paragraphStyle', {}).get('namedStyleType', '')
+                start = el.get('startIndex')
+                text = paragraph_text(para)
+                self.paragraphs.append(
+                    Paragraph(i, start, el.get('endIndex'), style, text))
+                if style[8:].isdigit() and isinstance(start, int):
+                    self.headings.append(Heading(
+                        int(style[8:]), i, start, el.get('endIndex'), text))
+                runs = para.get('elements', [])
+                if opening is not None:
+                    self._breaks_by_end[start] = opening
+                if paged or (runs and 'pageBreak' in runs[0]):
+                    self._page_break_ends.add(start)
+                if text:
+                    if self.content_start is None:
+                        self.content_start = start
+                    opening, paged = None, _ends_with_page_break(runs)
+                else:
+                    paged = paged or _ends_with_page_break(runs)
+            elif 'table' in el:
+                table = el['table']
+                self.tables.append(Table(
+                    i, el.get('startIndex'), el.get('endIndex'),
+                    table.get('rows', 0), table.get('columns', 0)))
+                if self.content_start is None:
+                    self.content_start = el.get('startIndex')
+                opening, paged = None, False
+            elif 'sectionBreak' in el and isinstance(el.get('startIndex'), int):
+                # The implicit break opening the body has no startIndex
+                style = el['sectionBreak'].get('sectionStyle', {})
+                self.breaks.append(SectionBreak(
+                    i, el['startIndex'], el.get('endIndex'),
+                    style.get('defaultHeaderId')))
+                opening, paged = self.breaks[-1], False
+        self.end_index = self.content[-1].get('endIndex', 1) if self.content else 1
+        self.h1 = [h for h in self.headings if h.level == 1]
+        self.sections = []
+        for i, h in enumerate(self.h1):
+            nxt = self.h1[i + 1] if i + 1 < len(self.h1) else None
+            self.sections.append(Section(
+                h.text, h.start, nxt.start if nxt else self.end_index, h,
+                h.element, nxt.element if nxt else len(self.content)))
+        self._section_starts = [s.start for s in self.sections]
+        self._sections_by_start = {s.start: s for s in self.sections}
+        self.named_ranges = {}
+        for name, group in (doc.get('namedRanges') or {}).items():
+            self.named_ranges[name] = [
+                NamedRange(name, nr.get('namedRangeId'), r.get('startIndex'),
+                           r.get('endIndex'), r.get('segmentId'))
+                for nr in group.get('namedRanges', [])
+                for r in nr.get('ranges', [])
+            ]
+
+    @property
+    def insert_index(self):
+        # insertText index must be less than the body segment's endIndex
+        return max(self.end_index - 1, 1)
+
+    def section_at(self, index):
+        """Return the section containing a character index in O(log n), or None."""
+        i = bisect_right(self._section_starts, index) - 1
+        if i < 0 or index >= self.sections[i].end:
+            return None
+        return self.sections[i]
+
+    def tagged_section(self, name):
+        """Return the section a tag_sections named range marks, or None.
+
+        Tags start at their heading, so this is a dict lookup rather than a
+        walk over the document.
+        """
+        ranges = self.named_ranges.get(name)
+        if not ranges:
+            return None
+        start = ranges[0].start
+        return self._sections_by_start.get(start) or self.section_at(start)
+
+    def break_before(self, index):
+        """Return the section break right before index (blank lines aside), or None."""
+        return self._breaks_by_end.get(index)
+
+    def page_break_before(self, index):
+        """True if a page break already precedes index (blank lines aside)."""
+        return index in self._page_break_ends
+
+    def headings_at(self, level):
+        return [h for h in self.headings if h.level == level]
+
+def fetch_index(service, doc_id, fields=None):
+    # fields: a partial-response mask (see doc_fields.MASKS); None fetches everything
+    return DocIndex(service.documents().get(documentId=doc_id, fields=fields).execute())
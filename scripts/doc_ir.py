@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""Compact, lossless in-memory form of a Google Doc, with a binary snapshot format."""
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+from array import array
+
+import profiling
+
+MAGIC = b'DOIR'
+FORMAT_VERSION = 1
+# magic, format version, record count, then byte sizes of text, meta and payloads
+_HEADER = struct.Struct('<4sHIQII')
+# Column name and array typecode in file order
+COLUMNS = (('kind', 'B'), ('start', 'i'), ('end', 'i'), ('payload', 'I'),
+           ('size', 'I'), ('text_start', 'I'), ('text_end', 'I'))
+# Stored for an absent startIndex/endIndex (the implicit first section break)
+MISSING = -1
+
+# Node kinds: (name, key holding the children, category of the children).
+# Structural and inline elements wrap their node in a key named after the
+# kind ({'startIndex': 1, 'paragraph': {...}}); rows and cells do not.
+# Kind 0 keeps an element of any other shape verbatim.
+KINDS = (
+    ('raw', None, None),
+    ('paragraph', 'elements', 'inline'),
+    ('sectionBreak', None, None),
+    ('table', 'tableRows', 'row'),
+    ('tableOfContents', 'content', 'structural'),
+    ('tableRow', 'tableCells', 'cell'),
+    ('tableCell', 'content', 'structural'),
+    ('textRun', None, None),
+    ('autoText', None, None),
+    ('pageBreak', None, None),
+    ('columnBreak', None, None),
+    ('footnoteReference', None, None),
+    ('horizontalRule', None, None),
+    ('equation', None, None),
+    ('inlineObjectElement', None, None),
+    ('person', None, None),
+    ('richLink', None, None),
+)
+KIND_CODES = {name: code for code, (name, _, _) in enumerate(KINDS)}
+RAW = KIND_CODES['raw']
+PARAGRAPH = KIND_CODES['paragraph']
+TEXT_RUN = KIND_CODES['textRun']
+# Which wrapped kinds may appear where
+_CATEGORIES = {
+    'structural': {'paragraph', 'sectionBreak', 'table', 'tableOfContents'},
+    'inline': {'textRun', 'autoText', 'pageBreak', 'columnBreak', 'footnoteReference',
+               'horizontalRule', 'equation', 'inlineObjectElement', 'person', 'richLink'},
+}
+_BARE = {'row': 'tableRow', 'cell': 'tableCell'}
+# Document keys holding segments: body is one segment, the others map ID to one
+SEGMENT_KEYS = ('body', 'headers', 'footers', 'footnotes')
+_INDEX_KEYS = ('startIndex', 'endIndex')
+_encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+class Element:
+    """View of one IR record; children and text are read from the shared arrays."""
+    __slots__ = ('ir', 'i')
+
+    def __init__(self, ir, i):
+        self.ir = ir
+        self.i = i
+
+    @property
+    def kind(self):
+        return KINDS[self.ir.kind[self.i]][0]
+
+    @property
+    def start(self):
+        start = self.ir.start[self.i]
+        return None if start == MISSING else start
+
+    @property
+    def end(self):
+        end = self.ir.end[self.i]
+        return None if end == MISSING else end
+
+    @property
+    def payload(self):
+        return self.ir.payloads[self.ir.payload[self.i]]
+
+    @property
+    def text(self):
+        """Concatenated text run content of the subtree."""
+        return self.ir.text[self.ir.text_start[self.i]:self.ir.text_end[self.i]]
+
+    @property
+    def named_style(self):
+        return self.payload.get('paragraphStyle', {}).get('namedStyleType', '')
+
+    def children(self):
+        size = self.ir.size
+        j, stop = self.i + 1, self.i + size[self.i]
+        while j < stop:
+            yield Element(self.ir, j)
+            j += size[j]
+
+    def to_json(self):
+        return self.ir._node_json(self.i)
+
+class DocumentIR:
+    """Records for every node of a doc's segments, in document order.
+
+    segments lists [key, segment ID or None, segment dict minus content,
+    first record, end record] per segment; its top-level nodes are the
+    records from first to end, each followed by its subtree.
+    """
+
+    def __init__(self):
+        self.kind = array('B')
+        self.start = array('i')
+        self.end = array('i')
+        self.payload = array('I')
+        self.size = array('I')
+        self.text_start = array('I')
+        self.text_end = array('I')
+        self.text = ''
+        self.payloads = []
+        self.segments = []
+        # The response minus its segments
+        self.document = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def revision_id(self):
+        return self.document.get('revisionId')
+
+    # -- building -----------------------------------------------------------
+
+    @classmethod
+    @profiling.timed('snapshot build')
+    def from_json(cls, doc):
+        ir = cls()
+        builder = _Builder(ir)
+        ir.document = {k: v for k, v in doc.items() if k not in SEGMENT_KEYS}
+        for key in SEGMENT_KEYS:
+            value = doc.get(key)
+            if key not in doc:
+                continue
+            if key == 'body':
+                if not builder.segment(key, None, value):
+                    ir.document[key] = value
+                continue
+            if not isinstance(value, dict):
+                ir.document[key] = value
+                continue
+            raw = {}
+            for segment_id, segment in value.items():
+                if not builder.segment(key, segment_id, segment):
+                    raw[segment_id] = segment
+            if raw or not value:
+                ir.document[key] = raw
+        ir.text = ''.join(builder.text)
+        ir.payloads = builder.payloads
+        return ir
+
+    # -- reading ------------------------------------------------------------
+
+    def content(self, key='body', segment_id=None):
+        """Top-level elements of a segment (the body by default)."""
+        for seg_key, seg_id, _, first, stop in self.segments:
+            if seg_key == key and seg_id == segment_id:
+                size = self.size
+                i = first
+                while i < stop:
+                    yield Element(self, i)
+                    i += size[i]
+                return
+
+    def paragraphs(self, key='body', segment_id=None):
+        return (el for el in self.content(key, segment_id) if el.kind == 'paragraph')
+
+    def _node_json(self, i):
+        name, children_key, _ = KINDS[self.kind[i]]
+        payload = self.payloads[self.payload[i]]
+        if name == 'raw':
+            return payload
+        body = dict(payload)
+        if children_key in body:
+            size = self.size
+            children = []
+            j, stop = i + 1, i + size[i]
+            while j < stop:
+                children.append(self._node_json(j))
+                j += size[j]
+            body[children_key] = children
+        if name == 'textRun' and 'content' in body:
+            body['content'] = self.text[self.text_start[i]:self.text_end[i]]
+        node = {}
+        if self.start[i] != MISSING:
+            node['startIndex'] = self.start[i]
+        if self.end[i] != MISSING:
+            node['endIndex'] = self.end[i]
+        if name in ('tableRow', 'tableCell'):
+            node.update(body)
+        else:
+            node[name] = body
+        return node
+
+    def to_json(self):
+        """The documents.get response this IR was built from."""
+        doc = dict(self.document)
+        for key, segment_id, payload, first, stop in self.segments:
+            segment = dict(payload)
+            content = []
+            i = first
+            while i < stop:
+                content.append(self._node_json(i))
+                i += self.size[i]
+            segment['content'] = content
+            if key == 'body':
+                doc[key] = segment
+            else:
+                if doc.get(key) is self.document.get(key):
+                    # Copy rather than add to segments kept verbatim
+                    doc[key] = dict(doc.get(key) or {})
+                doc[key][segment_id] = segment
+        return doc
+
+    # -- snapshots ----------------------------------------------------------
+
+    @profiling.timed('snapshot save')
+    def save(self, path):
+        text = self.text.encode('utf-8')
+        meta = _encode({'document': self.document, 'segments': self.segments}).encode('utf-8')
+        payloads = _encode(self.payloads).encode('utf-8')
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(self), len(text),
+                                 len(meta), len(payloads)))
+            for column, _ in COLUMNS:
+                values = getattr(self, column)
+                if sys.byteorder != 'little':
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                f.write(values.tobytes())
+            f.write(text)
+            f.write(meta)
+            f.write(payloads)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    @profiling.timed('snapshot load')
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, count, text_size, meta_size, payload_size = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path}: not a format {FORMAT_VERSION} document snapshot')
+        ir = cls()
+        pos = _HEADER.size
+        for column, code in COLUMNS:
+            values = getattr(ir, column)
+            size = values.itemsize * count
+            values.frombytes(data[pos:pos + size])
+            if sys.byteorder != 'little':
+                values.byteswap()
+            pos += size
+        ir.text = data[pos:pos + text_size].decode('utf-8')
+        pos += text_size
+        meta = json.loads(data[pos:pos + meta_size])
+        pos += meta_size
+        ir.payloads = json.loads(data[pos:pos + payload_size])
+        ir.document = meta['document']
+        ir.segments = meta['segments']
+        return ir
+
+class _Builder:
+    """Appends nodes to an IR in document order, interning payloads."""
+
+    def __init__(self, ir):
+        self.ir = ir
+        self.text = []
+        self.length = 0
+        self.payloads = []
+        self._ids = {}
+
+    def _intern(self, payload):
+        key = _encode(payload)
+        code = self._ids.get(key)
+        if code is None:
+            code = self._ids[key] = len(self.payloads)
+            self.payloads.append(payload)
+        return code
+
+    def segment(self, key, segment_id, segment):
+        # Segments without a content list stay in the document verbatim
+        if not isinstance(segment, dict) or not isinstance(segment.get('content'), list):
+            return False
+        first = len(self.ir)
+        for element in segment['content']:
+            self.node(element, 'structural')
+        payload = {k: v for k, v in segment.items() if k != 'content'}
+        self.ir.segments.append([key, segment_id, payload, first, len(self.ir)])
+        return True
+
+    def _shape(self, element, category):
+        """(kind name, node dict) when element has a shape the IR can rebuild."""
+        if not isinstance(element, dict):
+            return None
+        for key in _INDEX_KEYS:
+            value = element.get(key, MISSING)
+            if type(value) is not int or (value < 0 and key in element):
+                return None
+        if category in _BARE:
+            return _BARE[category], {k: v for k, v in element.items() if k not in _INDEX_KEYS}
+        keys = [k for k in element if k not in _INDEX_KEYS]
+        if len(keys) != 1 or keys[0] not in _CATEGORIES[category]:
+            return None
+        node = element[keys[0]]
+        return (keys[0], node) if isinstance(node, dict) else None
+
+    def node(self, element, category):
+        ir = self.ir
+        i = len(ir)
+        name, node = self._shape(element, category) or ('raw', element)
+        code = KIND_CODES[name]
+        _, children_key, child_category = KINDS[code]
+        children = None
+        if code != RAW:
+            children = node.get(children_key) if children_key else None
+            if ((children_key in node and not isinstance(children, list))
+                    or (code == TEXT_RUN and not isinstance(node.get('content', ''), str))):
+                code, children = RAW, None
+        if code == RAW:
+            payload, start, end = element, MISSING, MISSING
+        else:
+            # Children and run text live in the arrays; their keys stay as
+            # placeholders so the rebuilt node has the same keys in order
+            payload = {
+                k: None if k == children_key or (code == TEXT_RUN and k == 'content') else v
+                for k, v in node.items()
+            }
+            start = element.get('startIndex', MISSING)
+            end = element.get('endIndex', MISSING)
+        ir.kind.append(code)
+        ir.start.append(start)
+        ir.end.append(end)
+        ir.payload.append(self._intern(payload))
+        ir.size.append(1)
+        ir.text_start.append(self.length)
+        ir.text_end.append(self.length)
+        if code == TEXT_RUN and node.get('content'):
+            self.text.append(node['content'])
+            self.length += len(node['content'])
+        for child in children or ():
+            self.node(child, child_category)
+        ir.size[i] = len(ir) - i
+        ir.text_end[i] = self.length
+
+def snapshot_stats(doc, path, repeat=3):
+    """Compare JSON with a snapshot of doc: sizes, best load times, round trip."""
+    raw = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+    start = time.perf_counter()
+    ir = DocumentIR.from_json(doc)
+    build = time.perf_counter() - start
+    ir.save(path)
+    json_time = load_time = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        json.loads(raw)
+        json_time = min(json_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        loaded = DocumentIR.load(path)
+        load_time = min(load_time, time.perf_counter() - start)
+    return {
+        'records': len(ir),
+        'payloads': len(ir.payloads),
+        'json_bytes': len(raw),
+        'snapshot_bytes': os.path.getsize(path),
+        'build': build,
+        'json_load': json_time,
+        'snapshot_load': load_time,
+        'round_trip': loaded.to_json() == doc,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--doc-id', help='Google Doc ID to snapshot')
+    source.add_argument(
+        '--emulate', type=int, metavar='PARAGRAPHS',
+        help='Snapshot a generated document served by docs_emulator instead'
+    )
+    source.add_argument('--load', metavar='SNAPSHOT', help='Summarize an existing snapshot')
+    parser.add_argument('--output', default='docs/doc.ir', help='Snapshot path to write')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    if args.load:
+        start = time.perf_counter()
+        ir = DocumentIR.load(args.load)
+        elapsed = time.perf_counter() - start
+        headings = sum(1 for p in ir.paragraphs() if p.named_style.startswith('HEADING_'))
+        print(f'{args.load}: revision {ir.revision_id}, {len(ir)} records, '
+              f'{len(ir.payloads)} distinct payloads, {len(ir.text)} characters, '
+              f'{headings} headings; loaded in {elapsed * 1000:.1f} ms')
+        return
+    import google_clients
+    doc_id = args.doc_id
+    if args.emulate is not None:
+        import docs_emulator
+        docs = docs_emulator.EmulatedDocsService()
+        doc_id = docs.add(docs_emulator.generate_document('emulated-doc', args.emulate)).doc_id
+        docs_emulator.install(docs=docs)
+    service = google_clients.get_service(
+        'docs', 'v1', ['https://www.googleapis.com/auth/documents.readonly'])
+    stats = snapshot_stats(service.documents().get(documentId=doc_id).execute(), args.output)
+    print(f'{args.output}: {stats["records"]} records, {stats["payloads"]} distinct payloads, '
+          f'{stats["snapshot_bytes"]} bytes ({stats["snapshot_bytes"] / stats["json_bytes"]:.1%} '
+          f'of JSON); built in {stats["build"] * 1000:.1f} ms')
+    print(f'load: JSON {stats["json_load"] * 1000:.1f} ms, snapshot '
+          f'{stats["snapshot_load"] * 1000:.1f} ms; round trip '
+          f'{"exact" if stats["round_trip"] else "MISMATCH"}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Stream a Google Doc as Markdown, one chunk per structural element."""
+import os
+
+import profiling
+
+HEADING_PREFIXES = {f'HEADING_{n}': '#' * n + ' ' for n in range(1, 7)}
+# Glyph types that render as numbered list items; everything else is a bullet
+ORDERED_GLYPHS = {
+    'DECIMAL', 'ZERO_DECIMAL', 'UPPER_ALPHA', 'ALPHA', 'UPPER_ROMAN', 'ROMAN'
+}
+SECTION_BREAK = '\n---\n\n'
+WRITE_BUFFER_SIZE = 1 << 16
+_PLAIN = (False, False, None)
+
+def _wrap(text, bold, italic, url):
+    core = text.strip()
+    if not core:
+        return text
+    # Keep surrounding whitespace outside the markers so emphasis still parses
+    lead = text[:len(text) - len(text.lstrip())]
+    trail = text[len(text.rstrip()):]
+    if bold and italic:
+        core = f'***{core}***'
+    elif bold:
+        core = f'**{core}**'
+    elif italic:
+        core = f'*{core}*'
+    if url:
+        core = f'[{core}]({url})'
+    return f'{lead}{core}{trail}'
+
+def _flush(buf, key):
+    text = buf[0] if len(buf) == 1 else ''.join(buf)
+    return text if key == _PLAIN else _wrap(text, *key)
+
+def render_inline(elements, emphasis=True):
+    # Merge adjacent runs with the same style so we emit **ab** not **a****b**
+    parts = []
+    buf = []
+    key = _PLAIN
+    for el in elements:
+        run = el.get('textRun')
+        if run is None:
+            continue
+        content = run.get('content', '')
+        if content[-1:] == '\n':
+            content = content.rstrip('\n')
+            if not content:
+                continue
+        style = run.get('textStyle')
+        if style:
+            link = style.get('link')
+            run_key = (
+                emphasis and style.get('bold', False),
+                emphasis and style.get('italic', False),
+                link.get('url') if link else None,
+            )
+        else:
+            run_key = _PLAIN
+        if run_key != key:
+            if buf:
+                parts.append(_flush(buf, key))
+                buf = []
+            key = run_key
+        buf.append(content)
+    if buf:
+        parts.append(_flush(buf, key))
+    return parts[0] if len(parts) == 1 else ''.join(parts)
+
+def _is_ordered(bullet, lists):
+    levels = (lists.get(bullet.get('listId'), {})
+              .get('listProperties', {}).get('nestingLevels', []))
+    level = bullet.get('nestingLevel', 0)
+    if level < len(levels):
+        return levels[level].get('glyphType') in ORDERED_GLYPHS
+    return False
+
+def render_paragraph(paragraph, lists):
+    style = paragraph.get('paragraphStyle', {}).get('namedStyleType', '')
+    elements = paragraph.get('elements', [])
+    prefix = HEADING_PREFIXES.get(style)
+    if prefix:
+        # Headings are bold by style; only links are carried over
+        return f'{prefix}{render_inline(elements, emphasis=False)}\n\n'
+    text = render_inline(elements)
+    bullet = paragraph.get('bullet')
+    if bullet is not None:
+        indent = '  ' * bullet.get('nestingLevel', 0)
+        marker = '1. ' if _is_ordered(bullet, lists) else '- '
+        return f'{indent}{marker}{text}\n'
+    return f'{text}\n'
+
+def render_table(table):
+    rows = []
+    for row in table.get('tableRows', []):
+        cells = []
+        for cell in row.get('tableCells', []):
+            texts = [
+                render_inline(el['paragraph'].get('elements', []))
+                for el in cell.get('content', []) if 'paragraph' in el
+            ]
+            cells.append('<br>'.join(t for t in texts if t).replace('|', '\\|'))
+        rows.append(cells)
+    if not rows:
+        return ''
+    width = max(len(r) for r in rows)
+    lines = ['| ' + ' | '.join(r + [''] * (width - len(r))) + ' |\n' for r in rows]
+    lines.insert(1, '|' + ' --- |' * width + '\n')
+    return '\n' + ''.join(lines) + '\n'
+
+def iter_elements(content, lists=None):
+    lists = lists or {}
+    for element in content:
+        if 'paragraph' in element:
+            yield render_paragraph(element['paragraph'], lists)
+        elif 'table' in element:
+            chunk = render_table(element['table'])
+            if chunk:
+                yield chunk
+        elif 'sectionBreak' in element and element.get('startIndex'):
+            # The implicit break that opens every body has no startIndex
+            yield SECTION_BREAK
+
+def iter_markdown(doc):
+    return iter_elements(
+        doc.get('body', {}).get('content', []), doc.get('lists', {}))
+
+@profiling.timed('markdown write')
+def write_chunks(chunks, output_path):
+    """Stream chunks to output_path through a buffered writer; returns chars written."""
+    dirname = os.path.dirname(output_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    written = 0
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    os.replace(tmp_path, output_path)
+    return written
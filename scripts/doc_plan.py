@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Plan Docs edits against an in-memory model and send them in as few batchUpdates as possible."""
+import json
+from bisect import bisect_right
+from collections import Counter
+
+from batch_executor import MAX_REQUESTS_PER_BATCH, BatchExecutor
+# insertSectionBreak adds a newline followed by the break element
+SECTION_BREAK_LENGTH = 2
+# insertPageBreak adds the break followed by a newline
+PAGE_BREAK_LENGTH = 2
+
+def utf16_len(text):
+    # Length in Docs index units, e.g. 2 for an emoji
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+class IndexShifter:
+    """Map indices of the planned-against document to indices after planned inserts."""
+
+    def __init__(self):
+        self._positions = []
+        self._lengths = []
+        self._prefix = None
+
+    def insert(self, at, length):
+        i = bisect_right(self._positions, at)
+        self._positions.insert(i, at)
+        self._lengths.insert(i, length)
+        self._prefix = None
+
+    def position(self, index):
+        # Content at or after an insert point moves right by the inserted length
+        if self._prefix is None:
+            total = 0
+            self._prefix = []
+            for length in self._lengths:
+                total += length
+                self._prefix.append(total)
+        i = bisect_right(self._positions, index)
+        return index + (self._prefix[i - 1] if i else 0)
+
+class PlannedHeading:
+    __slots__ = ('start', 'end', 'text', 'planned')
+
+    def __init__(self, start, end, text, planned=False):
+        self.start = start
+        self.end = end
+        self.text = text
+        # True for headings this plan adds; their indices are post-insert
+        self.planned = planned
+
+class Plan:
+    """Ordered requests plus the H1 headings they target.
+
+    Requests are written in the coordinates the document will have when they
+    are applied. Appended sections extend ``h1``; inserts recorded on
+    ``shifter`` (section breaks) are folded in through ``position``.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.revision_id = index.revision_id
+        self.end_index = index.insert_index
+        self.h1 = [PlannedHeading(h.start, h.end, h.text) for h in index.h1]
+        self.shifter = IndexShifter()
+        # Heading starts that get a planned section break in front of them
+        self.breaks = set()
+        self.requests = []
+        self._callbacks = {}
+        # Requests the reply callbacks are expected to add
+        self.follow_ups = 0
+        self.batches = 0
+        self.sent = 0
+
+    def add(self, request, on_reply=None, follow_ups=0):
+        """Queue a request; on_reply(reply) may return follow-up requests.
+
+        follow_ups is how many on_reply is expected to return, for cost().
+        """
+        if on_reply is not None:
+            self._callbacks[len(self.requests)] = on_reply
+        self.requests.append(request)
+        self.follow_ups += follow_ups
+
+    def cost(self):
+        """Estimated cost of execute(): requests by type, calls and payload bytes."""
+        kinds = Counter(next(iter(request)) for request in self.requests)
+        calls = -(-len(self.requests) // MAX_REQUESTS_PER_BATCH)
+        calls += -(-self.follow_ups // MAX_REQUESTS_PER_BATCH)
+        size = len(json.dumps(self.requests, separators=(',', ':')))
+        return {'requests': dict(kinds), 'follow_ups': self.follow_ups,
+                'calls': calls, 'bytes': size}
+
+    def format_cost(self):
+        cost = self.cost()
+        kinds = ', '.join(f'{n} {kind}' for kind, n in sorted(cost['requests'].items()))
+        return (f'{len(self.requests)} request(s) ({kinds or "none"}) '
+                f'+ {cost["follow_ups"]} follow-up(s), {cost["calls"]} batchUpdate '
+                f'call(s), {cost["bytes"]} bytes')
+
+    def print_dry_run(self):
+        print(json.dumps(self.requests, indent=2))
+        print(f'Planned {self.format_cost()}.')
+
+    def position(self, index):
+        return self.shifter.position(index)
+
+    def heading_range(self, heading):
+        # Map the last character rather than the end so an insert at the
+        # next heading does not stretch this range
+        return self.position(heading.start), self.position(heading.end - 1) + 1
+
+    def break_location(self, heading):
+        """Index of the section break opening heading's section, or None."""
+        if heading.start in self.breaks:
+            return self.position(heading.start) - 1
+        existing = self.index.break_before(heading.start)
+        return self.position(existing.start) if existing else None
+
+    def _send(self, executor, doc_id, requests):
+        calls = executor.metrics.calls
+        replies = executor.run(doc_id, requests, self.revision_id)
+        self.batches += executor.metrics.calls - calls
+        self.sent += len(requests)
+        self.revision_id = executor.revision(doc_id) or self.revision_id
+        return replies
+
+    def execute(self, service, doc_id, executor=None):
+        """Send all rounds; returns the replies of the first round."""
+        executor = executor or BatchExecutor(service)
+        pending, callbacks = self.requests, self._callbacks
+        first = None
+        while pending:
+            replies = self._send(executor, doc_id, pending)
+            if first is None:
+                first = replies
+            follow_ups = []
+            for i, on_reply in sorted(callbacks.items()):
+                reply = replies[i] if i < len(replies) else {}
+                follow_ups.extend(on_reply(reply or {}))
+            pending, callbacks = follow_ups, {}
+        return first or []
@@ -0,0 +1,744 @@
+#!/usr/bin/env python3
+"""In-memory stand-in for the Docs v1, Drive Activity v2 and Drive v3 watch APIs."""
+import time
+import uuid
+import zlib
+import random
+import argparse
+import itertools
+import threading
+import urllib.request
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+
+from doc_fields import apply_fields, parse_fields
+import google_clients
+import profiling
+
+BLOCK_SIZE = 128
+# Stands in for a pageBreak element inside a paragraph's text
+PAGE_BREAK = '\ue000'
+NORMAL_TEXT = 'NORMAL_TEXT'
+# Page setup and style sheet the real API returns with every full fetch
+_DIMENSION = {'magnitude': 72, 'unit': 'PT'}
+_DOCUMENT_STYLE = {
+    'background': {'color': {}},
+    'pageNumberStart': 1,
+    'marginTop': _DIMENSION, 'marginBottom': _DIMENSION,
+    'marginRight': _DIMENSION, 'marginLeft': _DIMENSION,
+    'pageSize': {'height': {'magnitude': 792, 'unit': 'PT'},
+                 'width': {'magnitude': 612, 'unit': 'PT'}},
+    'marginHeader': {'magnitude': 36, 'unit': 'PT'},
+    'marginFooter': {'magnitude': 36, 'unit': 'PT'},
+}
+_NAMED_STYLES = {'styles': [
+    {
+        'namedStyleType': name,
+        'textStyle': {
+            'bold': False, 'italic': False, 'underline': False,
+            'fontSize': {'magnitude': size, 'unit': 'PT'},
+            'weightedFontFamily': {'fontFamily': 'Arial', 'weight': 400},
+            'foregroundColor': {'color': {'rgbColor': {}}},
+        },
+        'paragraphStyle': {
+            'namedStyleType': name, 'alignment': 'START', 'lineSpacing': 115,
+            'direction': 'LEFT_TO_RIGHT', 'spacingMode': 'COLLAPSE_LISTS',
+            'spaceAbove': {'unit': 'PT'}, 'spaceBelow': {'unit': 'PT'},
+            'keepLinesTogether': False, 'keepWithNext': False, 'avoidWidowAndOrphan': True,
+        },
+    }
+    for name, size in (('NORMAL_TEXT', 11), ('TITLE', 26), ('SUBTITLE', 15),
+                       ('HEADING_1', 20), ('HEADING_2', 16), ('HEADING_3', 14),
+                       ('HEADING_4', 12), ('HEADING_5', 11), ('HEADING_6', 11))
+]}
+# Top-level scalars of a Document and the EmulatedDocument attributes behind them
+_METADATA = {'documentId': 'doc_id', 'title': 'title', 'revisionId': 'revision_id'}
+
+class EmulatorResponse(dict):
+    """httplib2-style response: headers as dict items plus a status attribute."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+class EmulatorError(Exception):
+    """Raised like googleapiclient.errors.HttpError; `resp.status` holds the code."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f'HTTP {status}: {message}')
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.resp = EmulatorResponse(status, headers)
+        self.message = message
+
+def _utf16_len(text):
+    # Docs indices count UTF-16 code units: characters outside the BMP take two
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+def _offset(text, units):
+    """Position in text of an offset of `units` UTF-16 code units."""
+    if text.isascii():
+        return units
+    pos = 0
+    for i, ch in enumerate(text):
+        if pos >= units:
+            break
+        pos += 2 if ch > '\uffff' else 1
+    else:
+        i = len(text)
+    if pos != units:
+        raise EmulatorError(400, f'Index {units} splits a surrogate pair')
+    return i
+
+def _length(element):
+    kind, text, _, _ = element
+    return _utf16_len(text) if kind == 'p' else 1
+
+class EmulatedDocument:
+    """One document: body elements in blocks, plus headers, footers and named ranges.
+
+    Elements are immutable tuples (kind, text, style, header_id) where kind is
+    'p' for a paragraph (text includes its trailing newline) or 'sb' for a
+    section break. Edits replace tuples, so a batch can be rolled back by
+    keeping the previous block lists.
+    """
+
+    def __init__(self, doc_id, title='Untitled document'):
+        self.doc_id = doc_id
+        self.title = title
+        self.revision = 1
+        self.headers = {}
+        self.footers = {}
+        self.document_style = {}
+        # namedRangeId -> [name, start, end]
+        self.named_ranges = {}
+        self._ids = itertools.count(1)
+        self._set_elements([('sb', '', None, None), ('p', '\n', NORMAL_TEXT, None)])
+
+    @classmethod
+    def from_paragraphs(cls, doc_id, paragraphs, title='Untitled document'):
+        """Build a document from (text, namedStyleType) pairs, texts without newlines."""
+        doc = cls(doc_id, title)
+        elements = [('sb', '', None, None)]
+        elements.extend(('p', text + '\n', style, None) for text, style in paragraphs)
+        if len(elements) == 1:
+            elements.append(('p', '\n', NORMAL_TEXT, None))
+        doc._set_elements(elements)
+        return doc
+
+    @property
+    def revision_id(self):
+        return f'{self.doc_id}-r{self.revision}'
+
+    @property
+    def end_index(self):
+        return sum(self._lengths)
+
+    def _set_elements(self, elements):
+        self._blocks = [elements[i:i + BLOCK_SIZE] for i in range(0, len(elements), BLOCK_SIZE)]
+        self._lengths = [sum(map(_length, block)) for block in self._blocks]
+
+    def elements(self):
+        """Yield (startIndex, element) over the body."""
+        pos = 0
+        for block in self._blocks:
+            for el in block:
+                yield pos, el
+                pos += _length(el)
+
+    def _locate(self, index):
+        # (block, position in block, element start) of the element holding index
+        pos = 0
+        for b, total in enumerate(self._lengths):
+            if index < pos + total:
+                for e, el in enumerate(self._blocks[b]):
+                    n = _length(el)
+                    if index < pos + n:
+                        return b, e, pos
+                    pos += n
+            pos += total
+        raise EmulatorError(400, f'Index {index} must be less than the end index {pos}')
+
+    def _paragraph_at(self, index):
+        b, e, start = self._locate(index)
+        el = self._blocks[b][e]
+        if el[0] != 'p':
+            raise EmulatorError(400, f'Index {index} is not inside a paragraph')
+        return b, e, start, el
+
+    def _replace(self, b, e, count, elements):
+        # Swap `count` elements starting at (b, e) for `elements`, across blocks
+        block = self._blocks[b]
+        taken = len(block[e:e + count])
+        del block[e:e + count]
+        last = b
+        while taken < count:
+            last += 1
+            following = self._blocks[last]
+            n = min(len(following), count - taken)
+            del following[:n]
+            taken += n
+            self._lengths[last] = sum(map(_length, following))
+        block[e:e] = elements
+        self._lengths[b] = sum(map(_length, block))
+        for i in range(last, b, -1):
+            if not self._blocks[i]:
+                del self._blocks[i]
+                del self._lengths[i]
+        if len(block) > 2 * BLOCK_SIZE:
+            parts = [block[i:i + BLOCK_SIZE] for i in range(0, len(block), BLOCK_SIZE)]
+            self._blocks[b:b + 1] = parts
+            self._lengths[b:b + 1] = [sum(map(_length, part)) for part in parts]
+        elif not block:
+            del self._blocks[b]
+            del self._lengths[b]
+
+    def _shift_ranges(self, at, length):
+        for rng in self.named_ranges.values():
+            if rng[1] >= at:
+                rng[1] += length
+            if rng[2] > at:
+                rng[2] += length
+
+    def _collapse_ranges(self, start, end):
+        n = end - start
+        for rng in self.named_ranges.values():
+            for i in (1, 2):
+                if rng[i] >= end:
+                    rng[i] -= n
+                elif rng[i] > start:
+                    rng[i] = start
+
+    # -- body edits ---------------------------------------------------------
+
+    def insert_text(self, index, text, segment_id=None):
+        if segment_id:
+            return self._edit_segment(segment_id, index, index, text)
+        b, e, start, (_, old, style, _) = self._paragraph_at(index)
+        offset = _offset(old, index - start)
+        merged = old[:offset] + text + old[offset:]
+        parts = merged.split('\n')[:-1]
+        self._replace(b, e, 1, [('p', part + '\n', style, None) for part in parts])
+        self._shift_ranges(index, _utf16_len(text))
+
+    def insert_section_break(self, index):
+        b, e, start, (_, old, style, _) = self._paragraph_at(index)
+        offset = _offset(old, index - start)
+        self._replace(b, e, 1, [
+            ('p', old[:offset] + '\n', style if offset else NORMAL_TEXT, None),
+            ('sb', '', None, None),
+            ('p', old[offset:], style, None),
+        ])
+        self._shift_ranges(index, 2)
+
+    def insert_page_break(self, index):
+        b, e, start, (_, old, style, _) = self._paragraph_at(index)
+        offset = _offset(old, index - start)
+        self._replace(b, e, 1, [
+            ('p', old[:offset] + PAGE_BREAK + '\n', style if offset else NORMAL_TEXT, None),
+            ('p', old[offset:], style, None),
+        ])
+        self._shift_ranges(index, 2)
+
+    def delete_range(self, start, end, segment_id=None):
+        if segment_id:
+            return self._edit_segment(segment_id, start, end, '')
+        if not 0 < start < end < self.end_index:
+            raise EmulatorError(400, f'Invalid deletion range {start}-{end}')
+        # Walk from the element holding start to the one holding end; the
+        # survivor joins the head before start with the tail from end on
+        b, e, pos = self._locate(start)
+        taken = []
+        blk, i = b, e
+        while True:
+            el = self._blocks[blk][i]
+            taken.append((pos, el))
+            if pos + _length(el) > end:
+                break
+            pos += _length(el)
+            i += 1
+            if i == len(self._blocks[blk]):
+                blk, i = blk + 1, 0
+        (head_start, head), (tail_start, tail) = taken[0], taken[-1]
+        if head[0] != 'p' or tail[0] != 'p':
+            raise EmulatorError(400, 'Deletion must start and end inside paragraphs')
+        text = (head[1][:_offset(head[1], start - head_start)]
+                + tail[1][_offset(tail[1], end - tail_start):])
+        style = head[2] if start > head_start else tail[2]
+        self._replace(b, e, len(taken), [('p', text, style, None)])
+        self._collapse_ranges(start, end)
+
+    def update_paragraph_style(self, start, end, style, fields):
+        if fields != '*' and 'namedStyleType' not in fields.split(','):
+            return
+        named = style.get('namedStyleType', NORMAL_TEXT)
+        b, e, pos = self._locate(start)
+        while b < len(self._blocks) and pos < end:
+            block = self._blocks[b]
+            while e < len(block) and pos < end:
+                el = block[e]
+                if el[0] == 'p':
+                    block[e] = ('p', el[1], named, el[3])
+                pos += _length(el)
+                e += 1
+            b, e = b + 1, 0
+
+    def _edit_segment(self, segment_id, start, end, text):
+        segments = self.headers if segment_id in self.headers else self.footers
+        if segment_id not in segments:
+            raise EmulatorError(400, f'Unknown segment {segment_id}')
+        old = segments[segment_id]
+        if not 0 <= start <= end < _utf16_len(old):
+            raise EmulatorError(400, f'Invalid range {start}-{end} in segment {segment_id}')
+        segments[segment_id] = old[:_offset(old, start)] + text + old[_offset(old, end):]
+
+    # -- structure ----------------------------------------------------------
+
+    def create_segment(self, kind, location=None):
+        segment_id = f'kix.{kind}{next(self._ids)}'
+        default = f'default{kind.capitalize()}Id'
+        segments = self.headers if kind == 'header' else self.footers
+        if location is None:
+            if default in self.document_style:
+                raise EmulatorError(400, f'A default {kind} already exists')
+            self.document_style[default] = segment_id
+        else:
+            b, e, _ = self._locate(location)
+            el = self._blocks[b][e]
+            if el[0] != 'sb':
+                raise EmulatorError(400, f'No section break at index {location}')
+            if kind == 'header':
+                if el[3]:
+                    raise EmulatorError(400, f'Section at {location} already has a header')
+                self._blocks[b][e] = ('sb', '', None, segment_id)
+        segments[segment_id] = '\n'
+        return segment_id
+
+    def create_named_range(self, name, start, end):
+        if not 0 <= start < end <= self.end_index:
+            raise EmulatorError(400, f'Invalid named range {start}-{end}')
+        range_id = f'kix.nr{next(self._ids)}'
+        self.named_ranges[range_id] = [name, start, end]
+        return range_id
+
+    def delete_named_range(self, range_id=None, name=None):
+        for key in [k for k, rng in self.named_ranges.items()
+                    if k == range_id or (name is not None and rng[0] == name)]:
+            del self.named_ranges[key]
+
+    # -- batchUpdate --------------------------------------------------------
+
+    def _snapshot(self):
+        return ([list(b) for b in self._blocks], list(self._lengths), dict(self.headers),
+                dict(self.footers), dict(self.document_style),
+                {k: list(v) for k, v in self.named_ranges.items()})
+
+    def _restore(self, snapshot):
+        (self._blocks, self._lengths, self.headers, self.footers,
+         self.document_style, self.named_ranges) = snapshot
+
+    def apply(self, request):
+        """Apply one request and return its reply."""
+        (kind, body), = request.items()
+        location = body.get('location') or {}
+        rng = body.get('range') or {}
+        if kind == 'insertText':
+            self.insert_text(location['index'], body['text'], location.get('segmentId'))
+        elif kind == 'insertSectionBreak':
+            self.insert_section_break(location['index'])
+        elif kind == 'insertPageBreak':
+            self.insert_page_break(location['index'])
+        elif kind == 'deleteContentRange':
+            self.delete_range(rng['startIndex'], rng['endIndex'], rng.get('segmentId'))
+        elif kind == 'updateParagraphStyle':
+            self.update_paragraph_style(
+                rng['startIndex'], rng['endIndex'], body.get('paragraphStyle', {}),
+                body.get('fields', ''))
+        elif kind in ('createHeader', 'createFooter'):
+            segment = 'header' if kind == 'createHeader' else 'footer'
+            at = (body.get('sectionBreakLocation') or {}).get('index')
+            return {kind: {f'{segment}Id': self.create_segment(segment, at)}}
+        elif kind == 'createNamedRange':
+            range_id = self.create_named_range(body['name'], rng['startIndex'], rng['endIndex'])
+            return {kind: {'namedRangeId': range_id}}
+        elif kind == 'deleteNamedRange':
+            self.delete_named_range(body.get('namedRangeId'), body.get('name'))
+        else:
+            raise EmulatorError(400, f'Unsupported request {kind}')
+        return {}
+
+    def batch_update(self, body):
+        # All-or-nothing, like the real API
+        required = (body.get('writeControl') or {}).get('requiredRevisionId')
+        if required and required != self.revision_id:
+            raise EmulatorError(400, f'The required revision ID {required} does not '
+                                     f'match the latest revision {self.revision_id}')
+        snapshot = self._snapshot()
+        try:
+            replies = [self.apply(request) for request in body.get('requests', [])]
+        except (KeyError, ValueError) as exc:
+            self._restore(snapshot)
+            raise EmulatorError(400, f'Invalid request: {exc}') from exc
+        except EmulatorError:
+            self._restore(snapshot)
+            raise
+        if replies:
+            self.revision += 1
+        return {
+            'documentId': self.doc_id,
+            'replies': replies,
+            'writeControl': {'requiredRevisionId': self.revision_id},
+        }
+
+    # -- documents.get ------------------------------------------------------
+
+    def _paragraph_json(self, start, text, style):
+        paragraph_style = {'namedStyleType': style, 'direction': 'LEFT_TO_RIGHT'}
+        if style.startswith('HEADING_'):
+            # Stable across edits elsewhere, like the real IDs
+            paragraph_style['headingId'] = f'h.{zlib.crc32(text.encode("utf-8")):08x}'
+        runs = []
+        pos = start
+        for i, piece in enumerate(text.split(PAGE_BREAK)):
+            if i:
+                runs.append({'startIndex': pos, 'endIndex': pos + 1, 'pageBreak': {}})
+                pos += 1
+            if piece:
+                n = _utf16_len(piece)
+                runs.append({'startIndex': pos, 'endIndex': pos + n,
+                             'textRun': {'content': piece, 'textStyle': {}}})
+                pos += n
+        return {
+            'startIndex': start,
+            'endIndex': pos,
+            'paragraph': {'elements': runs, 'paragraphStyle': paragraph_style},
+        }
+
+    def _segment_json(self, key, segment_id, text):
+        return {key: segment_id, 'content': [self._paragraph_json(0, text, NORMAL_TEXT)]}
+
+    def to_json(self):
+        content = []
+        for start, (kind, text, style, header_id) in self.elements():
+            if kind == 'p':
+                content.append(self._paragraph_json(start, text, style))
+                continue
+            section_style = {'sectionType': 'NEXT_PAGE' if start else 'CONTINUOUS'}
+            if header_id:
+                section_style['defaultHeaderId'] = header_id
+            element = {'endIndex': start + 1, 'sectionBreak': {'sectionStyle': section_style}}
+            if start:
+                # Like the real API, the break opening the body has no startIndex
+                element['startIndex'] = start
+            content.append(element)
+        named = {}
+        for range_id, (name, start, end) in self.named_ranges.items():
+            group = named.setdefault(name, {'name': name, 'namedRanges': []})
+            group['namedRanges'].append({
+                'namedRangeId': range_id, 'name': name,
+                'ranges': [{'startIndex': start, 'endIndex': end}],
+            })
+        return {
+            'documentId': self.doc_id,
+            'title': self.title,
+            'revisionId': self.revision_id,
+            'body': {'content': content},
+            'headers': {k: self._segment_json('headerId', k, v) for k, v in self.headers.items()},
+            'footers': {k: self._segment_json('footerId', k, v) for k, v in self.footers.items()},
+            'documentStyle': dict(_DOCUMENT_STYLE, **self.document_style),
+            'namedStyles': _NAMED_STYLES,
+            'namedRanges': named,
+            'suggestionsViewMode': 'SUGGESTIONS_INLINE',
+        }
+
+class _Call:
+    """What service.<resource>().<method>(...) returns; runs on execute()."""
+
+    def __init__(self, service, name, fn):
+        self.service = service
+        self.name = name
+        self.fn = fn
+
+    def execute(self, num_retries=0):
+        if not profiling.active():
+            self.service._before(self.name)
+            return self.fn()
+        # Counted like google_clients counts real calls, so traces compare
+        profiling.count('api.calls')
+        profiling.count(f'api.{self.name}')
+        with profiling.span(f'api {self.name}'):
+            self.service._before(self.name)
+            return self.fn()
+
+class _EmulatedService:
+    """Call counting, injected latency and injected errors shared by both APIs."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_statuses=(429, 503), seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._failures = deque()
+        self._lock = threading.Lock()
+
+    def fail_next(self, status, count=1, retry_after=None):
+        """Make the next `count` calls raise EmulatorError(status)."""
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def _before(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            failure = self._failures.popleft() if self._failures else None
+            if failure is None and self.error_rate and self._random.random() < self.error_rate:
+                failure = (self._random.choice(self.error_statuses), None)
+        if self.latency:
+            time.sleep(self.latency)
+        if failure:
+            status, wait = failure
+            raise EmulatorError(status, f'Injected failure for {name}', wait)
+
+class _Documents:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, documentId, fields=None, **kwargs):
+        doc = self._service.document(documentId)
+
+        def run():
+            tree = parse_fields(fields) if fields else None
+            with self._service._lock:
+                if tree is not None and set(tree) <= set(_METADATA):
+                    # Metadata-only masks (revision polling) skip building the body
+                    resp = {key: getattr(doc, attr) for key, attr in _METADATA.items()}
+                else:
+                    resp = doc.to_json()
+            return apply_fields(resp, tree) if tree is not None else resp
+        return _Call(self._service, 'documents.get', run)
+
+    def batchUpdate(self, documentId, body, **kwargs):
+        doc = self._service.document(documentId)
+
+        def run():
+            with self._service._lock:
+                resp = doc.batch_update(body)
+                self._service.requests += len(body.get('requests', []))
+            for callback in list(self._service.listeners):
+                callback(documentId)
+            return resp
+        return _Call(self._service, 'documents.batchUpdate', run)
+
+class EmulatedDocsService(_EmulatedService):
+    """Serves documents().get() and documents().batchUpdate() from memory."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.docs = {}
+        self.requests = 0
+        # Called with the doc ID after every successful batchUpdate
+        self.listeners = []
+
+    def add(self, document):
+        self.docs[document.doc_id] = document
+        return document
+
+    def document(self, doc_id):
+        if doc_id not in self.docs:
+            raise EmulatorError(404, f'Requested entity was not found: {doc_id}')
+        return self.docs[doc_id]
+
+    def documents(self):
+        return _Documents(self)
+
+class _Activity:
+    def __init__(self, service):
+        self._service = service
+
+    def query(self, body):
+        return _Call(self._service, 'activity.query', lambda: self._service.query(body))
+
+class EmulatedActivityService(_EmulatedService):
+    """Serves activity().query() with newest-first pages and `time >` filters."""
+
+    def __init__(self, page_size=100, **kwargs):
+        super().__init__(**kwargs)
+        self.page_size = page_size
+        # doc_id -> activities, oldest first
+        self.activities = {}
+
+    def add(self, doc_id, activities):
+        self.activities.setdefault(doc_id, []).extend(activities)
+
+    def query(self, body):
+        doc_id = body.get('itemName', '').split('/', 1)[-1]
+        found = self.activities.get(doc_id, [])
+        since = body.get('filter', '')
+        if since.startswith('time > '):
+            since = since[len('time > '):].strip('"')
+            found = [a for a in found if a['timestamp'] > since]
+        found = found[::-1]
+        size = min(body.get('pageSize') or self.page_size, self.page_size)
+        offset = int(body.get('pageToken') or 0)
+        response = {'activities': found[offset:offset + size]}
+        if offset + size < len(found):
+            response['nextPageToken'] = str(offset + size)
+        return response
+
+    def activity(self):
+        return _Activity(self)
+
+class _Files:
+    def __init__(self, service):
+        self._service = service
+
+    def watch(self, fileId, body, **kwargs):
+        return _Call(self._service, 'files.watch', lambda: self._service.watch(fileId, body))
+
+class _Channels:
+    def __init__(self, service):
+        self._service = service
+
+    def stop(self, body, **kwargs):
+        return _Call(self._service, 'channels.stop', lambda: self._service.stop(body))
+
+class EmulatedDriveService(_EmulatedService):
+    """Serves files().watch() and channels().stop() for documents in a docs service.
+
+    Notifications are delivered on a background thread, like Drive's, with
+    the X-Goog-Channel-* and X-Goog-Resource-* headers and an empty body.
+    """
+
+    def __init__(self, docs, timeout=5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.docs = docs
+        self.timeout = timeout
+        # channel id -> channel resource plus address and message counter
+        self.watches = {}
+        self.delivered = Counter()
+        docs.listeners.append(self.changed)
+
+    def watch(self, file_id, body):
+        self.docs.document(file_id)
+        if body.get('type') != 'web_hook' or not body.get('address'):
+            raise EmulatorError(400, 'Only web_hook channels with an address are supported')
+        channel = {
+            'kind': 'api#channel',
+            'id': body['id'],
+            'resourceId': uuid.uuid5(uuid.NAMESPACE_URL, file_id).hex,
+            'resourceUri': f'https://www.googleapis.com/drive/v3/files/{file_id}',
+            'token': body.get('token'),
+            'expiration': str(body.get('expiration') or int((time.time() + 3600) * 1000)),
+        }
+        with self._lock:
+            self.watches[body['id']] = dict(
+                channel, fileId=file_id, address=body['address'], messages=itertools.count(1))
+        # Drive confirms every new channel with a "sync" message
+        self._deliver(self.watches[body['id']], 'sync')
+        return channel
+
+    def stop(self, body):
+        with self._lock:
+            channel = self.watches.get(body.get('id'))
+            if channel is None or channel['resourceId'] != body.get('resourceId'):
+                raise EmulatorError(404, f'Channel not found: {body.get("id")}')
+            del self.watches[body['id']]
+        return {}
+
+    def changed(self, file_id):
+        now = str(int(time.time() * 1000))
+        with self._lock:
+            targets = [c for c in self.watches.values()
+                       if c['fileId'] == file_id and c['expiration'] > now]
+        for channel in targets:
+            self._deliver(channel, 'update')
+
+    def _deliver(self, channel, state):
+        headers = {
+            'X-Goog-Channel-ID': channel['id'],
+            'X-Goog-Channel-Expiration': channel['expiration'],
+            'X-Goog-Message-Number': str(next(channel['messages'])),
+            'X-Goog-Resource-ID': channel['resourceId'],
+            'X-Goog-Resource-URI': channel['resourceUri'],
+            'X-Goog-Resource-State': state,
+        }
+        if channel['token']:
+            headers['X-Goog-Channel-Token'] = channel['token']
+
+        def post():
+            request = urllib.request.Request(
+                channel['address'], data=b'', headers=headers, method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                    status = resp.status
+            except OSError:
+                # Drive retries failed deliveries with backoff; lost ones are
+                # what polling catches
+                status = None
+            with self._lock:
+                self.delivered[status] += 1
+        threading.Thread(target=post, daemon=True).start()
+
+    def files(self):
+        return _Files(self)
+
+    def channels(self):
+        return _Channels(self)
+
+def generate_document(doc_id, paragraphs, section_every=50, subsection_every=10, seed=0):
+    """Synthetic doc: an H1 every `section_every` paragraphs, H2s in between."""
+    rng = random.Random(seed)
+    words = ('advisor', 'notes', 'review', 'plan', 'budget', 'canvas', 'draft',
+             'meeting', 'summary', 'action', 'owner', 'timeline', 'risk', 'scope')
+    rows = []
+    for i in range(paragraphs):
+        if i % section_every == 0:
+            rows.append((f'Section {i // section_every + 1}', 'HEADING_1'))
+        elif i % subsection_every == 0:
+            rows.append((f'Topic {i}', 'HEADING_2'))
+        else:
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(8, 40)))
+            rows.append((text.capitalize() + '.', NORMAL_TEXT))
+    return EmulatedDocument.from_paragraphs(doc_id, rows, title=f'Generated {paragraphs}')
+
+def generate_activities(count, start=None, users=('Ada', 'Grace', 'Linus')):
+    """Synthetic Drive activities one minute apart, oldest first."""
+    start = start or datetime(2024, 1, 1, tzinfo=timezone.utc)
+    actions = ('edit', 'comment', 'rename', 'permissionChange')
+    return [
+        {
+            'timestamp': (start + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'actors': [{'user': {'knownUser': {'personName': f'people/{users[i % len(users)]}'}}}],
+            'actions': [{'detail': {actions[i % len(actions)]: {}}}],
+            'primaryActionDetail': {actions[i % len(actions)]: {}},
+        }
+        for i in range(count)
+    ]
+
+def install(docs=None, activity=None, drive=None):
+    """Route google_clients.get_service() to the given emulated services."""
+    if docs is not None:
+        google_clients.override_service('docs', docs)
+    if activity is not None:
+        google_clients.override_service('driveactivity', activity)
+    if drive is not None:
+        google_clients.override_service('drive', drive)
+
+def uninstall():
+    google_clients.override_service('docs', None)
+    google_clients.override_service('driveactivity', None)
+    google_clients.override_service('drive', None)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--paragraphs', type=int, default=200, help='Generated document size')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    service = EmulatedDocsService()
+    doc = service.add(generate_document('emulated-doc', args.paragraphs))
+    body = doc.to_json()['body']['content']
+    print(f'{doc.doc_id}: {len(body)} structural elements, end index {doc.end_index}, '
+          f'revision {doc.revision_id}')
+
+if __name__ == '__main__':
+    main()
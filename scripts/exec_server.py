@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""HTTP back end for the Docs Terminal sidebar: runs terminal commands in one warm process."""
+import os
+import sys
+import hmac
+import json
+import time
+import shlex
+import asyncio
+import argparse
+import threading
+from http import HTTPStatus
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from activity_store import DEFAULT_STORE, ActivityStore
+from create_sections import create_sections
+from doc_fields import MASKS, combine
+from doc_index import fetch_index
+import google_clients
+import profiling
+from sync_doc import fetch_revision_id, snapshot_path, sync_doc, sync_doc_split
+from sync_state import (
+    DEFAULT_CHANGES_PATH, DEFAULT_STATE_PATH, append_changes, load_state, save_state,
+)
+from tag_sections import tag_sections, tag_slug
+
+# OAuth2 scopes for Google Docs write access; reads share the client
+SCOPES = ['https://www.googleapis.com/auth/documents']
+
+TOKEN_ENV = 'DOCS_TERMINAL_TOKEN'
+# One mask covering every command, so a cached index serves them all
+INDEX_FIELDS = combine(*MASKS.values())
+CACHE_SIZE = 32
+# Largest request body accepted; commands are one terminal line
+MAX_BODY = 65536
+
+class CommandParser(argparse.ArgumentParser):
+    """ArgumentParser that reports errors to the caller instead of stderr."""
+
+    def error(self, message):
+        self.print_usage()
+        print(f'{self.prog}: error: {message}')
+        raise SystemExit(2)
+
+class ThreadOutput:
+    """sys.stdout stand-in that sends a command thread's prints to its own sink.
+
+    The scripts report progress with print(), so routing by thread lets
+    concurrent commands stream their output without touching that code.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        sink = getattr(self._local, 'sink', None)
+        if sink is None:
+            return self.stream.write(text)
+        sink(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(self._local, 'sink', None) is None:
+            self.stream.flush()
+
+    def redirect(self, sink):
+        self._local.sink = sink
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class IndexCache:
+    """DocIndex per (doc ID, revisionId); least recently used are evicted first."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, service, doc_id):
+        revision_id = fetch_revision_id(service, doc_id)
+        key = (doc_id, revision_id)
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return index
+            self.misses += 1
+        index = fetch_index(service, doc_id, INDEX_FIELDS)
+        self.put(doc_id, index)
+        return index
+
+    def put(self, doc_id, index):
+        with self._lock:
+            # Older revisions of the doc can never be asked for again
+            for key in [k for k in self._entries if k[0] == doc_id]:
+                del self._entries[key]
+            self._entries[(doc_id, index.revision_id)] = index
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+class ExecServer:
+    """Parses and runs terminal commands against warm clients and caches."""
+
+    def __init__(self, service, token, state_path=DEFAULT_STATE_PATH,
+                 changes_path=DEFAULT_CHANGES_PATH, store_path=DEFAULT_STORE,
+                 cache_size=CACHE_SIZE, workers=4, root='.'):
+        self.service = service
+        self.token = token.encode('utf-8')
+        self.state_path = state_path
+        self.changes_path = changes_path
+        self.store_path = store_path
+        # Clients choose output paths, but only below this directory
+        self.root = os.path.realpath(root)
+        self.cache = IndexCache(cache_size)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.parser = self._build_parser()
+        self.started = time.time()
+        self.commands = 0
+        # Syncs share the state file and change log
+        self._state_lock = threading.Lock()
+        self._store = None
+        self._store_mtime = None
+        self._store_lock = threading.Lock()
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+
+    def _build_parser(self):
+        parser = CommandParser(prog='terminal', description='Docs Terminal commands.')
+        commands = parser.add_subparsers(dest='command', required=True, parser_class=CommandParser)
+
+        def command(name, run, help):
+            sub = commands.add_parser(name, prog=name, help=help, description=help)
+            sub.set_defaults(run=run)
+            return sub
+
+        def doc_option(sub):
+            sub.add_argument('--doc-id', help='Google Doc ID (default: the open doc)')
+
+        command('help', self.cmd_help, 'List the commands')
+        command('status', self.cmd_status, 'Show uptime and cache statistics')
+        outline = command('outline', self.cmd_outline, 'List the H1 sections and their tags')
+        doc_option(outline)
+        sync = command('sync', self.cmd_sync, 'Render the doc to Markdown (see sync_doc.py)')
+        doc_option(sync)
+        sync.add_argument('--output', default='docs/doc.md',
+                          help='Output path, relative to the server root')
+        sync.add_argument('--split', action='store_true', help='One file per H1 section')
+        sync.add_argument('--full', action='store_true', help='Ignore the sync state')
+        sync.add_argument('--snapshot', action='store_true', help='Also save a DocumentIR snapshot')
+        sections = command('sections', self.cmd_sections, 'Ensure H1 sections exist')
+        doc_option(sections)
+        sections.add_argument('names', nargs='+', help='H1 section names')
+        sections.add_argument('--dry-run', action='store_true', help='Only print the plan')
+        tag = command('tag', self.cmd_tag, 'Tag H1 sections with named ranges')
+        doc_option(tag)
+        tag.add_argument('names', nargs='*', help='H1 section names (default: every H1)')
+        tag.add_argument('--dry-run', action='store_true', help='Only print the plan')
+        activity = command('activity', self.cmd_activity, 'Query the activity store')
+        doc_option(activity)
+        activity.add_argument('--all-docs', action='store_true', help='Do not filter by doc')
+        activity.add_argument('--since', help='Start (inclusive): YYYY-MM-DD or RFC 3339')
+        activity.add_argument('--until', help='End (exclusive): YYYY-MM-DD or RFC 3339')
+        activity.add_argument('--user', help='Exact user, e.g. people/123')
+        activity.add_argument('--action', help='Action type, e.g. edit')
+        activity.add_argument('--limit', type=int, default=20, help='Records to print')
+        summary = activity.add_mutually_exclusive_group()
+        summary.add_argument('--count', action='store_true', help='Print only the number of matches')
+        summary.add_argument('--by-user', action='store_true', help='Print match counts per user')
+        return parser
+
+    def run(self, line, doc_id, sink):
+        """Parse and run one command line on the calling thread, printing to sink."""
+        sys.stdout.redirect(sink)
+        try:
+            argv = shlex.split(line)
+            if not argv:
+                return
+            args = self.parser.parse_args(argv)
+            if getattr(args, 'doc_id', False) is None:
+                args.doc_id = doc_id
+            args.run(args)
+        except SystemExit:
+            pass
+        except Exception as exc:  # report to the terminal; the server keeps running
+            print(f'Error: {exc}')
+        finally:
+            self.commands += 1
+            sys.stdout.redirect(None)
+
+    def _doc_id(self, args):
+        if not args.doc_id:
+            raise ValueError('no document; pass --doc-id')
+        return args.doc_id
+
+    def cmd_help(self, args):
+        self.parser.print_help()
+
+    def cmd_status(self, args):
+        cache = self.cache
+        print(f'up {time.time() - self.started:.0f}s, {self.commands} command(s); '
+              f'index cache {len(cache)}/{cache.size} entries, '
+              f'{cache.hits} hit(s), {cache.misses} miss(es)')
+
+    def cmd_outline(self, args):
+        index = self.cache.get(self.service, self._doc_id(args))
+        tags = {
+            r.start: tag_slug(name) for name, group in index.named_ranges.items()
+            if tag_slug(name) for r in group if r.segment_id is None
+        }
+        print(f'revision {index.revision_id}: {len(index.sections)} section(s), '
+              f'{len(index.paragraphs)} paragraph(s)')
+        for section in index.sections:
+            print(f'{section.start:>8}  {tags.get(section.start, "-"):<24}  {section.name}')
+
+    def _output_path(self, path):
+        # Resolved against the root, so neither "..", absolute paths nor
+        # symlinks can send a write elsewhere; relative to the cwd like the CLI's
+        if '..' in path.replace('\\', '/').split('/'):
+            raise ValueError(f'--output may not contain "..": {path}')
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if resolved == self.root or os.path.commonpath([resolved, self.root]) != self.root:
+            raise ValueError(f'--output must be inside {self.root}: {path}')
+        return os.path.relpath(resolved)
+
+    def cmd_sync(self, args):
+        doc_id = self._doc_id(args)
+        args.output = self._output_path(args.output)
+        changes = []
+        with self._state_lock:
+            # Read afresh: the workflow and sync_daemon write the same file
+            state = load_state(self.state_path)
+            if args.split:
+                paths = sync_doc_split(self.service, doc_id, args.output, state,
+                                       args.full, changes, snapshot=args.snapshot)
+            else:
+                changed = sync_doc(self.service, doc_id, args.output, state,
+                                   args.full, changes, snapshot=args.snapshot)
+                paths = [args.output] if changed else []
+                if changed and args.snapshot:
+                    paths.append(snapshot_path(args.output))
+            save_state(state, self.state_path)
+            if changes:
+                append_changes(changes, self.changes_path)
+        for path in paths:
+            print(f'  {path}')
+
+    def cmd_sections(self, args):
+        doc_id = self._doc_id(args)
+        index = self.cache.get(self.service, doc_id)
+        added = create_sections(self.service, doc_id, args.names, index, args.dry_run)
+        if args.dry_run:
+            return
+        if added:
+            print(f'Added {len(added)} new section(s).')
+        else:
+            print('All sections already exist; no changes made.')
+
+    def cmd_tag(self, args):
+        doc_id = self._doc_id(args)
+        index = self.cache.get(self.service, doc_id)
+        tag_sections(doc_id, args.names or None, self.service, index, args.dry_run)
+
+    def store(self):
+        """The activity store, reopened only when its index.json has changed."""
+        path = os.path.join(self.store_path, 'index.json')
+        mtime = os.stat(path).st_mtime_ns if os.path.isfile(path) else None
+        with self._store_lock:
+            if self._store is None or mtime != self._store_mtime:
+                self._store = ActivityStore(self.store_path)
+                self._store_mtime = mtime
+            return self._store
+
+    def cmd_activity(self, args):
+        filters = {
+            'since': args.since, 'until': args.until, 'user': args.user, 'action': args.action,
+            'doc': None if args.all_docs else self._doc_id(args),
+        }
+        store = self.store()
+        if args.count:
+            print(store.count(**filters))
+        elif args.by_user:
+            for user, n in store.count_by_user(**filters).most_common():
+                print(f'{n:>10}  {user}')
+        else:
+            for i, record in enumerate(store.query(**filters)):
+                if i >= args.limit:
+                    break
+                print(json.dumps(record, separators=(',', ':')))
+
+    def authorized(self, headers):
+        scheme, _, given = headers.get('authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(
+            given.strip().encode('utf-8'), self.token)
+
+    async def handle(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it."""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if target.split('?', 1)[0] != '/exec':
+                    await send_text(writer, 404, 'Not found\n', keep_alive)
+                elif method != 'POST':
+                    await send_text(writer, 405, 'Use POST\n', keep_alive, [('Allow', 'POST')])
+                elif not self.authorized(headers):
+                    await send_text(writer, 401, 'Unauthorized\n', keep_alive,
+                                    [('WWW-Authenticate', 'Bearer')])
+                else:
+                    try:
+                        payload = json.loads(body or b'{}')
+                        line = payload.get('cmd') or ''
+                    except (ValueError, AttributeError):
+                        await send_text(writer, 400, 'Expected {"cmd": "..."}\n', keep_alive)
+                    else:
+                        await self.stream(writer, line, payload.get('docId'), keep_alive)
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError):
+            await send_text(writer, 400, 'Bad request\n', False)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, writer, line, doc_id, keep_alive):
+        """Run a command on the pool and send its output as chunks while it runs."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def sink(text):
+            loop.call_soon_threadsafe(queue.put_nowait, text)
+
+        done = loop.run_in_executor(self.pool, self.run, line, doc_id, sink)
+        # Scheduled after every sink() call the command made, so None comes last
+        done.add_done_callback(lambda _: queue.put_nowait(None))
+        writer.write(response_head(200, keep_alive, [
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Transfer-Encoding', 'chunked'),
+            ('Cache-Control', 'no-store'),
+        ]))
+        finished = False
+        while not finished:
+            # Everything printed since the last write goes out as one chunk
+            pieces = [await queue.get()]
+            while not queue.empty():
+                pieces.append(queue.get_nowait())
+            finished = pieces[-1] is None
+            data = ''.join(p for p in pieces if p is not None).encode('utf-8')
+            if data:
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+async def read_request(reader):
+    """(method, target, lowercased headers, body), or None once the client is done."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+def response_head(status, keep_alive, headers=()):
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+    lines.extend(f'{name}: {value}' for name, value in headers)
+    lines.append(f'Connection: {"keep-alive" if keep_alive else "close"}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+async def send_text(writer, status, text, keep_alive, headers=()):
+    data = text.encode('utf-8')
+    writer.write(response_head(status, keep_alive, [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Content-Length', str(len(data))),
+        *headers,
+    ]) + data)
+    await writer.drain()
+
+async def serve(server, host, port):
+    listener = await asyncio.start_server(server.handle, host, port)
+    host, port = listener.sockets[0].getsockname()[:2]
+    print(f'Serving /exec on {host}:{port}', flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+def parse_listen(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--listen', default='127.0.0.1:8000', metavar='[HOST:]PORT',
+        help='Address to serve /exec on; put it behind HTTPS for Code.gs'
+    )
+    parser.add_argument(
+        '--token',
+        help=f'Bearer token Code.gs sends as API_TOKEN (default: ${TOKEN_ENV})'
+    )
+    parser.add_argument(
+        '--state', default=DEFAULT_STATE_PATH,
+        help='Sync state file shared with sync_doc.py'
+    )
+    parser.add_argument(
+        '--changes-log', default=DEFAULT_CHANGES_PATH,
+        help='Log of which sections each sync changed (read by correlate_activity.py)'
+    )
+    parser.add_argument('--store', default=DEFAULT_STORE, help='Activity store directory')
+    parser.add_argument(
+        '--root', default='.',
+        help='Directory (normally the repository) that sync --output paths must stay inside'
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=CACHE_SIZE,
+        help='Parsed document indexes kept in memory'
+    )
+    parser.add_argument('--workers', type=int, default=4, help='Commands run concurrently')
+    parser.add_argument(
+        '--emulate', type=int, metavar='PARAGRAPHS',
+        help='Serve a generated document "emulated-doc" from docs_emulator instead of Google'
+    )
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    token = args.token or os.environ.get(TOKEN_ENV)
+    if not token:
+        parser.error(f'a bearer token is required: pass --token or set {TOKEN_ENV}')
+    if args.emulate is not None:
+        import docs_emulator
+        docs = docs_emulator.EmulatedDocsService()
+        docs.add(docs_emulator.generate_document('emulated-doc', args.emulate))
+        docs_emulator.install(docs=docs)
+    # Built once: discovery and credentials are paid for before the first command
+    service = google_clients.get_service('docs', 'v1', SCOPES)
+    server = ExecServer(service, token, args.state, args.changes_log, args.store,
+                        args.cache_size, args.workers, args.root)
+    host, port = parse_listen(args.listen)
+    try:
+        asyncio.run(serve(server, host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown(wait=False)
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,41 @@
 #!/usr/bin/env python3
-"""Fetch Drive activity for a Google Doc and output author, timestamp, and action."""
+"""Fetch Drive activity for Google Docs and append author, timestamp, and action to a log."""
 import os
 import argparse
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import google_clients
+import profiling
+from sync_state import load_state, save_state
 
 # OAuth2 scopes for Drive Activity API
 SCOPES = ['https://www.googleapis.com/auth/drive.activity.readonly']
 
+DEFAULT_OUTPUT = 'activity/activity.jsonl'
+DEFAULT_CURSOR = 'activity/cursor.json'
+# Activities requested per query page
+PAGE_SIZE = 100
+
 def get_activity_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError(
-            'Service account credentials not found. '
-            'Set GOOGLE_APPLICATION_CREDENTIALS to a valid JSON file.'
-        )
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    service = build('driveactivity', 'v2', credentials=creds)
+    # Safe to share across worker threads (see google_clients.HttpPool)
+    service = google_clients.get_service('driveactivity', 'v2', SCOPES)
     return service
 
-def fetch_activity(doc_id):
-    service = get_activity_service()
-    body = {'itemName': f'items/{doc_id}'}
-    response = service.activity().query(body=body).execute()
-    return response.get('activities', [])
+def fetch_activity(doc_id, since=None, service=None):
+    # Follow nextPageToken so older history is not cut off
+    service = service or get_activity_service()
+    body = {'itemName': f'items/{doc_id}', 'pageSize': PAGE_SIZE}
+    if since:
+        body['filter'] = f'time > "{since}"'
+    activities = []
+    while True:
+        response = service.activity().query(body=body).execute()
+        activities.extend(response.get('activities', []))
+        token = response.get('nextPageToken')
+        if not token:
+            return activities
+        body = dict(body, pageToken=token)
 
 def parse_activities(activities):
     records = []
@@ -40,31 +49,127 @@ def parse_activities(activities):
                 user = user_known.get('personName')
                 break
         actions = act.get('actions', [])
-        action_desc = ','.join([next(iter(a)) for a in actions])
+        # Each Action nests its type under `detail` (e.g. {'detail': {'edit': {}}})
+        action_desc = ','.join([next(iter(a.get('detail') or a)) for a in actions])
         records.append({
             'timestamp': timestamp,
             'user': user,
             'action': action_desc,
+            # Kept whole so audit logs can show what changed
+            'detail': act.get('primaryActionDetail', {}),
         })
     return records
 
-def write_output(records, output_path):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(records, f, indent=2)
+def fetch_new_records(doc_id, since=None, service=None):
+    records = parse_activities(fetch_activity(doc_id, since, service))
+    # The API returns newest first; the log is kept oldest first
+    records.reverse()
+    for record in records:
+        record['docId'] = doc_id
+    return records
+
+def fetch_many(doc_ids, cursor, workers):
+    """Yield (doc_id, records or exception) as a bounded thread pool finishes each doc."""
+    service = get_activity_service()
+
+    def job(doc_id):
+        return fetch_new_records(doc_id, cursor.get(doc_id), service)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(job, doc_id): doc_id for doc_id in doc_ids}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as exc:
+                yield futures[future], exc
+
+def append_records(records, output_path):
+    dirname = os.path.dirname(output_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(output_path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+def read_records(path):
+    # Stream a newline-delimited JSON log without loading it whole
+    if not os.path.isfile(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def record_key(record):
+    # The whole record: one response can hold an edit and a comment by the
+    # same user on the same doc in the same millisecond
+    return json.dumps(record, sort_keys=True, separators=(',', ':'))
+
+def read_doc_ids(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('--doc-id', required=True, help='Google Doc ID')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--doc-id', nargs='+', help='Google Doc ID(s)')
+    source.add_argument('--doc-ids-file', help='File with one Google Doc ID per line')
+    parser.add_argument(
+        '--output', default=DEFAULT_OUTPUT,
+        help='Newline-delimited JSON log that new records are appended to'
+    )
+    parser.add_argument(
+        '--cursor', default=DEFAULT_CURSOR,
+        help='File recording the newest activity timestamp seen per doc'
+    )
+    parser.add_argument(
+        '--full', action='store_true',
+        help='Ignore the cursor and fetch the complete history again, appending only '
+             'records not already in the log'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='Docs fetched concurrently'
+    )
     parser.add_argument(
-        '--output', default='activity/activity.json',
-        help='Path to output JSON file'
+        '--store',
+        help='Also append new records to this columnar store (see activity_store.py)'
     )
+    profiling.add_argument(parser)
     args = parser.parse_args()
-    activities = fetch_activity(args.doc_id)
-    records = parse_activities(activities)
-    write_output(records, args.output)
-    print(f'Wrote {len(records)} activity records to {args.output}')
+    profiling.start(args.profile)
+    doc_ids = args.doc_id or read_doc_ids(args.doc_ids_file)
+    cursor = {} if args.full else load_state(args.cursor)
+    new_cursor = load_state(args.cursor)
+    # A full refetch overlaps the log; records already in it are skipped
+    wanted = set(doc_ids)
+    seen = ({record_key(r) for r in read_records(args.output) if r.get('docId') in wanted}
+            if args.full else None)
+    total = 0
+    failed = 0
+    fetched = []
+    for doc_id, records in fetch_many(doc_ids, cursor, args.workers):
+        if isinstance(records, Exception):
+            print(f'Warning: fetching activity for {doc_id} failed: {records}')
+            failed += 1
+            continue
+        if seen is not None:
+            records = [r for r in records if record_key(r) not in seen]
+            seen.update(record_key(r) for r in records)
+        append_records(records, args.output)
+        # Advance only after the records are safely on disk
+        latest = max((r['timestamp'] for r in records if r['timestamp']), default=None)
+        if latest and latest > new_cursor.get(doc_id, ''):
+            new_cursor[doc_id] = latest
+        total += len(records)
+        if args.store:
+            fetched.extend(records)
+    if fetched:
+        # One append per run keeps the store to a few chunks per month
+        from activity_store import ActivityStore
+        ActivityStore(args.store).append(fetched)
+    save_state(new_cursor, args.cursor)
+    print(f'Appended {total} new activity records for {len(doc_ids) - failed} doc(s) to {args.output}')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
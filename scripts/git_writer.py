@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Commit files to a git branch through one `git fast-import` stream."""
+import os
+import stat
+import hashlib
+import argparse
+import subprocess
+
+import profiling
+
+_NULL_SHA = '0' * 40
+
+def blob_sha1(data):
+    # The object name git would give data, without writing the object
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+def quote_path(path):
+    # C-style quoting, accepted by every fast-import path argument
+    escaped = path.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+def read_entry(path):
+    """(mode, data) for a file or symlink, or None if path does not exist."""
+    try:
+        if os.path.islink(path):
+            return '120000', os.fsencode(os.readlink(path))
+        with open(path, 'rb') as f:
+            data = f.read()
+        mode = os.stat(path).st_mode
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None
+    return ('100755' if mode & stat.S_IXUSR else '100644'), data
+
+class GitWriter:
+    """Writes commits for one branch of one repository."""
+
+    __slots__ = ('work_tree', 'git_dir', 'ref', 'remote', 'bare', 'checked_out', 'ident')
+
+    def __init__(self, work_tree='.', git_dir=None, ref=None, remote='origin'):
+        # One rev-parse finds the repository; paths are read relative to work_tree
+        base = ['git', f'--git-dir={git_dir}'] if git_dir else ['git', '-C', work_tree]
+        lines = self._output(base + ['rev-parse', '--absolute-git-dir',
+                                     '--is-bare-repository']).splitlines()
+        self.git_dir, self.bare = lines[0], lines[1] == 'true'
+        if git_dir or self.bare:
+            self.work_tree = os.path.abspath(work_tree)
+        else:
+            self.work_tree = self._output(['git', '-C', work_tree, 'rev-parse',
+                                           '--show-toplevel']).strip()
+        self.remote = remote
+        head = subprocess.run(self._git('symbolic-ref', '-q', 'HEAD'),
+                              capture_output=True, text=True).stdout.strip()
+        if not ref and not head:
+            raise ValueError('HEAD is detached; pass the branch ref to commit to')
+        self.ref = ref or head
+        if not self.ref.startswith('refs/'):
+            self.ref = f'refs/heads/{self.ref}'
+        self.checked_out = not self.bare and self.ref == head
+        # "Name <email>"; the timestamp is taken by fast-import at commit time
+        self.ident = self._output(self._git('var', 'GIT_COMMITTER_IDENT')).rsplit(' ', 2)[0]
+
+    @staticmethod
+    def _output(command, stdin=None, cwd=None):
+        return subprocess.run(command, input=stdin, capture_output=True, check=True, cwd=cwd,
+                              text=stdin is None or isinstance(stdin, str)).stdout
+
+    def _git(self, *args):
+        return ['git', f'--git-dir={self.git_dir}', f'--work-tree={self.work_tree}', *args]
+
+    def relative(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.work_tree)
+        if rel == os.curdir or rel.startswith(os.pardir + os.sep) or rel == os.pardir:
+            raise ValueError(f'{path} is outside the work tree {self.work_tree}')
+        return rel.replace(os.sep, '/')
+
+    def expand(self, paths):
+        """Repository paths for paths; directories stand for the files under them."""
+        result = {}
+        for path in paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                for root, dirs, files in os.walk(path):
+                    dirs[:] = sorted(d for d in dirs if d != '.git')
+                    for name in sorted(files):
+                        full = os.path.join(root, name)
+                        result[self.relative(full)] = full
+            else:
+                result[self.relative(path)] = path
+        return result
+
+    def head(self):
+        # Commit the branch points at, or None before its first commit
+        line = self._output(self._git('for-each-ref', '--format=%(objectname)', self.ref))
+        return line.strip() or None
+
+    def commit(self, paths, message):
+        """Commit paths (deleted ones are removed) in one commit on the branch.
+
+        Returns the new commit's sha1, or None if every path already matches
+        the branch.
+        """
+        files = self.expand(paths)
+        parent = self.head()
+        with profiling.span('git commit', files=len(files)):
+            proc = subprocess.Popen(
+                self._git('fast-import', '--quiet', '--done', '--date-format=now',
+                          '--cat-blob-fd=1'),
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            changes = []
+            try:
+                changes = self._diff(proc, parent, files)
+                sha = self._write_commit(proc, parent, changes, message) if changes else None
+                proc.stdin.write(b'done\n')
+                proc.stdin.close()
+            except BrokenPipeError:
+                sha = None
+            proc.stdout.close()
+            if proc.wait():
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+            if sha and self.checked_out:
+                self._update_index(changes)
+        profiling.count('git.files_written', len(changes))
+        return sha
+
+    def _diff(self, proc, parent, files):
+        # [(path, mode, data, sha1)] for changed files, data None for deletions
+        changes = []
+        for rel, full in sorted(files.items()):
+            current = self._ls(proc, parent, rel) if parent else None
+            entry = read_entry(full)
+            if entry is None:
+                if current is not None:
+                    changes.append((rel, None, None, None))
+                continue
+            mode, data = entry
+            sha = blob_sha1(data)
+            if current != (mode, sha):
+                changes.append((rel, mode, data, sha))
+        return changes
+
+    @staticmethod
+    def _ls(proc, parent, rel):
+        # (mode, sha1) of rel in parent, or None; one round trip through cat-blob-fd
+        proc.stdin.write(f'ls {parent} {quote_path(rel)}\n'.encode('utf-8'))
+        proc.stdin.flush()
+        line = proc.stdout.readline().decode('utf-8')
+        if not line:
+            raise BrokenPipeError('git fast-import exited early')
+        if line.startswith('missing '):
+            return None
+        mode, kind, sha = line.split('\t', 1)[0].split(' ')
+        return (mode, sha) if kind == 'blob' else (mode, kind)
+
+    def _write_commit(self, proc, parent, changes, message):
+        body = message.encode('utf-8')
+        out = proc.stdin
+        out.write(f'commit {self.ref}\nmark :1\ncommitter {self.ident} now\n'.encode('utf-8'))
+        out.write(b'data %d\n%s\n' % (len(body), body))
+        if parent:
+            out.write(f'from {parent}\n'.encode('ascii'))
+        for rel, mode, data, _ in changes:
+            if mode is None:
+                out.write(f'D {quote_path(rel)}\n'.encode('utf-8'))
+            else:
+                out.write(f'M {mode} inline {quote_path(rel)}\n'.encode('utf-8'))
+                out.write(b'data %d\n' % len(data))
+                out.write(data)
+                out.write(b'\n')
+        out.write(b'\nget-mark :1\n')
+        out.flush()
+        line = proc.stdout.readline().decode('ascii')
+        if not line:
+            raise BrokenPipeError('git fast-import exited early')
+        return line.strip()
+
+    def _update_index(self, changes):
+        # Point the index at the new blobs so the work tree does not look dirty
+        entries = [f'{mode} {sha}\t{rel}' for rel, mode, _, sha in changes if mode is not None]
+        deleted = [rel for rel, mode, _, _ in changes if mode is None]
+        if deleted:
+            # A deleted directory is one D command but many index entries
+            indexed = self._output(
+                self._git('--literal-pathspecs', 'ls-files', '-z', '--', *deleted),
+                cwd=self.work_tree)
+            entries.extend(f'0 {_NULL_SHA}\t{rel}' for rel in indexed.split('\0') if rel)
+        if entries:
+            self._output(self._git('update-index', '-z', '--index-info'),
+                         stdin=('\0'.join(entries) + '\0').encode('utf-8'))
+
+    def push(self):
+        with profiling.span('git push'):
+            subprocess.run(self._git('push', '--quiet', self.remote, f'{self.ref}:{self.ref}'),
+                           check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='Files or directories to commit')
+    parser.add_argument('-m', '--message', required=True, help='Commit message')
+    parser.add_argument('--work-tree', default='.', help='Directory paths are relative to')
+    parser.add_argument('--git-dir', help='Repository to write to, e.g. a bare repository')
+    parser.add_argument('--ref', help='Branch to commit to (default: the checked-out branch)')
+    parser.add_argument('--remote', default='origin', help='Remote to push to')
+    parser.add_argument('--push', action='store_true', help='Push the branch after committing')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    writer = GitWriter(args.work_tree, args.git_dir, args.ref, args.remote)
+    sha = writer.commit(args.paths, args.message)
+    if sha is None:
+        print('No changes to commit.')
+        return
+    print(f'Committed {sha[:12]} to {writer.ref}.')
+    if args.push:
+        writer.push()
+        print('Changes pushed.')
+
+if __name__ == '__main__':
+    main()
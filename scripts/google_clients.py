@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Shared Google API client factory: cached discovery, pooled transports, rate limiting."""
+import os
+import json
+import time
+import threading
+
+import profiling
+
+# Seconds before an idle socket read gives up
+HTTP_TIMEOUT = 60
+DISCOVERY_URL = 'https://{api}.googleapis.com/$discovery/rest?version={version}'
+DISCOVERY_CACHE_DIR = os.environ.get(
+    'GOOGLE_DISCOVERY_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'google-doc-canvas', 'discovery'),
+)
+
+# Parsed discovery documents, shared by every client built in this process
+_documents = {}
+_documents_lock = threading.Lock()
+# Stand-in services (e.g. docs_emulator) returned instead of real clients
+_overrides = {}
+
+# Google libraries are imported inside the functions below, so --help and
+# dry runs never load them
+
+@profiling.timed('credentials')
+def load_credentials(scopes):
+    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    if not creds_path or not os.path.isfile(creds_path):
+        raise FileNotFoundError(
+            'Service account credentials not found. '
+            'Set GOOGLE_APPLICATION_CREDENTIALS to a valid JSON file.'
+        )
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(
+        creds_path, scopes=scopes)
+
+class TokenBucket:
+    """Blocking token bucket: `rate` requests per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class HttpPool:
+    """Keep-alive transports sharing one credentials object.
+
+    httplib2 connections are not thread-safe, so each thread gets its own
+    AuthorizedHttp and keeps reusing its open connections; token refreshes
+    are shared through the credentials.
+    """
+
+    def __init__(self, creds, timeout=HTTP_TIMEOUT):
+        self.creds = creds
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            import httplib2
+            import google_auth_httplib2
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.creds, http=httplib2.Http(timeout=self.timeout))
+            self._local.http = http
+        return http
+
+def _cache_path(api, version):
+    # Keyed by client library version so an upgrade never reads a stale schema
+    import googleapiclient
+    return os.path.join(
+        DISCOVERY_CACHE_DIR, f'{api}.{version}.{googleapiclient.__version__}.json')
+
+def _load_document_text(api, version):
+    path = _cache_path(api, version)
+    if os.path.isfile(path):
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    # Prefer the copy bundled with googleapiclient; fetch only as a last resort
+    from googleapiclient.discovery_cache import get_static_doc
+    text = get_static_doc(api, version)
+    if text is None:
+        import httplib2
+        resp, content = httplib2.Http(timeout=HTTP_TIMEOUT).request(
+            DISCOVERY_URL.format(api=api, version=version))
+        if resp.status != 200:
+            raise RuntimeError(f'Discovery fetch for {api} {version} failed: HTTP {resp.status}')
+        text = content.decode('utf-8')
+    os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return text
+
+def discovery_document(api, version):
+    """Parsed discovery document, read from the on-disk cache at most once per process."""
+    key = (api, version)
+    with _documents_lock:
+        document = _documents.get(key)
+        if document is None:
+            with profiling.span('discovery', api=api):
+                document = json.loads(_load_document_text(api, version))
+            _documents[key] = document
+    return document
+
+_profiled_request = None
+
+def _request_class():
+    # HttpRequest that reports each call to profiling; built on first use
+    # because googleapiclient is imported lazily
+    global _profiled_request
+    if _profiled_request is None:
+        from googleapiclient.http import HttpRequest
+
+        class ProfiledRequest(HttpRequest):
+            def execute(self, *args, **kwargs):
+                if not profiling.active():
+                    return super().execute(*args, **kwargs)
+                profiling.count('api.calls')
+                profiling.count(f'api.{self.methodId}')
+                profiling.count('api.bytes_sent', len(self.body or ''))
+                with profiling.span(f'api {self.methodId}'):
+                    return super().execute(*args, **kwargs)
+
+        _profiled_request = ProfiledRequest
+    return _profiled_request
+
+def _profiled_postproc(postproc):
+    def parse(resp, content):
+        if not profiling.active():
+            return postproc(resp, content)
+        profiling.count('api.bytes_received', len(content or b''))
+        with profiling.span('parse response'):
+            return postproc(resp, content)
+    return parse
+
+def build_service(api, version, creds, pool=None, bucket=None):
+    """Build a client from the cached discovery document, safe to share across threads."""
+    from googleapiclient.discovery import build_from_document
+    pool = pool or HttpPool(creds)
+    request_class = _request_class()
+
+    def request_builder(http, postproc, *args, **kwargs):
+        # Requests are built right before they execute, so this is where
+        # the shared rate limit is charged
+        if bucket is not None:
+            with profiling.span('rate limit'):
+                bucket.acquire()
+        return request_class(pool.get(), _profiled_postproc(postproc), *args, **kwargs)
+
+    with profiling.span('build service', api=api):
+        return build_from_document(
+            discovery_document(api, version), http=pool.get(), requestBuilder=request_builder)
+
+def override_service(api, service):
+    """Serve `service` for every get_service(api, ...) call; None restores real clients."""
+    if service is None:
+        _overrides.pop(api, None)
+    else:
+        _overrides[api] = service
+
+def get_service(api, version, scopes, bucket=None):
+    if api in _overrides:
+        return _overrides[api]
+    return build_service(api, version, load_credentials(scopes), bucket=bucket)
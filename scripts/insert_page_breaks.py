@@ -1,45 +1,60 @@
 #!/usr/bin/env python3
 """Insert a page break before each H1 heading in a Google Doc."""
-import os, argparse
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import argparse
+
+from doc_fields import MASKS
+from doc_index import fetch_index
+from doc_plan import PAGE_BREAK_LENGTH, Plan
+import google_clients
+import profiling
 
 # write scope for Google Docs
 SCOPES = ['https://www.googleapis.com/auth/documents']
 
 def get_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError('Set GOOGLE_APPLICATION_CREDENTIALS to your key JSON.')
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    return build('docs', 'v1', credentials=creds)
+    return google_clients.get_service('docs', 'v1', SCOPES)
+
+def plan_page_breaks(plan):
+    """Queue a page break before every H1 lacking one; returns how many.
+
+    Headings that open the document or already follow a page break (blank
+    lines aside) are skipped, so a re-run plans no requests.
+    """
+    index = plan.index
+    missing = [
+        h for h in plan.h1
+        if h.start != index.content_start and not index.page_break_before(h.start)
+    ]
+    # Build requests in reverse order to avoid index shifts
+    for heading in sorted(missing, key=lambda h: h.start, reverse=True):
+        plan.add({'insertPageBreak': {'location': {'index': heading.start}}})
+        plan.shifter.insert(heading.start, PAGE_BREAK_LENGTH)
+    return len(missing)
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--doc-id', required=True, help='Google Doc ID')
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
+    )
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.start(args.profile)
     service = get_service()
-    doc = service.documents().get(documentId=args.doc_id).execute()
-    positions = []
-    for el in doc.get('body', {}).get('content', []):
-        para = el.get('paragraph')
-        if para and para.get('paragraphStyle', {}).get('namedStyleType') == 'HEADING_1':
-            idx = el.get('startIndex')
-            if isinstance(idx, int):
-                positions.append(idx)
-    if not positions:
+    plan = Plan(fetch_index(service, args.doc_id, MASKS['page_breaks']))
+    if not plan.h1:
         print('No H1 headings found; nothing to do.')
         return
-    # Build requests in reverse order to avoid index shifts
-    requests = []
-    for idx in sorted(positions, reverse=True):
-        requests.append({'insertPageBreak': {'location': {'index': idx}}})
-    service.documents().batchUpdate(
-        documentId=args.doc_id,
-        body={'requests': requests}
-    ).execute()
-    print(f'Inserted {len(positions)} page break(s).')
+    count = plan_page_breaks(plan)
+    if args.dry_run:
+        plan.print_dry_run()
+        return
+    if not count:
+        print('Every H1 already follows a page break; no changes made.')
+        return
+    plan.execute(service, args.doc_id)
+    print(f'Inserted {count} page break(s).')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
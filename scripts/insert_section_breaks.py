@@ -1,61 +1,74 @@
 #!/usr/bin/env python3
 """Insert section breaks (NEXT_PAGE) before each H1 heading in a Google Doc."""
-import os
 import argparse
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+
+from doc_fields import MASKS
+from doc_index import DocIndex, fetch_index
+from doc_plan import SECTION_BREAK_LENGTH, Plan
+import google_clients
+import profiling
 
 # OAuth2 scopes for Google Docs write access
 SCOPES = ['https://www.googleapis.com/auth/documents']
 
 def get_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError(
-            'Service account credentials not found. '
-            'Set GOOGLE_APPLICATION_CREDENTIALS to your key JSON.'
-        )
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    return build('docs', 'v1', credentials=creds)
+    return google_clients.get_service('docs', 'v1', SCOPES)
 
 def fetch_h1_positions(doc):
-    positions = []
-    for el in doc.get('body', {}).get('content', []):
-        para = el.get('paragraph')
-        if not para:
-            continue
-        if para.get('paragraphStyle', {}).get('namedStyleType') == 'HEADING_1':
-            idx = el.get('startIndex')
-            if isinstance(idx, int):
-                positions.append(idx)
-    return positions
+    index = doc if isinstance(doc, DocIndex) else DocIndex(doc)
+    return [h.start for h in index.h1]
+
+def needs_break(plan, heading):
+    """False if heading already opens a section or opens the document."""
+    if heading.start in plan.breaks:
+        return False
+    index = plan.index
+    if heading.planned:
+        # Appended headings follow existing content, unless the doc was empty
+        return index.content_start is not None or heading is not plan.h1[0]
+    return (heading.start != index.content_start
+            and index.break_before(heading.start) is None)
+
+def plan_section_breaks(plan):
+    """Queue a section break before every H1 lacking one; returns how many."""
+    missing = [h for h in plan.h1 if needs_break(plan, h)]
+    # Descending order keeps every index valid without shifting earlier requests
+    for heading in sorted(missing, key=lambda h: h.start, reverse=True):
+        plan.add({
+            'insertSectionBreak': {
+                'location': {'index': heading.start},
+                'sectionType': 'NEXT_PAGE'
+            }
+        })
+        plan.shifter.insert(heading.start, SECTION_BREAK_LENGTH)
+        plan.breaks.add(heading.start)
+    return len(missing)
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--doc-id', required=True, help='Google Doc ID')
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
+    )
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.start(args.profile)
     service = get_service()
-    # Fetch full doc content
-    doc = service.documents().get(documentId=args.doc_id).execute()
-    positions = fetch_h1_positions(doc)
-    if not positions:
+    # Only headings, indices and existing breaks are needed
+    plan = Plan(fetch_index(service, args.doc_id, MASKS['breaks']))
+    if not plan.h1:
         print('No H1 headings found; nothing to do.')
         return
-    # Build section break requests in reverse order
-    requests = []
-    for idx in sorted(positions, reverse=True):
-        requests.append({
-            'insertSectionBreak': {
-                'location': {'index': idx},
-                'sectionType': 'NEXT_PAGE'
-            }
-        })
-    service.documents().batchUpdate(
-        documentId=args.doc_id,
-        body={'requests': requests}
-    ).execute()
-    print(f'Inserted {len(positions)} section break(s).')
+    count = plan_section_breaks(plan)
+    if args.dry_run:
+        plan.print_dry_run()
+        return
+    if not count:
+        print('Every H1 already has a section break; no changes made.')
+        return
+    plan.execute(service, args.doc_id)
+    print(f'Inserted {count} section break(s).')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Create sections, insert section breaks, apply headers and tag sections in one pass."""
+import argparse
+
+from apply_section_headers import plan_headers
+from batch_executor import BatchExecutor
+from create_sections import plan_sections
+from doc_fields import MASKS, combine
+from doc_index import DocIndex, fetch_index
+from doc_ir import DocumentIR
+from doc_plan import Plan
+import google_clients
+from insert_section_breaks import plan_section_breaks
+import profiling
+from tag_sections import plan_tags, write_mapping
+
+# OAuth2 scopes for Google Docs write access
+SCOPES = ['https://www.googleapis.com/auth/documents']
+
+# Steps run in this order; each plans against the document left by the previous
+STEPS = ('sections', 'breaks', 'headers', 'tags')
+
+def get_service():
+    return google_clients.get_service('docs', 'v1', SCOPES)
+
+def build_plan(index, sections, steps=STEPS, prefix='Advisor Notes - '):
+    plan = Plan(index)
+    mapping = {}
+    if 'sections' in steps and sections:
+        plan_sections(plan, sections)
+    if 'breaks' in steps:
+        plan_section_breaks(plan)
+    if 'headers' in steps:
+        plan_headers(plan, prefix)
+    if 'tags' in steps:
+        mapping = plan_tags(plan, sections or None)
+    return plan, mapping
+
+def run_pipeline(service, doc_id, sections, steps=STEPS, prefix='Advisor Notes - ',
+                 dry_run=False, executor=None):
+    # One fetch of just what the steps read, one in-memory plan, then the
+    # fewest batchUpdate calls
+    index = fetch_index(service, doc_id, combine(*(MASKS[step] for step in steps)))
+    plan, mapping = build_plan(index, sections, steps, prefix)
+    if not dry_run:
+        if plan.requests:
+            plan.execute(service, doc_id, executor)
+        if mapping:
+            write_mapping(mapping)
+    return plan, mapping
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--doc-id', help='Google Doc ID')
+    source.add_argument(
+        '--snapshot',
+        help='Plan offline against a DocumentIR snapshot (sync_doc.py --snapshot); '
+             'implies --dry-run'
+    )
+    parser.add_argument(
+        '--sections', nargs='*', default=[],
+        help='H1 section names to ensure and tag (default: tag every H1)'
+    )
+    parser.add_argument(
+        '--steps', nargs='+', choices=STEPS, default=list(STEPS),
+        help='Steps to run (default: all)'
+    )
+    parser.add_argument('--prefix', default='Advisor Notes - ', help='Header text prefix')
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
+    )
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    if args.snapshot:
+        ir = DocumentIR.load(args.snapshot)
+        plan, _ = build_plan(DocIndex(ir.to_json()), args.sections, args.steps, args.prefix)
+        print(f'Planned against revision {ir.revision_id} from {args.snapshot}.')
+        plan.print_dry_run()
+        return
+    service = get_service()
+    executor = BatchExecutor(service)
+    plan, mapping = run_pipeline(
+        service, args.doc_id, args.sections, args.steps, args.prefix, args.dry_run,
+        executor)
+    if args.dry_run:
+        plan.print_dry_run()
+        return
+    if not plan.requests:
+        print('Nothing to do.')
+    else:
+        print(f'Applied {plan.sent} request(s) in {plan.batches} batchUpdate call(s).')
+        print(f'Write metrics: {executor.metrics.format()}')
+    if mapping:
+        print(f'Tagged {len(mapping)} sections; mapping in sections/sections.json')
+
+if __name__ == '__main__':
+    main()
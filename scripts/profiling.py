@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Opt-in timing spans, counters and memory sampling shared by every script."""
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import defaultdict
+
+# Seconds between resident-memory samples
+SAMPLE_INTERVAL = 0.05
+
+# Set by start(); until then span() and count() cost one global check
+_recorder = None
+
+def _page_size():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+_PAGE_SIZE = _page_size()
+
+def rss_bytes():
+    """Current resident set size, or the peak so far where that is all the OS reports."""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Recorder:
+    """Events in Chrome trace form plus running counter totals."""
+
+    def __init__(self, path, interval=SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = defaultdict(int)
+        self.peak_rss = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='profiling', daemon=True)
+
+    def _us(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def add_span(self, name, start, end, args):
+        event = {'name': name, 'ph': 'X', 'ts': self._us(start),
+                 'dur': round((end - start) * 1e6, 1), 'pid': self.pid,
+                 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        # list.append is atomic, so spans need no lock
+        self.events.append(event)
+
+    def count(self, name, amount):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _sample(self):
+        while True:
+            rss = rss_bytes()
+            self.peak_rss = max(self.peak_rss, rss)
+            self.events.append({
+                'name': 'memory', 'ph': 'C', 'ts': self._us(time.perf_counter()),
+                'pid': self.pid, 'args': {'rss_mb': round(rss / 2 ** 20, 2)}})
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler.is_alive():
+            self._sampler.join()
+        self.peak_rss = max(self.peak_rss, peak_rss_bytes())
+
+    def summary(self):
+        """{span name: [calls, total s, max s]}, counters and peak RSS."""
+        spans = {}
+        for event in self.events:
+            if event['ph'] != 'X':
+                continue
+            entry = spans.setdefault(event['name'], [0, 0.0, 0.0])
+            seconds = event['dur'] / 1e6
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+        return {'spans': spans, 'counters': dict(self.counters), 'peak_rss_bytes': self.peak_rss}
+
+    def write(self):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        summary = self.summary()
+        summary['spans'] = {name: {'calls': calls, 'total_s': round(total, 6),
+                                   'max_s': round(longest, 6)}
+                            for name, (calls, total, longest) in summary['spans'].items()}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if self.path.endswith('.jsonl'):
+                for event in self.events:
+                    f.write(json.dumps(event, separators=(',', ':')) + '\n')
+                f.write(json.dumps(dict(summary, ph='summary'), separators=(',', ':')) + '\n')
+            else:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                           'otherData': summary}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def format_summary(self):
+        summary = self.summary()
+        spans = summary['spans']
+        wall = spans.get('run', [0, 0.0, 0.0])[1] or 1e-9
+        lines = [f'profile: {wall * 1000:.1f} ms wall, peak RSS '
+                 f'{summary["peak_rss_bytes"] / 2 ** 20:.1f} MB -> {self.path}',
+                 f'  {"span":<32} {"calls":>7} {"total ms":>11} {"mean ms":>9} '
+                 f'{"max ms":>9} {"% wall":>7}']
+        for name, (calls, total, longest) in sorted(
+                spans.items(), key=lambda item: -item[1][1]):
+            lines.append(f'  {name:<32} {calls:>7} {total * 1000:>11.1f} '
+                         f'{total * 1000 / calls:>9.2f} {longest * 1000:>9.1f} '
+                         f'{total / wall:>7.1%}')
+        if summary['counters']:
+            lines.append(f'  {"counter":<32} {"value":>7}')
+            for name, value in sorted(summary['counters'].items()):
+                lines.append(f'  {name:<32} {value:>7}')
+        return '\n'.join(lines)
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        recorder = _recorder
+        if recorder is not None:
+            recorder.add_span(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def active():
+    return _recorder is not None
+
+def span(name, **args):
+    """Context manager timing one phase; args land in the trace event."""
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+def timed(name):
+    """Decorator running the function inside span(name)."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return fn(*args, **kwargs)
+            with _Span(name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, amount=1):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, amount)
+
+def add_argument(parser):
+    parser.add_argument(
+        '--profile', metavar='TRACE',
+        help='Record timing spans, counters and peak memory to TRACE (Chrome trace '
+             'JSON, or JSON lines if it ends in .jsonl) and print a summary to stderr'
+    )
+
+def start(path, interval=SAMPLE_INTERVAL):
+    """Record until the process exits, then write path and print the summary.
+
+    A falsy path leaves profiling off, so scripts can pass args.profile as is.
+    """
+    global _recorder
+    if not path or _recorder is not None:
+        return _recorder
+    recorder = Recorder(path, interval)
+    _recorder = recorder
+    recorder._sampler.start()
+    root = _Span('run', {'argv': sys.argv})
+    root.__enter__()
+
+    def finish():
+        global _recorder
+        root.__exit__(None, None, None)
+        recorder.stop()
+        _recorder = None
+        recorder.write()
+        print(recorder.format_summary(), file=sys.stderr)
+
+    atexit.register(finish)
+    return recorder
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""Push edits made to a synced Markdown file back into its Google Doc."""
+import re
+import argparse
+from bisect import bisect_left
+
+from doc_index import DocIndex
+from doc_markdown import SECTION_BREAK, render_paragraph, render_table
+from doc_plan import Plan, utf16_len
+import google_clients
+import profiling
+from sync_state import DEFAULT_STATE_PATH, load_state
+
+# OAuth2 scopes for Google Docs write access
+SCOPES = ['https://www.googleapis.com/auth/documents']
+
+NORMAL_TEXT = 'NORMAL_TEXT'
+# Past this many edits a region is replaced whole instead of diffed further
+MAX_EDITS = 4000
+# Character hunks closer than this are sent as one delete and insert
+MERGE_GAP = 8
+
+HEADING = re.compile(r'(#{1,6}) (.*)\n')
+LIST_ITEM = re.compile(r' *(?:- |1\. )(.*)\n')
+LINK = re.compile(r'\[([^\]]*)\]\([^)\s]*\)')
+EMPHASIS = re.compile(r'(\*{1,3})(\S(?:.*?\S)?)\1')
+
+class Block:
+    __slots__ = ('markdown', 'text', 'style', 'start', 'end')
+
+    def __init__(self, markdown, text, style, start=None, end=None):
+        # markdown: the block as doc_markdown renders it, compared for equality
+        self.markdown = markdown
+        # text: paragraph text without its newline; None if it cannot be edited
+        self.text = text
+        # style: namedStyleType; Markdown paragraphs other than headings have None
+        self.style = style
+        self.start = start
+        self.end = end
+
+def get_service():
+    return google_clients.get_service('docs', 'v1', SCOPES)
+
+def plain_text(markdown):
+    # Undo render_inline's links and emphasis markers
+    return EMPHASIS.sub(r'\2', LINK.sub(r'\1', markdown))
+
+def doc_blocks(doc):
+    """Body blocks with their rendered Markdown and character range."""
+    lists = doc.get('lists', {})
+    blocks = []
+    for element in doc.get('body', {}).get('content', []):
+        start, end = element.get('startIndex'), element.get('endIndex')
+        if 'paragraph' in element:
+            paragraph = element['paragraph']
+            runs = paragraph.get('elements', [])
+            text = ''.join(r['textRun'].get('content', '') for r in runs if 'textRun' in r)
+            # Inline objects and breaks take up positions no text accounts
+            # for; such paragraphs are left alone
+            editable = (all('textRun' in r for r in runs) and text[-1:] == '\n'
+                        and isinstance(start, int) and utf16_len(text) == end - start)
+            blocks.append(Block(
+                render_paragraph(paragraph, lists), text[:-1] if editable else None,
+                paragraph.get('paragraphStyle', {}).get('namedStyleType', ''), start, end))
+        elif 'table' in element:
+            markdown = render_table(element['table'])
+            if markdown:
+                blocks.append(Block(markdown, None, None, start, end))
+        elif 'sectionBreak' in element and start:
+            blocks.append(Block(SECTION_BREAK, None, None, start, end))
+    return blocks
+
+def markdown_blocks(markdown):
+    """Split Markdown written by sync_doc.py back into the blocks it was rendered from."""
+    if markdown and not markdown.endswith('\n'):
+        markdown += '\n'
+    # Only \n separates lines; paragraphs may hold vertical tabs and the like
+    lines = [line + '\n' for line in markdown.split('\n')[:-1]]
+    blocks = []
+    i, n = 0, len(lines)
+    while i < n:
+        line = lines[i]
+        if line == '\n' and lines[i + 1:i + 3] == ['---\n', '\n']:
+            blocks.append(Block(SECTION_BREAK, None, None))
+            i += 3
+            continue
+        if line == '\n' and i + 1 < n and lines[i + 1].startswith('|'):
+            j = i + 1
+            while j < n and lines[j].startswith('|'):
+                j += 1
+            if j < n and lines[j] == '\n':
+                j += 1
+            blocks.append(Block(''.join(lines[i:j]), None, None))
+            i = j
+            continue
+        heading = HEADING.fullmatch(line)
+        if heading:
+            # Headings are followed by a blank line
+            j = i + 2 if i + 1 < n and lines[i + 1] == '\n' else i + 1
+            blocks.append(Block(''.join(lines[i:j]), plain_text(heading.group(2)),
+                                f'HEADING_{len(heading.group(1))}'))
+            i = j
+            continue
+        item = LIST_ITEM.fullmatch(line)
+        blocks.append(Block(line, plain_text(item.group(1) if item else line[:-1]), None))
+        i += 1
+    return blocks
+
+def _myers(a, b, limit):
+    # Matched (x, y) pairs of a shortest edit script, or None past limit edits
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, limit) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+def _backtrack(trace, x, y):
+    matches = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        prev_k = k + 1 if k == -d or (k != d and v[k - 1] < v[k + 1]) else k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((x, y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+def diff(a, b, limit=MAX_EDITS):
+    """Hunks (i1, i2, j1, j2), ascending: a[i1:i2] is replaced by b[j1:j2].
+
+    Myers' O(ND) algorithm on what is left after trimming the common prefix
+    and suffix, so a small edit to a long sequence costs little. Past
+    `limit` edits the trimmed middle comes back as a single hunk.
+    """
+    lo, hi_a, hi_b = 0, len(a), len(b)
+    while lo < hi_a and lo < hi_b and a[lo] == b[lo]:
+        lo += 1
+    while hi_a > lo and hi_b > lo and a[hi_a - 1] == b[hi_b - 1]:
+        hi_a -= 1
+        hi_b -= 1
+    if lo == hi_a and lo == hi_b:
+        return []
+    matches = _myers(a[lo:hi_a], b[lo:hi_b], limit)
+    if matches is None:
+        return [(lo, hi_a, lo, hi_b)]
+    hunks = []
+    i = j = 0
+    for x, y in matches + [(hi_a - lo, hi_b - lo)]:
+        if x > i or y > j:
+            hunks.append((lo + i, lo + x, lo + j, lo + y))
+        i, j = x + 1, y + 1
+    return hunks
+
+def _coalesce(hunks, gap=MERGE_GAP):
+    # Fewer, slightly larger requests beat many tiny ones in a rewritten line
+    merged = []
+    for hunk in hunks:
+        if merged and hunk[0] - merged[-1][1] < gap:
+            merged[-1] = (merged[-1][0], hunk[1], merged[-1][2], hunk[3])
+        else:
+            merged.append(hunk)
+    return merged
+
+def _utf16_offsets(text):
+    # Docs index (in UTF-16 code units) of every code-point offset into text
+    if text.isascii():
+        return range(len(text) + 1)
+    offsets = [0]
+    for ch in text:
+        offsets.append(offsets[-1] + (2 if ch > '\uffff' else 1))
+    return offsets
+
+def _restyle(target, styles):
+    """Style to set on a paragraph that may currently have any of `styles`, or None."""
+    if target:
+        return target if any(s != target for s in styles) else None
+    # Markdown only says "not a heading"; titles and the like are kept
+    return NORMAL_TEXT if any((s or '').startswith('HEADING_') for s in styles) else None
+
+def _plan_window(plan, old, new, i1, i2, j1, j2):
+    """Queue requests turning paragraphs old[i1:i2] into new[j1:j2], last first."""
+    at_end = i2 == len(old)
+    start = old[i1].start
+    a_text = ''.join(block.text + '\n' for block in old[i1:i2])
+    b_text = ''.join(block.text + '\n' for block in new[j1:j2])
+    if at_end:
+        # The body's final newline can never be deleted, so it is kept out of the diff
+        a_text, b_text = a_text[:-1], b_text[:-1]
+    hunks = _coalesce(diff(a_text, b_text))
+    if hunks and not at_end:
+        # Text may not be inserted at, nor a newline deleted right before,
+        # whatever follows the window; slide such a hunk one character left
+        h1, h2, k1, k2 = hunks[-1]
+        while h2 == len(a_text) and h1 > 0 and k1 > 0 and (
+                (h1 == h2 and b_text[k1 - 1] == b_text[k2 - 1])
+                or (k1 == k2 and a_text[h1 - 1] == a_text[h2 - 1])):
+            h1, h2, k1, k2 = h1 - 1, h2 - 1, k1 - 1, k2 - 1
+        hunks[-1] = (h1, h2, k1, k2)
+
+    # A paragraph's style belongs to its newline: kept newlines keep theirs,
+    # inserted ones split a paragraph and take the style of the next kept one
+    a_newlines, a_styles, offset = [], [], 0
+    for block in old[i1:i2]:
+        offset += len(block.text) + 1
+        a_newlines.append(offset - 1)
+        a_styles.append(block.style)
+    kept = {}
+    a_pos = b_pos = 0
+    for h1, h2, k1, k2 in hunks + [(len(a_text), None, None, None)]:
+        for n in range(bisect_left(a_newlines, a_pos), bisect_left(a_newlines, h1)):
+            kept[b_pos + a_newlines[n] - a_pos] = a_styles[n]
+        a_pos, b_pos = h2, k2
+    paragraphs, offset = [], 0
+    for block in new[j1:j2]:
+        offset += len(block.text) + 1
+        paragraphs.append(offset - 1)
+    b_newlines = paragraphs[:]
+    # Styles of newlines a hunk deleted may pass to the paragraph ending at
+    # the next kept newline, and so to any split off in front of it
+    merged = [set() for _ in paragraphs]
+    for h1, h2, k1, k2 in hunks:
+        deleted = range(bisect_left(a_newlines, h1), bisect_left(a_newlines, h2))
+        if deleted and paragraphs:
+            p = min(bisect_left(b_newlines, k2), len(paragraphs) - 1)
+            merged[p].update(a_styles[n] for n in deleted)
+
+    # Hunks count code points; requests count UTF-16 code units
+    units = _utf16_offsets(a_text)
+    for h1, h2, k1, k2 in reversed(hunks):
+        if h2 > h1:
+            plan.add({'deleteContentRange': {
+                'range': {'startIndex': start + units[h1], 'endIndex': start + units[h2]}}})
+        if k2 > k1:
+            plan.add({'insertText': {'location': {'index': start + units[h1]},
+                                     'text': b_text[k1:k2]}})
+
+    # Sets, because real Docs and the emulator disagree on which style a
+    # merged paragraph keeps; a paragraph is restyled unless all agree
+    following = {old[i2].style} if not at_end else set()
+    styles = []
+    for p in range(len(paragraphs) - 1, -1, -1):
+        if at_end and p == len(paragraphs) - 1:
+            possible = {a_styles[-1]}
+        elif b_newlines[p] in kept:
+            possible = {kept[b_newlines[p]]}
+        else:
+            possible = set(following)
+        possible |= merged[p]
+        styles.append(possible)
+        following = possible
+    styles.reverse()
+    position = start
+    for block, possible in zip(new[j1:j2], styles):
+        length = utf16_len(block.text) + 1
+        restyle = _restyle(block.style, possible)
+        if restyle:
+            plan.add({'updateParagraphStyle': {
+                'range': {'startIndex': position, 'endIndex': position + length},
+                'paragraphStyle': {'namedStyleType': restyle},
+                'fields': 'namedStyleType',
+            }})
+        position += length
+
+def _editable(blocks):
+    if any(block.text is None for block in blocks):
+        return False
+    return all(a.end == b.start for a, b in zip(blocks, blocks[1:]))
+
+def plan_push(plan, old, new):
+    """Queue the requests turning doc blocks `old` into Markdown blocks `new`.
+
+    Returns (changes planned, changes skipped). Changes are planned from the
+    end of the document backwards, each against indices no earlier request
+    has moved.
+    """
+    hunks = diff([block.markdown for block in old], [block.markdown for block in new])
+    planned = skipped = 0
+    for i1, i2, j1, j2 in reversed(hunks):
+        # Windows that only add or only remove paragraphs borrow the unchanged
+        # paragraph before them unless a paragraph follows to anchor the edit
+        followed = i2 < len(old) and old[i2].text is not None
+        anchored = True
+        if (i1 == i2 or j1 == j2) and not followed:
+            if i1 > 0 and j1 > 0:
+                i1, j1 = i1 - 1, j1 - 1
+            else:
+                anchored = i1 < i2 == len(old)
+        if not anchored or not _editable(old[i1:i2]) or not _editable(new[j1:j2]):
+            at = old[i1].start if i1 < len(old) else old[-1].end
+            print(f'Warning: skipping a change at index {at}; tables, section breaks '
+                  'and non-text elements are not pushed.')
+            skipped += 1
+            continue
+        _plan_window(plan, old, new, i1, i2, j1, j2)
+        planned += 1
+    return planned, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doc-id', required=True, help='Google Doc ID')
+    parser.add_argument(
+        '--input', default='docs/doc.md',
+        help='Markdown file written by sync_doc.py and edited since'
+    )
+    parser.add_argument(
+        '--state', default=DEFAULT_STATE_PATH,
+        help='Sync state file; the doc must still be at the revision --input was synced from'
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Push even if the doc changed since --input was synced, reverting those edits'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
+    )
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiling.start(args.profile)
+    with open(args.input, encoding='utf-8') as f:
+        markdown = f.read()
+    service = get_service()
+    doc = service.documents().get(documentId=args.doc_id).execute()
+    entry = load_state(args.state).get(args.doc_id) or {}
+    synced = entry.get('output') == args.input and entry.get('revisionId') == doc.get('revisionId')
+    if not synced and not args.force:
+        print(f'Warning: {args.doc_id} has changed since {args.input} was synced; '
+              'run sync_doc.py and redo the edits, or pass --force to overwrite.')
+        return
+    old = doc_blocks(doc)
+    plan = Plan(DocIndex(doc))
+    if ''.join(block.markdown for block in old) != markdown:
+        planned, skipped = plan_push(plan, old, markdown_blocks(markdown))
+    else:
+        planned = skipped = 0
+    if args.dry_run:
+        plan.print_dry_run()
+        return
+    if not plan.requests:
+        print('The doc already matches the Markdown; no changes made.')
+        return
+    plan.execute(service, args.doc_id)
+    print(f'Pushed {planned} change(s) with {plan.sent} request(s) in '
+          f'{plan.batches} batchUpdate call(s); skipped {skipped}.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""Keep Google Docs synced by polling their revisionId on an adaptive schedule."""
+import hmac
+import heapq
+import time
+import uuid
+import random
+import argparse
+import ipaddress
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from git_writer import GitWriter
+import google_clients
+import profiling
+from sync_doc import (
+    fetch_revision_id, get_service, load_manifest, snapshot_path,
+    sync_doc, sync_doc_split,
+)
+from sync_state import (
+    DEFAULT_CHANGES_PATH, DEFAULT_STATE_PATH, append_changes, load_state, save_state,
+)
+
+# files.watch accepts the narrowest Drive scope
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
+
+MIN_INTERVAL = 30.0
+MAX_INTERVAL = 3600.0
+# Each unchanged poll multiplies a doc's interval by this
+BACKOFF = 2.0
+# Intervals are stretched by up to this fraction so docs do not poll in lockstep
+JITTER = 0.1
+# Seconds a push channel is requested for; channels are renewed before expiry
+CHANNEL_TTL = 86400
+CHANNEL_RENEW_MARGIN = 600
+
+class DocSchedule:
+    __slots__ = ('doc_id', 'output', 'revision_id', 'interval', 'due', 'busy', 'poked',
+                 'failures')
+
+    def __init__(self, doc_id, output, revision_id, interval, due):
+        self.doc_id = doc_id
+        self.output = output
+        # Last revision seen, so an unchanged poll never reaches sync_doc
+        self.revision_id = revision_id
+        self.interval = interval
+        self.due = due
+        # busy: being polled right now; poked: a notification arrived meanwhile
+        self.busy = False
+        self.poked = False
+        # Polls in a row that raised; retried on their own backoff
+        self.failures = 0
+
+class Scheduler:
+    """Docs ordered by next-due time; safe to poke from other threads.
+
+    Rescheduling pushes a fresh (due, seq, doc_id) entry instead of
+    re-heapifying, and entries whose time no longer matches the doc are
+    dropped when they surface.
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, jitter=JITTER, clock=time.monotonic, seed=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.clock = clock
+        self.docs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._random = random.Random(seed)
+
+    def add(self, doc_id, output, revision_id=None):
+        # New docs are due at once
+        with self._lock:
+            doc = DocSchedule(doc_id, output, revision_id, self.min_interval, self.clock())
+            self.docs[doc_id] = doc
+            self._push(doc)
+        return doc
+
+    def _push(self, doc):
+        heapq.heappush(self._heap, (doc.due, next(self._seq), doc.doc_id))
+
+    def due(self):
+        """Pop every doc whose time has come, earliest first, and mark it busy."""
+        now = self.clock()
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, _, doc_id = heapq.heappop(self._heap)
+                doc = self.docs[doc_id]
+                if doc.busy or when != doc.due:
+                    continue
+                doc.busy = True
+                ready.append(doc)
+        return ready
+
+    def done(self, doc, changed):
+        """Reschedule a polled doc: at the minimum if it changed, else backed off."""
+        with self._lock:
+            if changed or doc.poked:
+                doc.interval = self.min_interval
+            else:
+                doc.interval = min(doc.interval * self.backoff, self.max_interval)
+            delay = doc.interval * (1 + self.jitter * self._random.random())
+            # A notification that arrived mid-poll may describe a newer revision
+            doc.due = self.clock() + (0 if doc.poked else delay)
+            doc.busy = doc.poked = False
+            doc.failures = 0
+            self._push(doc)
+
+    def failed(self, doc):
+        """Reschedule a doc whose poll raised; returns the seconds until the retry.
+
+        Retries start at min_interval and back off per failure in a row.
+        The polling interval is kept, so a failure is not taken for an
+        unchanged poll.
+        """
+        with self._lock:
+            doc.failures += 1
+            delay = min(self.min_interval * self.backoff ** (doc.failures - 1),
+                        self.max_interval)
+            delay *= 1 + self.jitter * self._random.random()
+            doc.due = self.clock() + delay
+            doc.busy = doc.poked = False
+            self._push(doc)
+        return delay
+
+    def poke(self, doc_id):
+        """Make a doc due now, e.g. because a push notification arrived."""
+        with self._lock:
+            doc = self.docs.get(doc_id)
+            if doc is None:
+                return False
+            if doc.busy:
+                doc.poked = True
+            else:
+                doc.interval = self.min_interval
+                doc.due = self.clock()
+                self._push(doc)
+        self._wake.set()
+        return True
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def wait(self, limit=None):
+        """Sleep until the next doc is due, a poke arrives or limit seconds pass."""
+        due = self.next_due()
+        delay = self.max_interval if due is None else due - self.clock()
+        if limit is not None:
+            delay = min(delay, limit)
+        if delay > 0:
+            self._wake.wait(delay)
+        self._wake.clear()
+
+def poll(service, doc, state, split=False, changes=None, snapshot=False):
+    """Sync doc if its revision moved; returns (revision moved, changed paths)."""
+    revision_id = fetch_revision_id(service, doc.doc_id)
+    if revision_id and revision_id == doc.revision_id:
+        return False, []
+    if split:
+        paths = sync_doc_split(service, doc.doc_id, doc.output, state, changes=changes,
+                               revision_id=revision_id, snapshot=snapshot)
+    elif sync_doc(service, doc.doc_id, doc.output, state, changes=changes,
+                  revision_id=revision_id, snapshot=snapshot):
+        paths = [doc.output, snapshot_path(doc.output)] if snapshot else [doc.output]
+    else:
+        paths = []
+    doc.revision_id = revision_id
+    return True, paths
+
+def channel_token(doc_id, secret=None):
+    # Drive echoes the token back in X-Goog-Channel-Token with every notification
+    return f'{doc_id}:{secret}' if secret else doc_id
+
+class NotificationHandler(BaseHTTPRequestHandler):
+    """Receives Drive push notifications and pokes the doc named by the channel token."""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        doc_id, _, given = self.headers.get('X-Goog-Channel-Token', '').partition(':')
+        secret = self.server.secret
+        if secret and not hmac.compare_digest(given, secret):
+            self.send_response(403)
+            self.end_headers()
+            return
+        # "sync" only confirms a new channel; anything else means the file changed
+        if self.headers.get('X-Goog-Resource-State') != 'sync':
+            self.server.scheduler.poke(doc_id)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def start_receiver(scheduler, host='127.0.0.1', port=8080, secret=None):
+    """Serve NotificationHandler on a background thread; returns the server.
+
+    Off the loopback interface anyone could trigger syncs, so a secret is required.
+    """
+    if not secret and not is_loopback(host):
+        raise ValueError(f'A webhook secret is required to listen on {host}')
+    server = ThreadingHTTPServer((host, port), NotificationHandler)
+    server.daemon_threads = True
+    server.scheduler = scheduler
+    server.secret = secret
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def watch_docs(drive, doc_ids, address, secret=None, ttl=CHANNEL_TTL):
+    """Open a files.watch channel per doc; returns {doc_id: channel}."""
+    expiration = int((time.time() + ttl) * 1000)
+    channels = {}
+    for doc_id in doc_ids:
+        try:
+            channels[doc_id] = drive.files().watch(fileId=doc_id, body={
+                'id': str(uuid.uuid4()),
+                'type': 'web_hook',
+                'address': address,
+                'token': channel_token(doc_id, secret),
+                'expiration': expiration,
+            }).execute()
+        except Exception as exc:  # polling still covers this doc
+            print(f'Warning: watching {doc_id} failed: {exc}')
+    return channels
+
+def stop_channels(drive, channels):
+    for channel in channels.values():
+        try:
+            drive.channels().stop(
+                body={'id': channel['id'], 'resourceId': channel['resourceId']}).execute()
+        except Exception:  # an expired channel is already gone
+            pass
+
+class ChannelRenewer:
+    """renew() for SyncDaemon.run: reopens every doc's channel and stops the old ones."""
+
+    def __init__(self, drive, doc_ids, address, secret=None, ttl=CHANNEL_TTL,
+                 margin=CHANNEL_RENEW_MARGIN):
+        self.drive = drive
+        self.doc_ids = list(doc_ids)
+        self.address = address
+        self.secret = secret
+        self.ttl = ttl
+        self.margin = margin
+        self.channels = {}
+
+    def __call__(self):
+        old, self.channels = self.channels, watch_docs(
+            self.drive, self.doc_ids, self.address, self.secret, self.ttl)
+        stop_channels(self.drive, old)
+        print(f'Watching {len(self.channels)} of {len(self.doc_ids)} doc(s) for changes')
+        # Drive may grant less than the requested lifetime
+        expirations = [int(c['expiration']) / 1000
+                       for c in self.channels.values() if c.get('expiration')]
+        return min(expirations, default=time.time() + self.ttl) - self.margin
+
+    def stop(self):
+        stop_channels(self.drive, self.channels)
+        self.channels = {}
+
+class SyncDaemon:
+    """Polls due docs with a thread pool, then saves state and commits once per round."""
+
+    def __init__(self, service, scheduler, state, state_path, changes_path=DEFAULT_CHANGES_PATH,
+                 split=False, workers=8, commit=False, snapshot=False):
+        self.service = service
+        self.scheduler = scheduler
+        self.state = state
+        self.state_path = state_path
+        self.changes_path = changes_path
+        self.split = split
+        self.workers = workers
+        self.commit = commit
+        self.snapshot = snapshot
+        # Finds the repository once, not on every round
+        self.writer = GitWriter() if commit else None
+        # Paths, synced docs and a push left over from a failed commit or push
+        self.pending = []
+        self.pending_docs = 0
+        self.unpushed = False
+        self.polls = 0
+        self.syncs = 0
+        self.failures = 0
+
+    def add(self, doc_id, output):
+        # Start from the synced revision so a restart does not re-sync everything
+        entry = self.state.get(doc_id) or {}
+        self.scheduler.add(doc_id, output, entry.get('revisionId'))
+
+    def run_round(self, pool):
+        """Poll every due doc; returns the paths this round changed."""
+        docs = self.scheduler.due()
+        if not docs:
+            return []
+        changes = []
+
+        def job(doc):
+            try:
+                return poll(self.service, doc, self.state, self.split, changes,
+                            self.snapshot)
+            except Exception as exc:
+                return exc
+
+        changed = []
+        synced = 0
+        for doc, result in zip(docs, pool.map(job, docs)):
+            if isinstance(result, Exception):
+                delay = self.scheduler.failed(doc)
+                self.failures += 1
+                print(f'Warning: syncing {doc.doc_id} failed ({doc.failures} in a row); '
+                      f'retrying in {delay:.0f}s: {result}')
+                continue
+            moved, paths = result
+            self.scheduler.done(doc, moved)
+            synced += moved
+            changed.extend(paths)
+        self.polls += len(docs)
+        self.syncs += synced
+        if synced:
+            save_state(self.state, self.state_path)
+            if changes:
+                append_changes(changes, self.changes_path)
+                if changed:
+                    changed.append(self.changes_path)
+            print(f'Polled {len(docs)} doc(s), synced {synced}, '
+                  f'{len(changed)} file(s) changed.')
+        if self.commit and (changed or self.pending or self.unpushed):
+            if changed:
+                self.pending_docs += synced
+            self.commit_pending(changed + [self.state_path] if changed else [])
+        return changed
+
+    def commit_pending(self, paths):
+        """Commit and push paths plus whatever an earlier round failed to."""
+        self.pending.extend(p for p in paths if p not in self.pending)
+        message = f'Update {self.pending_docs} doc(s)'
+        try:
+            if self.pending:
+                sha = self.writer.commit(self.pending, message)
+                self.pending = []
+                self.pending_docs = 0
+                if sha:
+                    print(f'Committed {sha[:12]}: {message}')
+                    self.unpushed = True
+            if self.unpushed:
+                self.writer.push()
+                self.unpushed = False
+        except Exception as exc:  # a failed commit or push must not stop the daemon
+            print(f'Warning: commit or push failed; retrying next round: {exc}')
+
+    def run(self, duration=None, renew=None):
+        """Poll until duration seconds pass (forever if None).
+
+        renew() is called when push channels are due for renewal and returns
+        the wall-clock time (seconds) when they next are.
+        """
+        stop = None if duration is None else self.scheduler.clock() + duration
+        renew_at = renew() if renew else None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while stop is None or self.scheduler.clock() < stop:
+                if renew_at is not None and time.time() >= renew_at:
+                    renew_at = renew()
+                self.run_round(pool)
+                limit = None if stop is None else stop - self.scheduler.clock()
+                if renew_at is not None:
+                    until_renew = renew_at - time.time()
+                    limit = until_renew if limit is None else min(limit, until_renew)
+                self.scheduler.wait(limit)
+
+def parse_listen(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--doc-id', help='Google Doc ID')
+    source.add_argument(
+        '--manifest',
+        help='JSON file mapping Google Doc IDs to output Markdown paths'
+    )
+    parser.add_argument('--output', default='docs/doc.md', help='Output path for --doc-id')
+    parser.add_argument(
+        '--split', action='store_true',
+        help='Write one Markdown file per H1 section (see sync_doc.py --split)'
+    )
+    parser.add_argument(
+        '--state', default=DEFAULT_STATE_PATH,
+        help='Path to the sync state file shared with sync_doc.py'
+    )
+    parser.add_argument(
+        '--changes-log', default=DEFAULT_CHANGES_PATH,
+        help='Log of which sections each sync changed (read by correlate_activity.py)'
+    )
+    parser.add_argument(
+        '--commit', action='store_true',
+        help='Commit and push the files each round changed'
+    )
+    parser.add_argument(
+        '--snapshot', action='store_true',
+        help='Save a DocumentIR snapshot next to the Markdown (see sync_doc.py --snapshot)'
+    )
+    parser.add_argument('--workers', type=int, default=8, help='Docs polled concurrently')
+    parser.add_argument(
+        '--rate', type=float, default=5.0,
+        help='Maximum Docs API requests per second across all workers'
+    )
+    parser.add_argument(
+        '--min-interval', type=float, default=MIN_INTERVAL,
+        help='Seconds between polls of a doc that just changed'
+    )
+    parser.add_argument(
+        '--max-interval', type=float, default=MAX_INTERVAL,
+        help='Longest wait between polls of an idle doc'
+    )
+    parser.add_argument(
+        '--listen', metavar='[HOST:]PORT',
+        help='Accept Drive push notifications on this address'
+    )
+    parser.add_argument(
+        '--watch-address',
+        help='Public HTTPS URL that reaches --listen; registers a files.watch '
+             'channel per doc and renews it before it expires'
+    )
+    parser.add_argument(
+        '--webhook-secret',
+        help='Shared secret carried in channel tokens; other notifications are rejected. '
+             'Required unless --listen is a loopback address'
+    )
+    parser.add_argument(
+        '--duration', type=float,
+        help='Stop after this many seconds (default: run until interrupted)'
+    )
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    if args.listen and not args.webhook_secret and not is_loopback(parse_listen(args.listen)[0]):
+        parser.error('--webhook-secret is required when --listen is not a loopback address')
+    profiling.start(args.profile)
+    manifest = load_manifest(args.manifest) if args.manifest else {args.doc_id: args.output}
+
+    scheduler = Scheduler(args.min_interval, args.max_interval)
+    daemon = SyncDaemon(get_service(rate=args.rate), scheduler, load_state(args.state),
+                        args.state, args.changes_log, args.split, args.workers, args.commit,
+                        args.snapshot)
+    for doc_id, output_path in manifest.items():
+        daemon.add(doc_id, output_path)
+
+    server = None
+    if args.listen:
+        host, port = parse_listen(args.listen)
+        server = start_receiver(scheduler, host, port, args.webhook_secret)
+        host, port = server.server_address[:2]
+        print(f'Listening for push notifications on {host}:{port}')
+    renew = None
+    if args.watch_address:
+        drive = google_clients.get_service('drive', 'v3', DRIVE_SCOPES)
+        renew = ChannelRenewer(drive, manifest, args.watch_address, args.webhook_secret)
+
+    print(f'Polling {len(manifest)} doc(s) every {args.min_interval:g}-{args.max_interval:g}s')
+    try:
+        daemon.run(args.duration, renew)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if renew is not None:
+            renew.stop()
+        if server is not None:
+            server.shutdown()
+    print(f'Stopped after {daemon.polls} poll(s), {daemon.syncs} sync(s) and '
+          f'{daemon.failures} failure(s).')
+
+if __name__ == '__main__':
+    main()
@@ -1,88 +1,427 @@
 #!/usr/bin/env python3
-"""Fetch a Google Doc and convert it to Markdown, then optionally commit and push."""
+"""Fetch Google Docs and convert them to Markdown, then optionally commit and push."""
 import os
+import json
+import time
+import hashlib
 import argparse
-import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from doc_index import DocIndex
+from doc_ir import DocumentIR
+from doc_markdown import iter_elements, iter_markdown, write_chunks
+from git_writer import GitWriter
+import google_clients
+import profiling
+from sync_state import (
+    DEFAULT_CHANGES_PATH, DEFAULT_STATE_PATH, append_changes, load_state, save_state,
+    section_hash,
+)
+from tag_sections import unique_slug
 
 # OAuth2 scopes for Google Docs
 SCOPES = ['https://www.googleapis.com/auth/documents.readonly']
 
-def get_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError(
-            'Service account credentials not found. '
-            'Set GOOGLE_APPLICATION_CREDENTIALS to a valid JSON file.'
-        )
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    service = build('docs', 'v1', credentials=creds)
-    return service
-
-def fetch_doc(doc_id):
-    service = get_service()
+# Bump whenever parse_doc_to_markdown output changes so cached sections re-render
+FORMAT_VERSION = 2
+# Split mode file names; slugify never produces a leading underscore
+INDEX_NAME = 'index'
+PREAMBLE_NAME = '_preamble'
+SNAPSHOT_SUFFIX = '.ir'
+
+def get_service(rate=None):
+    # One thread-safe client; rate caps requests per second across all workers
+    bucket = google_clients.TokenBucket(rate) if rate else None
+    return google_clients.get_service('docs', 'v1', SCOPES, bucket=bucket)
+
+def fetch_doc(doc_id, service=None):
+    service = service or get_service()
     doc = service.documents().get(documentId=doc_id).execute()
     return doc
 
+def fetch_revision_id(service, doc_id):
+    # Fields-masked metadata fetch: a few bytes instead of the whole body
+    meta = service.documents().get(
+        documentId=doc_id, fields='revisionId').execute()
+    return meta.get('revisionId')
+
+def snapshot_path(output_path, split=False):
+    # docs/doc.md -> docs/doc.ir; split output directories hold index.ir
+    if split:
+        return os.path.join(output_path, f'{INDEX_NAME}{SNAPSHOT_SUFFIX}')
+    return os.path.splitext(output_path)[0] + SNAPSHOT_SUFFIX
+
+def split_sections(index):
+    # (title, elements) per H1 section; content before the first H1 has no title
+    content = index.content
+    first = index.sections[0].first if index.sections else len(content)
+    sections = [(None, content[:first])] if first else []
+    sections.extend((s.name, content[s.first:s.stop]) for s in index.sections)
+    return sections
+
 def parse_doc_to_markdown(doc):
-    md = ''
-    body = doc.get('body', {}).get('content', [])
-    for element in body:
-        paragraph = element.get('paragraph')
-        if not paragraph:
-            continue
-        style = paragraph.get('paragraphStyle', {}).get('namedStyleType', '')
-        text_runs = paragraph.get('elements', [])
-        text = ''.join(
-            run.get('textRun', {}).get('content', '')
-            for run in text_runs
-        )
-        text = text.rstrip('\n')
-        if style == 'HEADING_1':
-            md += f'# {text}\n\n'
-        elif style == 'HEADING_2':
-            md += f'## {text}\n\n'
-        else:
-            md += f'{text}\n'
-    return md
+    return ''.join(iter_markdown(doc))
 
 def write_markdown(md, output_path):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(md)
+    write_chunks([md], output_path)
+
+def previous_chunks(entry, output_path):
+    # Slice the last written file back into sections using the recorded lengths
+    if not entry or not os.path.isfile(output_path):
+        return {}
+    with open(output_path, encoding='utf-8', newline='') as f:
+        text = f.read()
+    sections = entry.get('sections', [])
+    if sum(s['length'] for s in sections) != len(text):
+        # File was edited by hand; fall back to a full render
+        return {}
+    chunks = {}
+    offset = 0
+    for s in sections:
+        chunks[s['hash']] = text[offset:offset + s['length']]
+        offset += s['length']
+    return chunks
+
+def section_slugs(titles):
+    # The names split mode gives section files; also used in the change log
+    taken = {INDEX_NAME}
+    return [PREAMBLE_NAME if t is None else unique_slug(t, taken) for t in titles]
+
+def record_changes(changes, doc_id, revision_id, slugs, records, old_records):
+    """Append which sections this sync changed, for activity correlation.
+
+    Edits made since the previous sync can only have touched these sections.
+    Syncs that changed nothing are logged too, so an edit is never blamed on
+    a later window; without a previous sync there is no window at all.
+    """
+    if changes is None or not old_records:
+        return
+    old = {r['hash'] for r in old_records}
+    now = datetime.now(timezone.utc)
+    changes.append({
+        # Same shape as Drive Activity timestamps, so they compare as strings
+        'time': now.strftime('%Y-%m-%dT%H:%M:%S.') + f'{now.microsecond // 1000:03d}Z',
+        'docId': doc_id,
+        'revisionId': revision_id,
+        'sections': [slug for slug, r in zip(slugs, records) if r['hash'] not in old],
+    })
+
+def sync_doc(service, doc_id, output_path, state, full=False, changes=None,
+             revision_id=None, snapshot=False):
+    """Render doc_id into output_path, returning True if the file changed.
+
+    revision_id is a revisionId the caller has just fetched, which saves
+    the metadata call. With snapshot, every new revision is also saved as a
+    DocumentIR snapshot next to the Markdown and counts as a change.
+    """
+    entry = state.get(doc_id)
+    if entry and (entry.get('format') != FORMAT_VERSION
+                  or entry.get('output') != output_path):
+        entry = None
+    if not full and entry and os.path.isfile(output_path):
+        revision_id = revision_id or fetch_revision_id(service, doc_id)
+        if revision_id and revision_id == entry.get('revisionId'):
+            print(f'{doc_id}: revision {revision_id} already synced; nothing to do.')
+            return False
+    doc = fetch_doc(doc_id, service)
+    if snapshot:
+        DocumentIR.from_json(doc).save(snapshot_path(output_path))
+    lists = doc.get('lists', {})
+    lists_hash = section_hash([lists])
+    sections = split_sections(DocIndex(doc))
+    records = [
+        {'title': title, 'hash': section_hash(elements), 'length': 0}
+        for title, elements in sections
+    ]
+    if full or not entry or entry.get('listsHash') != lists_hash:
+        previous = {}
+    else:
+        previous = previous_chunks(entry, output_path)
+    old_hashes = [s['hash'] for s in entry.get('sections', [])] if entry else None
+    changed = not previous or old_hashes != [r['hash'] for r in records]
+    rendered = 0
+
+    def chunks():
+        # Reuse unchanged sections verbatim; stream the rest element by element
+        nonlocal rendered
+        for record, (_, elements) in zip(records, sections):
+            chunk = previous.get(record['hash'])
+            if chunk is not None:
+                record['length'] = len(chunk)
+                yield chunk
+                continue
+            rendered += 1
+            for piece in iter_elements(elements, lists):
+                record['length'] += len(piece)
+                yield piece
+
+    if changed:
+        write_chunks(chunks(), output_path)
+    else:
+        records = entry['sections']
+    record_changes(changes, doc_id, doc.get('revisionId'),
+                   section_slugs([title for title, _ in sections]), records,
+                   entry.get('sections') if entry else None)
+    state[doc_id] = {
+        'revisionId': doc.get('revisionId'),
+        'output': output_path,
+        'format': FORMAT_VERSION,
+        'listsHash': lists_hash,
+        'sections': records,
+    }
+    print(f'{doc_id}: re-rendered {rendered} of {len(records)} section(s) '
+          f'for revision {doc.get("revisionId")}.')
+    return changed or snapshot
+
+def content_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def write_if_changed(text, path, old_digest):
+    """Write text unless the file already holds it; returns (digest, written)."""
+    digest = content_digest(text)
+    if digest == old_digest and os.path.isfile(path):
+        return digest, False
+    write_chunks([text], path)
+    return digest, True
+
+def render_index(records):
+    lines = [f'- [{r["title"]}]({os.path.basename(r["path"])})'
+             for r in records if r['title'] is not None]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def sync_doc_split(service, doc_id, output_dir, state, full=False, changes=None,
+                   revision_id=None, snapshot=False):
+    """Render each H1 section of doc_id to its own file in output_dir.
+
+    Files are named by the section's tag_sections slug and listed in
+    index.md. Sections are cached by the hash of their source elements and
+    files by the digest of their Markdown, so a section is only re-rendered
+    when it changed and only rewritten when its Markdown did. Returns the
+    paths written or removed. revision_id and snapshot are as for sync_doc.
+    """
+    entry = state.get(doc_id)
+    if entry and (entry.get('format') != FORMAT_VERSION
+                  or entry.get('output') != output_dir or not entry.get('split')):
+        entry = None
+    if not full and entry and os.path.isdir(output_dir):
+        revision_id = revision_id or fetch_revision_id(service, doc_id)
+        if revision_id and revision_id == entry.get('revisionId'):
+            print(f'{doc_id}: revision {revision_id} already synced; nothing to do.')
+            return []
+    doc = fetch_doc(doc_id, service)
+    changed = []
+    if snapshot:
+        path = snapshot_path(output_dir, split=True)
+        DocumentIR.from_json(doc).save(path)
+        changed.append(path)
+    lists = doc.get('lists', {})
+    lists_hash = section_hash([lists])
+    old_sections = entry.get('sections', []) if entry else []
+    digests = {s['path']: s['digest'] for s in old_sections}
+    if full or not entry or entry.get('listsHash') != lists_hash:
+        cached = {}
+    else:
+        cached = {(s['path'], s['hash']): s for s in old_sections}
+    sections = split_sections(DocIndex(doc))
+    slugs = section_slugs([title for title, _ in sections])
+    records = []
+    rendered = 0
+    for slug, (title, elements) in zip(slugs, sections):
+        path = os.path.join(output_dir, f'{slug}.md')
+        source_hash = section_hash(elements)
+        hit = cached.get((path, source_hash))
+        if hit and os.path.isfile(path):
+            digest = hit['digest']
+        else:
+            rendered += 1
+            digest, written = write_if_changed(
+                ''.join(iter_elements(elements, lists)), path, digests.get(path))
+            if written:
+                changed.append(path)
+        records.append({'title': title, 'path': path, 'hash': source_hash, 'digest': digest})
+    # Sections that disappeared or were renamed leave their old file behind
+    current = {r['path'] for r in records}
+    for path in sorted(set(digests) - current):
+        if os.path.isfile(path):
+            os.remove(path)
+            changed.append(path)
+    index_path = os.path.join(output_dir, f'{INDEX_NAME}.md')
+    index_digest, written = write_if_changed(
+        render_index(records), index_path, entry.get('indexDigest') if entry else None)
+    if written:
+        changed.append(index_path)
+    record_changes(changes, doc_id, doc.get('revisionId'), slugs, records, old_sections)
+    state[doc_id] = {
+        'revisionId': doc.get('revisionId'),
+        'output': output_dir,
+        'split': True,
+        'format': FORMAT_VERSION,
+        'listsHash': lists_hash,
+        'indexDigest': index_digest,
+        'sections': records,
+    }
+    print(f'{doc_id}: re-rendered {rendered} of {len(records)} section(s), '
+          f'{len(changed)} file(s) changed for revision {doc.get("revisionId")}.')
+    return changed
+
+def load_manifest(path):
+    # JSON object mapping Google Doc ID to its Markdown output path
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
 
-def git_commit_and_push(path, message):
-    subprocess.run(['git', 'add', path], check=True)
-    subprocess.run(['git', 'commit', '-m', message], check=True)
-    subprocess.run(['git', 'push'], check=True)
+def sync_many(service, manifest, state, workers=8, full=False, split=False, changes=None,
+              snapshot=False):
+    """Sync every doc in manifest concurrently; returns (changed paths, timings)."""
+    changed = []
+    timings = {}
+
+    def job(doc_id, output_path):
+        start = time.perf_counter()
+        try:
+            if split:
+                result = sync_doc_split(
+                    service, doc_id, output_path, state, full=full, changes=changes,
+                    snapshot=snapshot)
+            else:
+                result = sync_doc(
+                    service, doc_id, output_path, state, full=full, changes=changes,
+                    snapshot=snapshot)
+            return result, time.perf_counter() - start
+        except Exception as exc:
+            return exc, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(job, doc_id, output_path): (doc_id, output_path)
+            for doc_id, output_path in manifest.items()
+        }
+        for future in as_completed(futures):
+            doc_id, output_path = futures[future]
+            result, elapsed = future.result()
+            timings[doc_id] = (elapsed, result)
+            if isinstance(result, Exception):
+                print(f'Warning: syncing {doc_id} failed: {result}')
+            elif split:
+                changed.extend(result)
+            elif result:
+                changed.append(output_path)
+                if snapshot:
+                    changed.append(snapshot_path(output_path))
+    return changed, timings
+
+def print_timings(timings):
+    print(f'{"doc":<48} {"seconds":>8}  status')
+    for doc_id, (elapsed, result) in sorted(
+            timings.items(), key=lambda item: item[1][0], reverse=True):
+        if isinstance(result, Exception):
+            status = 'failed'
+        else:
+            status = 'changed' if result else 'unchanged'
+        print(f'{doc_id:<48} {elapsed:>8.2f}  {status}')
+
+def git_commit(paths, message, push=False, writer=None):
+    # One fast-import commit of the paths whose contents differ from the branch
+    writer = writer or GitWriter()
+    sha = writer.commit(paths, message)
+    if sha is None:
+        print('No changes to commit.')
+        return None
+    print(f'Committed {sha[:12]}: {message}')
+    if push:
+        writer.push()
+    return sha
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('--doc-id', required=True, help='Google Doc ID')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--doc-id', help='Google Doc ID')
+    source.add_argument(
+        '--manifest',
+        help='JSON file mapping Google Doc IDs to output Markdown paths'
+    )
     parser.add_argument(
         '--output', default='docs/doc.md',
         help='Path to output Markdown file'
     )
     parser.add_argument(
         '--commit', action='store_true',
-        help='Commit changes to git'
+        help='Commit the changed files to the checked-out branch in one commit'
     )
     parser.add_argument(
         '--push', action='store_true',
         help='Push changes after commit'
     )
+    parser.add_argument(
+        '--state', default=DEFAULT_STATE_PATH,
+        help='Path to the sync state file (revisionId and section hashes)'
+    )
+    parser.add_argument(
+        '--full', action='store_true',
+        help='Ignore the sync state and re-render every section'
+    )
+    parser.add_argument(
+        '--changes-log', default=DEFAULT_CHANGES_PATH,
+        help='Log of which sections each sync changed (read by correlate_activity.py)'
+    )
+    parser.add_argument(
+        '--split', action='store_true',
+        help='Treat --output (or manifest paths) as a directory and write one '
+             'Markdown file per H1 section plus index.md'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='Docs fetched concurrently in --manifest mode'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=5.0,
+        help='Maximum Docs API requests per second across all workers'
+    )
+    parser.add_argument(
+        '--snapshot', action='store_true',
+        help='Also save each new revision as a binary DocumentIR snapshot next to '
+             'the Markdown (doc.ir, or index.ir with --split) for offline tools'
+    )
+    profiling.add_argument(parser)
     args = parser.parse_args()
+    profiling.start(args.profile)
 
-    doc = fetch_doc(args.doc_id)
-    md = parse_doc_to_markdown(doc)
-    write_markdown(md, args.output)
+    service = get_service(rate=args.rate)
+    state = load_state(args.state)
+    changes = []
+    if args.manifest:
+        changed, timings = sync_many(
+            service, load_manifest(args.manifest), state, args.workers, args.full,
+            args.split, changes, args.snapshot)
+        print_timings(timings)
+        # Count docs, not paths: split output and snapshots add several per doc
+        synced = sum(1 for _, result in timings.values()
+                     if result and not isinstance(result, Exception))
+        message = f'Update {synced} doc(s)'
+    elif args.split:
+        changed = sync_doc_split(
+            service, args.doc_id, args.output, state, full=args.full, changes=changes,
+            snapshot=args.snapshot)
+        message = f'Update doc {args.doc_id}'
+    else:
+        changed = sync_doc(
+            service, args.doc_id, args.output, state, full=args.full, changes=changes,
+            snapshot=args.snapshot)
+        changed = [args.output] if changed else []
+        if changed and args.snapshot:
+            changed.append(snapshot_path(args.output))
+        message = f'Update doc {args.doc_id}'
+    save_state(state, args.state)
+    if changes:
+        append_changes(changes, args.changes_log)
+        # Syncs that changed no file do not commit just for the log line
+        if changed:
+            changed.append(args.changes_log)
 
-    if args.commit:
-        git_commit_and_push(args.output, f'Update doc {args.doc_id}')
-        if args.push:
+    # Every changed file lands in one commit; unchanged section files are
+    # never staged
+    if args.commit and changed:
+        if git_commit(changed + [args.state], message, push=args.push) and args.push:
             print('Changes pushed.')
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Local sync state: last synced revisionId and per-section hashes for each Doc."""
+import os
+import json
+import hashlib
+
+DEFAULT_STATE_PATH = 'docs/.sync_state.json'
+# One line per sync that changed sections: when, which doc, which sections
+DEFAULT_CHANGES_PATH = 'docs/.section_changes.jsonl'
+
+# Keys that move whenever earlier content changes; they are excluded from
+# section hashes so an edit in one section does not dirty every later one.
+_POSITION_KEYS = ('startIndex', 'endIndex')
+
+def load_state(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            # A corrupt state file only costs us one full sync
+            return {}
+
+def save_state(state, path):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def append_changes(changes, path):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for change in changes:
+            f.write(json.dumps(change, separators=(',', ':')) + '\n')
+
+def _strip_positions(obj):
+    if isinstance(obj, dict):
+        return {
+            k: _strip_positions(v) for k, v in obj.items()
+            if k not in _POSITION_KEYS
+        }
+    if isinstance(obj, list):
+        return [_strip_positions(v) for v in obj]
+    return obj
+
+def section_hash(elements):
+    h = hashlib.sha1()
+    for el in elements:
+        h.update(json.dumps(
+            _strip_positions(el), sort_keys=True, separators=(',', ':')
+        ).encode('utf-8'))
+    return h.hexdigest()
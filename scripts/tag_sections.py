@@ -4,94 +4,159 @@ import os
 import re
 import json
 import argparse
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from bisect import bisect_left
+
+from doc_fields import MASKS
+from doc_index import fetch_index
+from doc_plan import Plan
+import google_clients
+import profiling
 
 # OAuth2 scopes for Google Docs write access
 SCOPES = ['https://www.googleapis.com/auth/documents']
 
+# Tags are named TAG_PREFIX + slug. Ranges without the prefix belong to
+# someone else and are never moved or deleted
+TAG_PREFIX = 'section:'
+TAG_NAME = re.compile(re.escape(TAG_PREFIX) + r'([a-z0-9]+(?:-[a-z0-9]+)*)')
+
 def slugify(text):
     # Lowercase, replace non-alphanum with dashes
     s = text.lower()
     s = re.sub(r'[^a-z0-9]+', '-', s)
     return s.strip('-')
 
+def tag_name(slug):
+    return TAG_PREFIX + slug
+
+def tag_slug(name):
+    """The slug a named range tags, or None if the range is not a tag."""
+    match = TAG_NAME.fullmatch(name)
+    return match.group(1) if match else None
+
+def unique_slug(name, taken):
+    # Suffix -1, -2, ... until the slug is not in `taken`, then claim it
+    base = slugify(name) or 'section'
+    slug = base
+    suffix = 1
+    while slug in taken:
+        slug = f"{base}-{suffix}"
+        suffix += 1
+    taken.add(slug)
+    return slug
+
 def get_service():
-    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-    if not creds_path or not os.path.isfile(creds_path):
-        raise FileNotFoundError(
-            'Service account credentials not found. '
-            'Set GOOGLE_APPLICATION_CREDENTIALS to your key JSON.'
-        )
-    creds = service_account.Credentials.from_service_account_file(
-        creds_path, scopes=SCOPES)
-    return build('docs', 'v1', credentials=creds)
-
-def tag_sections(doc_id, section_names):
-    service = get_service()
-    doc = service.documents().get(documentId=doc_id).execute()
-    # Map heading text to its start/end indices
-    heading_positions = {}
-    for el in doc.get('body', {}).get('content', []):
-        para = el.get('paragraph')
-        if not para:
-            continue
-        if para.get('paragraphStyle', {}).get('namedStyleType') == 'HEADING_1':
-            text = ''.join(
-                run.get('textRun', {}).get('content', '')
-                for run in para.get('elements', [])
-            ).strip()
-            start = el.get('startIndex')
-            end = el.get('endIndex')
-            heading_positions[text] = (start, end)
-    requests = []
+    return google_clients.get_service('docs', 'v1', SCOPES)
+
+def plan_tags(plan, section_names=None):
+    """Queue named ranges so every H1 (or every H1 named in section_names) is tagged.
+
+    A heading's tag is the first body named range called TAG_PREFIX + slug
+    starting inside it, so its slug survives renames and edits to the heading text. Tags that
+    still cover their heading exactly are left alone; moved, resized or
+    duplicated ones are deleted and recreated under the same name. Headings
+    without a tag, or whose tag name an earlier heading already claimed,
+    get a new unique slug, so duplicate headings are tagged separately.
+    Returns {slug: entry} for sections/sections.json; namedRangeId is
+    filled in from the replies.
+    """
+    named = plan.index.named_ranges
+    taken = {tag_slug(name) for name in named} - {None}
+    tags = sorted(
+        (r for name, group in named.items() if tag_slug(name)
+         for r in group if r.segment_id is None),
+        key=lambda r: r.start
+    )
+    tag_starts = [r.start for r in tags]
+    wanted = set(section_names) if section_names else None
+    found = set()
+    # Slugs given to a heading in this run; each name is deleted at most once
+    claimed = set()
     mapping = {}
-    slug_set = set()
-    # Tag only the specified sections
-    for name in section_names:
-        pos = heading_positions.get(name)
-        if not pos:
-            print(f'Warning: heading "{name}" not found; skipping.')
+
+    def record_id(entry):
+        def on_reply(reply):
+            entry['namedRangeId'] = reply.get('createNamedRange', {}).get('namedRangeId')
+            return []
+        return on_reply
+
+    for heading in plan.h1:
+        if wanted is not None and heading.text not in wanted:
             continue
-        start, end = pos
-        # Generate unique slug
-        base = slugify(name) or 'section'
-        slug = base
-        suffix = 1
-        while slug in slug_set:
-            slug = f"{base}-{suffix}"
-            suffix += 1
-        slug_set.add(slug)
-        # Create named range for this heading
-        requests.append({
+        found.add(heading.text)
+        start, end = plan.heading_range(heading)
+        current = None
+        if not heading.planned:
+            i = bisect_left(tag_starts, heading.start)
+            if i < len(tags) and tag_starts[i] < heading.end:
+                current = tags[i]
+        entry = {'name': heading.text, 'namedRangeId': None,
+                 'startIndex': start, 'endIndex': end}
+        if current is not None and tag_slug(current.name) not in claimed:
+            slug = tag_slug(current.name)
+            claimed.add(slug)
+            if (current.start == heading.start and current.end == heading.end
+                    and len(named[current.name]) == 1):
+                entry['namedRangeId'] = current.range_id
+                mapping[slug] = entry
+                continue
+            # deleteNamedRange by name also clears duplicates left by older runs
+            plan.add({'deleteNamedRange': {'name': current.name}})
+        else:
+            # A second heading carrying a claimed name lost that range to the
+            # delete above, so it is tagged afresh
+            slug = unique_slug(heading.text, taken)
+            claimed.add(slug)
+        plan.add({
             'createNamedRange': {
-                'name': slug,
+                'name': tag_name(slug),
                 'range': {'startIndex': start, 'endIndex': end}
             }
-        })
-        mapping[slug] = {'name': name, 'startIndex': start, 'endIndex': end}
-    if not requests:
-        print('No valid headings to tag; nothing to do.')
-        return
-    service.documents().batchUpdate(
-        documentId=doc_id,
-        body={'requests': requests}
-    ).execute()
-    # Write mapping locally
+        }, on_reply=record_id(entry))
+        mapping[slug] = entry
+    for name in section_names or []:
+        if name not in found:
+            print(f'Warning: heading "{name}" not found; skipping.')
+    return mapping
+
+def write_mapping(mapping):
     os.makedirs('sections', exist_ok=True)
     with open('sections/sections.json', 'w', encoding='utf-8') as f:
         json.dump(mapping, f, indent=2)
-    print(f'Tagged {len(mapping)} sections; mapping in sections/sections.json')
+
+def tag_sections(doc_id, section_names, service=None, index=None, dry_run=False):
+    service = service or get_service()
+    plan = Plan(index or fetch_index(service, doc_id, MASKS['tags']))
+    mapping = plan_tags(plan, section_names)
+    if dry_run:
+        plan.print_dry_run()
+        return
+    if not mapping:
+        print('No valid headings to tag; nothing to do.')
+        return
+    if plan.requests:
+        plan.execute(service, doc_id)
+    # Write mapping locally
+    write_mapping(mapping)
+    retagged = sum(1 for r in plan.requests if 'createNamedRange' in r)
+    print(f'Tagged {len(mapping)} sections ({retagged} created or moved); '
+          f'mapping in sections/sections.json')
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--doc-id', required=True, help='Google Doc ID')
     parser.add_argument(
-        '--sections', required=True, nargs='+',
-        help='List of exact H1 section names to tag'
+        '--sections', nargs='+',
+        help='Exact H1 section names to tag (default: every H1)'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the planned requests and their cost instead of sending them'
     )
+    profiling.add_argument(parser)
     args = parser.parse_args()
-    tag_sections(args.doc_id, args.sections)
+    profiling.start(args.profile)
+    tag_sections(args.doc_id, args.sections, dry_run=args.dry_run)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
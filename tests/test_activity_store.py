@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import activity_store
+from activity_store import ActivityStore, import_log, to_millis
+
+def record(timestamp, user='people/1', doc='a', action='edit'):
+    return {'timestamp': timestamp, 'user': user, 'action': action, 'docId': doc,
+            'detail': {action: {}}}
+
+RECORDS = [
+    record('2024-04-30T23:59:59.999Z', 'people/1', 'a'),
+    record('2024-05-01T00:00:00Z', 'people/2', 'a'),
+    record('2024-05-01T00:00:00Z', 'people/2', 'a', 'comment'),
+    record('2024-05-02T12:00:00.5Z', 'people/1', 'b'),
+    record('2024-05-31T23:00:00Z', 'people/3', 'b', 'edit,rename'),
+    record('2024-06-01T00:00:00Z', 'people/1', 'a'),
+]
+
+def timestamps(records):
+    return [r['timestamp'] for r in records]
+
+def test_to_millis():
+    assert to_millis('2024-05-01') == to_millis('2024-05-01T00:00:00Z') == 1714521600000
+    assert to_millis('2024-05-01T00:00:00.5Z') == 1714521600500
+    assert to_millis('2024-05-01T05:00:00.25+05:00') == 1714521600250
+    with pytest.raises(ValueError):
+        to_millis('2024-05-01T00:00:00')
+
+def test_append_query_and_reopen(tmp_path):
+    store = ActivityStore(str(tmp_path))
+    # Appended out of order and in two batches
+    assert store.append(RECORDS[3:]) == 3
+    assert store.append(RECORDS[:3]) == 3
+    store = ActivityStore(str(tmp_path))
+    assert len(store) == 6
+    assert sorted(c['path'].split('/')[0] for c in store.index['chunks']) == [
+        '2024-04', '2024-05', '2024-05', '2024-06']
+    assert timestamps(store.query(user='people/1')) == timestamps(
+        [RECORDS[0], RECORDS[3], RECORDS[5]])
+    assert list(store.query(doc='b')) == RECORDS[3:5]
+    assert list(store.query(since='2024-05-01', until='2024-06-01', action='edit')) == [
+        RECORDS[1], RECORDS[3], RECORDS[4]]
+    assert store.count(since='2024-05-01T00:00:00Z', until='2024-05-02T12:00:00.500Z') == 2
+    assert store.count(user='people/9') == 0
+    assert store.count_by_user(doc='a') == {'people/1': 2, 'people/2': 2}
+
+def test_compact_merges_chunks_and_keeps_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(activity_store, 'CHUNK_SIZE', 2)
+    store = ActivityStore(str(tmp_path))
+    for r in RECORDS[1:5]:
+        store.append([r])
+    assert len(store.index['chunks']) == 4
+    assert store.compact() == 4
+    assert len(store.index['chunks']) == 2
+    assert sorted(p.name for p in (tmp_path / '2024-05').iterdir()) == [
+        'chunk-000005.col', 'chunk-000005.jsonl', 'chunk-000006.col', 'chunk-000006.jsonl']
+    store = ActivityStore(str(tmp_path))
+    assert list(store.query()) == RECORDS[1:5]
+    assert store.compact() == 0
+
+def test_import_twice_adds_nothing(tmp_path):
+    log = tmp_path / 'activity.jsonl'
+    log.write_text(''.join(json.dumps(r) + '\n' for r in RECORDS[:4]))
+    store = ActivityStore(str(tmp_path / 'store'))
+    assert import_log(store, str(log), batch=3) == 4
+    with log.open('a') as f:
+        f.writelines(json.dumps(r) + '\n' for r in RECORDS[4:])
+    assert import_log(store, str(log), batch=3) == 2
+    assert import_log(store, str(log)) == 0
+    assert list(ActivityStore(str(tmp_path / 'store')).query()) == RECORDS
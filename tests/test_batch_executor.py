@@ -0,0 +1,109 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from batch_executor import MAX_REQUESTS_PER_BATCH, BatchExecutor, retry_after
+from docs_emulator import EmulatedDocsService, EmulatorError, EmulatorResponse, generate_document
+
+class Recorder:
+    """Wraps a service, keeping every batchUpdate body and raising queued errors."""
+
+    def __init__(self, service):
+        self.service = service
+        self.bodies = []
+        self.errors = []
+
+    def documents(self):
+        return self
+
+    def batchUpdate(self, documentId, body):
+        self.bodies.append(body)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.service.documents().batchUpdate(documentId=documentId, body=body)
+
+def setup():
+    docs = EmulatedDocsService()
+    doc = docs.add(generate_document('d', 20))
+    sleeps = []
+    return docs, doc, Recorder(docs), sleeps
+
+def name(i):
+    return {'createNamedRange': {'name': f'r{i}', 'range': {'startIndex': 1, 'endIndex': 2}}}
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_throttled_calls_are_retried_without_a_pin(status):
+    docs, doc, service, sleeps = setup()
+    docs.fail_next(status, count=2)
+    executor = BatchExecutor(service, sleep=sleeps.append)
+    executor.run('d', [name(0)])
+    assert len(sleeps) == 2 and executor.metrics.retries == 2
+    assert executor.metrics.throttled == 2 and executor.metrics.calls == 1
+    assert len(doc.named_ranges) == 1
+
+@pytest.mark.parametrize('error', [EmulatorError(500, 'boom'), ConnectionResetError()])
+def test_ambiguous_failures_are_final_unless_pinned(error):
+    docs, doc, service, sleeps = setup()
+    service.errors.append(error)
+    executor = BatchExecutor(service, sleep=sleeps.append)
+    with pytest.raises(type(error)):
+        executor.run('d', [name(0)])
+    assert sleeps == [] and executor.metrics.failures == 1
+    service.errors.append(error)
+    executor = BatchExecutor(service, sleep=sleeps.append)
+    executor.run('d', [name(0)], doc.revision_id)
+    assert len(sleeps) == 1 and len(doc.named_ranges) == 1
+
+def test_stale_revision_is_not_retried():
+    docs, doc, service, sleeps = setup()
+    executor = BatchExecutor(service, sleep=sleeps.append)
+    with pytest.raises(EmulatorError) as raised:
+        executor.run('d', [name(0)], 'd-r0')
+    assert raised.value.resp.status == 400 and len(service.bodies) == 1
+
+def test_retry_after_is_honoured():
+    docs, doc, service, sleeps = setup()
+    docs.fail_next(429, retry_after=7)
+    BatchExecutor(service, base_delay=0, sleep=sleeps.append).run('d', [name(0)])
+    assert sleeps == [7.0]
+    date = EmulatorError(503, 'busy')
+    date.resp = EmulatorResponse(503, {'retry-after': formatdate(time.time() + 30)})
+    assert 28 <= retry_after(date) <= 30
+    assert retry_after(EmulatorError(503, 'busy')) is None
+
+def test_large_queues_are_chunked_and_chained():
+    docs, doc, service, sleeps = setup()
+    executor = BatchExecutor(service, sleep=sleeps.append)
+    count = 2 * MAX_REQUESTS_PER_BATCH + 1
+    replies = executor.run('d', [name(i) for i in range(count)])
+    assert [len(body['requests']) for body in service.bodies] == [
+        MAX_REQUESTS_PER_BATCH, MAX_REQUESTS_PER_BATCH, 1]
+    # Unpinned, the first call is sent as is and the rest follow its revision
+    assert 'writeControl' not in service.bodies[0]
+    assert [body['writeControl']['requiredRevisionId'] for body in service.bodies[1:]] == [
+        'd-r2', 'd-r3']
+    assert executor.revision('d') == doc.revision_id == 'd-r4'
+    ids = [reply['createNamedRange']['namedRangeId'] for reply in replies]
+    assert [doc.named_ranges[i][0] for i in ids] == [f'r{i}' for i in range(count)]
+
+def test_replies_are_routed_and_pins_are_not_mixed():
+    docs, doc, service, sleeps = setup()
+    executor = BatchExecutor(service, sleep=sleeps.append)
+    pinned = [executor.submit('d', [name(0), name(1)], 'd-r1'),
+              executor.submit('d', [name(2)], 'd-r1')]
+    unpinned = executor.submit('d', [name(3)])
+    executor.flush()
+    # Same pin: one call; no pin: its own call, without inheriting the chain's revision
+    assert [body.get('writeControl') for body in service.bodies] == [
+        {'requiredRevisionId': 'd-r1'}, None]
+    for batch, names in ((pinned[0], ['r0', 'r1']), (pinned[1], ['r2']), (unpinned, ['r3'])):
+        assert [doc.named_ranges[r['createNamedRange']['namedRangeId']][0]
+                for r in batch.replies] == names
+    # A batch pinned to a revision the chain moved past fails instead of being re-pinned
+    executor.submit('d', [name(4)])
+    executor.submit('d', [name(5)], 'd-r2')
+    with pytest.raises(EmulatorError):
+        executor.flush()
+    assert 'writeControl' not in service.bodies[2]
+    assert service.bodies[3]['writeControl'] == {'requiredRevisionId': 'd-r2'}
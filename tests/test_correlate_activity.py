@@ -0,0 +1,52 @@
+import json
+
+from correlate_activity import DOCUMENT_LOG, ChangeWindows, correlate, write_audit_logs
+
+def edit(doc_id, timestamp, user='people/1'):
+    return {'timestamp': timestamp, 'user': user, 'action': 'edit', 'docId': doc_id}
+
+def test_edits_go_to_the_first_sync_at_or_after_them():
+    windows = ChangeWindows([
+        {'docId': 'a', 'time': '2024-05-01T10:00:00.500Z', 'sections': ['intro']},
+        {'docId': 'a', 'time': '2024-05-01T10:05:00Z', 'sections': ['usage', 'faq']},
+    ])
+    records = [
+        # No fraction: compared as text this sorts after the .500Z sync
+        edit('a', '2024-05-01T10:00:00Z'),
+        edit('a', '2024-05-01T10:00:00.500Z'),
+        edit('a', '2024-05-01T10:00:01Z'),
+        edit('a', '2024-05-01T10:06:00Z'),
+        edit('b', '2024-05-01T10:00:00Z'),
+        dict(edit('a', '2024-05-01T10:00:00Z'), action='comment'),
+    ]
+    assert [(doc_id, slug, attribution) for doc_id, slug, _, attribution
+            in correlate(records, windows)] == [
+        ('a', 'intro', 'window'),
+        ('a', 'intro', 'window'),
+        ('a', 'usage', 'window'), ('a', 'faq', 'window'),
+        ('a', DOCUMENT_LOG, 'document'),
+        ('b', DOCUMENT_LOG, 'document'),
+        ('a', DOCUMENT_LOG, 'document'),
+    ]
+
+def test_docs_sharing_a_heading_get_separate_logs(tmp_path):
+    windows = ChangeWindows([
+        {'docId': 'a', 'time': '2024-05-01T10:00:00Z', 'sections': ['intro']},
+        {'docId': 'b', 'time': '2024-05-01T10:00:00Z', 'sections': ['intro']},
+    ])
+    records = [edit('a', '2024-05-01T09:00:00Z', 'people/1'),
+               edit('b', '2024-05-01T09:00:00Z', 'people/2')]
+    # A log from an earlier run for a doc this run does not cover
+    (tmp_path / 'c').mkdir()
+    (tmp_path / 'c' / 'intro.jsonl').write_text('{}\n')
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'gone.jsonl').write_text('{}\n')
+    grouped = {}
+    for doc_id, slug, record, attribution in correlate(records, windows):
+        grouped.setdefault((doc_id, slug), []).append((record, attribution))
+    write_audit_logs(grouped, str(tmp_path))
+    for doc_id, user in (('a', 'people/1'), ('b', 'people/2')):
+        lines = (tmp_path / doc_id / 'intro.jsonl').read_text().splitlines()
+        assert [json.loads(line)['user'] for line in lines] == [user]
+    assert (tmp_path / 'c' / 'intro.jsonl').exists()
+    assert not (tmp_path / 'a' / 'gone.jsonl').exists()
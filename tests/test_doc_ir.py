@@ -0,0 +1,41 @@
+from doc_index import DocIndex, fetch_index
+from doc_ir import DocumentIR
+from docs_emulator import EmulatedDocsService, EmulatedDocument
+from pipeline import build_plan
+
+def emulated_doc():
+    service = EmulatedDocsService()
+    service.add(EmulatedDocument.from_paragraphs('d', [
+        ('Intro 🎉', 'HEADING_1'), ('Launch 🚀 went fine 𝄞', 'NORMAL_TEXT'),
+        ('Usage', 'HEADING_1'), ('Run it', 'NORMAL_TEXT'), ('Details', 'HEADING_2'),
+        ('', 'NORMAL_TEXT'), ('Ünïcode ✓', 'HEADING_1'), ('last', 'NORMAL_TEXT'),
+    ]))
+    # Give the doc section breaks, headers and named ranges too
+    plan, _ = build_plan(fetch_index(service, 'd'), [], ('breaks', 'headers', 'tags'))
+    plan.execute(service, 'd')
+    return service.documents().get(documentId='d').execute()
+
+def test_snapshot_round_trip_keeps_the_document_and_its_plans(tmp_path):
+    doc = emulated_doc()
+    path = str(tmp_path / 'doc.ir')
+    DocumentIR.from_json(doc).save(path)
+    ir = DocumentIR.load(path)
+    assert ir.revision_id == doc['revisionId']
+    assert ir.to_json() == doc
+    paragraphs = [el for el in doc['body']['content'] if 'paragraph' in el]
+    assert [(p.start, p.end, p.text) for p in ir.paragraphs()] == [
+        (el['startIndex'], el['endIndex'],
+         ''.join(r['textRun']['content'] for r in el['paragraph']['elements']))
+        for el in paragraphs]
+    for sections in ([], ['Usage', 'FAQ 👋']):
+        expected, expected_mapping = build_plan(DocIndex(doc), sections)
+        plan, mapping = build_plan(DocIndex(ir.to_json()), sections)
+        assert plan.requests == expected.requests
+        assert bool(plan.requests) == bool(sections)
+        assert mapping == expected_mapping
+    expected = DocIndex(doc)
+    index = DocIndex(ir.to_json())
+    assert [(s.name, s.start, s.end) for s in index.sections] == [
+        (s.name, s.start, s.end) for s in expected.sections]
+    # The first H1 opens the body, so only the other two get a break
+    assert len(index.breaks) == 2 and {b.header_id for b in index.breaks} != {None}
@@ -0,0 +1,51 @@
+import pytest
+
+from docs_emulator import EmulatedDocsService, EmulatedDocument, EmulatorError
+
+def paragraph_ranges(doc):
+    return [(el['startIndex'], el['endIndex'],
+             ''.join(run['textRun']['content'] for run in el['paragraph']['elements']))
+            for el in doc.to_json()['body']['content'] if 'paragraph' in el]
+
+def test_indices_count_utf16_code_units():
+    doc = EmulatedDocument.from_paragraphs('d', [('a😀b', 'NORMAL_TEXT'), ('c', 'NORMAL_TEXT')])
+    assert paragraph_ranges(doc) == [(1, 6, 'a😀b\n'), (6, 8, 'c\n')]
+    assert doc.end_index == 8
+
+def test_edits_after_an_emoji():
+    service = EmulatedDocsService()
+    doc = service.add(EmulatedDocument.from_paragraphs(
+        'd', [('a😀b', 'NORMAL_TEXT'), ('c', 'HEADING_1')]))
+    service.documents().batchUpdate(documentId='d', body={'requests': [
+        # After "a😀", i.e. before "b"
+        {'insertText': {'location': {'index': 4}, 'text': 'X'}},
+        # The first paragraph's newline, now at 6
+        {'deleteContentRange': {'range': {'startIndex': 6, 'endIndex': 7}}},
+    ]}).execute()
+    assert paragraph_ranges(doc) == [(1, 8, 'a😀Xbc\n')]
+
+def test_inserted_emoji_shifts_named_ranges_by_two():
+    doc = EmulatedDocument.from_paragraphs('d', [('ab', 'NORMAL_TEXT')])
+    range_id = doc.create_named_range('n', 2, 3)
+    doc.insert_text(1, '😀')
+    assert doc.named_ranges[range_id][1:] == [4, 5]
+    assert paragraph_ranges(doc) == [(1, 6, '😀ab\n')]
+
+def test_style_range_ends_at_utf16_paragraph_end():
+    doc = EmulatedDocument.from_paragraphs('d', [('😀', 'NORMAL_TEXT'), ('b', 'NORMAL_TEXT')])
+    doc.update_paragraph_style(1, 4, {'namedStyleType': 'HEADING_2'}, 'namedStyleType')
+    styles = [el['paragraph']['paragraphStyle']['namedStyleType']
+              for el in doc.to_json()['body']['content'] if 'paragraph' in el]
+    assert styles == ['HEADING_2', 'NORMAL_TEXT']
+
+def test_index_inside_a_surrogate_pair_is_rejected():
+    doc = EmulatedDocument.from_paragraphs('d', [('😀', 'NORMAL_TEXT')])
+    with pytest.raises(EmulatorError):
+        doc.insert_text(2, 'x')
+
+def test_segment_edits_count_utf16_code_units():
+    doc = EmulatedDocument('d')
+    header_id = doc.create_segment('header')
+    doc.insert_text(0, '😀a', segment_id=header_id)
+    doc.delete_range(2, 3, segment_id=header_id)
+    assert doc.headers[header_id] == '😀\n'
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+
+import pytest
+
+from docs_emulator import EmulatedDocsService, generate_document
+from exec_server import ExecServer, ThreadOutput
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'repo').mkdir()
+    docs = EmulatedDocsService()
+    docs.add(generate_document('d', 20))
+    server = ExecServer(docs, 'token', state_path='repo/state.json',
+                        changes_path='repo/changes.jsonl', root='repo')
+    yield server
+    server.pool.shutdown()
+
+def run(server, line):
+    # pytest swaps sys.stdout per test, undoing the server's ThreadOutput
+    out = []
+    stdout, sys.stdout = sys.stdout, ThreadOutput(sys.stdout)
+    try:
+        server.run(line, 'd', out.append)
+    finally:
+        sys.stdout = stdout
+    return ''.join(out)
+
+def test_sync_writes_inside_the_root(server, tmp_path):
+    assert 'Error' not in run(server, 'sync --output docs/d.md')
+    assert (tmp_path / 'repo' / 'docs' / 'd.md').is_file()
+
+@pytest.mark.parametrize('output', ['../escape.md', 'docs/../../escape.md', '/tmp/escape.md', '.'])
+def test_sync_rejects_outputs_outside_the_root(server, tmp_path, output):
+    assert run(server, f'sync --output {output}').startswith('Error: --output')
+    assert not (tmp_path / 'escape.md').exists()
+
+def test_sync_rejects_symlinks_out_of_the_root(server, tmp_path):
+    os.symlink(tmp_path, tmp_path / 'repo' / 'out')
+    assert run(server, 'sync --output out/escape.md').startswith('Error: --output')
+    assert not (tmp_path / 'escape.md').exists()
+
+def test_sync_keeps_state_written_by_other_processes(server, tmp_path):
+    run(server, 'sync --output docs/d.md')
+    state_path = tmp_path / 'repo' / 'state.json'
+    # e.g. sync_daemon syncing another doc in the meantime
+    state = json.loads(state_path.read_text())
+    state['other'] = {'revisionId': 'other-r7'}
+    state_path.write_text(json.dumps(state))
+    run(server, 'sync --output docs/d.md --full')
+    state = json.loads(state_path.read_text())
+    assert state['other'] == {'revisionId': 'other-r7'} and 'd' in state
@@ -0,0 +1,9 @@
+from fetch_activity import record_key
+
+def test_record_key_tells_apart_activities_in_the_same_millisecond():
+    base = {'timestamp': '2024-05-01T10:00:00.123Z', 'user': 'people/1', 'docId': 'd'}
+    edit = dict(base, action='edit', detail={'edit': {}})
+    comment = dict(base, action='comment', detail={'comment': {'post': {'subtype': 'ADDED'}}})
+    assert record_key(edit) != record_key(comment)
+    # A refetched record matches however its keys are ordered
+    assert record_key(edit) == record_key(dict(reversed(list(edit.items()))))
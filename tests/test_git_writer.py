@@ -0,0 +1,57 @@
+import shutil
+import subprocess
+
+import pytest
+
+from git_writer import GitWriter, blob_sha1
+
+def git(cwd, *args):
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True,
+                          text=True).stdout
+
+@pytest.fixture
+def work(tmp_path, monkeypatch):
+    work = tmp_path / 'work'
+    git(tmp_path, 'init', '-q', str(work))
+    git(work, 'config', 'user.name', 'Test')
+    git(work, 'config', 'user.email', 'test@example.com')
+    monkeypatch.chdir(work)
+    return work
+
+def test_blob_sha1_matches_git(work):
+    (work / 'a.md').write_bytes(b'hello\n')
+    assert blob_sha1(b'hello\n') == git(work, 'hash-object', 'a.md').strip()
+
+def test_unchanged_files_are_not_committed(work):
+    (work / 'docs').mkdir()
+    (work / 'docs' / 'a.md').write_text('a\n')
+    writer = GitWriter()
+    first = writer.commit(['docs/a.md', 'docs/missing.md'], 'first')
+    assert first and writer.commit(['docs/a.md'], 'again') is None
+    assert git(work, 'log', '--format=%s').splitlines() == ['first']
+    assert git(work, 'status', '--porcelain') == ''
+
+def test_deleted_directory_leaves_a_clean_index(work):
+    (work / 'docs' / 'sub').mkdir(parents=True)
+    for name in ('docs/a.md', 'docs/sub/b.md', 'keep.md'):
+        (work / name).write_text(name)
+    writer = GitWriter()
+    writer.commit(['docs', 'keep.md'], 'add')
+    shutil.rmtree(work / 'docs')
+    assert writer.commit(['docs'], 'remove')
+    assert git(work, 'ls-tree', '-r', '--name-only', 'HEAD').splitlines() == ['keep.md']
+    assert git(work, 'ls-files').splitlines() == ['keep.md']
+    assert git(work, 'status', '--porcelain') == ''
+
+def test_writes_into_a_bare_repository(tmp_path):
+    bare = tmp_path / 'mirror.git'
+    git(tmp_path, 'init', '-q', '--bare', str(bare))
+    git(bare, 'config', 'user.name', 'Test')
+    git(bare, 'config', 'user.email', 'test@example.com')
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'a.md').write_text('a\n')
+    writer = GitWriter(str(src), git_dir=str(bare), ref='main')
+    sha = writer.commit([str(src / 'a.md')], 'mirror')
+    assert git(bare, 'rev-parse', 'refs/heads/main').strip() == sha
+    assert git(bare, 'show', 'main:a.md') == 'a\n'
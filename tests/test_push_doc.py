@@ -0,0 +1,38 @@
+from doc_index import DocIndex
+from doc_plan import Plan
+from docs_emulator import EmulatedDocument
+from push_doc import doc_blocks, markdown_blocks, plan_push
+
+def render(doc):
+    return ''.join(block.markdown for block in doc_blocks(doc))
+
+def push(doc, edit):
+    before = doc.to_json()
+    target = edit(render(before))
+    plan = Plan(DocIndex(before))
+    assert plan_push(plan, doc_blocks(before), markdown_blocks(target)) == (1, 0)
+    doc.batch_update({'requests': plan.requests})
+    return target, plan.requests
+
+def styles(doc):
+    return [el['paragraph']['paragraphStyle']['namedStyleType']
+            for el in doc.to_json()['body']['content'] if 'paragraph' in el]
+
+def test_edit_after_an_emoji_uses_utf16_indices():
+    doc = EmulatedDocument.from_paragraphs('d', [
+        ('Intro', 'HEADING_1'), ('The b😀dget is 😀 fine', 'NORMAL_TEXT'),
+        ('Plan risk', 'NORMAL_TEXT'),
+    ])
+    target, requests = push(doc, lambda md: md.replace('is 😀 fine', 'is 😀 great'))
+    assert render(doc.to_json()) == target
+    assert styles(doc) == ['HEADING_1', 'NORMAL_TEXT', 'NORMAL_TEXT']
+    # The paragraph starts at 7; "The b😀dget is 😀 " is 16 code points but 18 units
+    assert requests[0]['deleteContentRange']['range'] == {'startIndex': 25, 'endIndex': 29}
+
+def test_restyle_after_an_emoji_stays_on_its_paragraph():
+    doc = EmulatedDocument.from_paragraphs('d', [
+        ('b😀dget', 'NORMAL_TEXT'), ('Plan risk', 'NORMAL_TEXT'),
+    ])
+    target, _ = push(doc, lambda md: md.replace('b😀dget\n', '## b😀dget!\n\n'))
+    assert render(doc.to_json()) == target
+    assert styles(doc) == ['HEADING_2', 'NORMAL_TEXT']
@@ -0,0 +1,140 @@
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from docs_emulator import EmulatedDocsService, EmulatedDriveService, generate_document
+from sync_daemon import ChannelRenewer, Scheduler, SyncDaemon, is_loopback, start_receiver
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def git(cwd, *args):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+def test_unchanged_polls_back_off_and_changes_reset():
+    clock = FakeClock()
+    scheduler = Scheduler(min_interval=10, max_interval=40, jitter=0, clock=clock)
+    scheduler.add('d', 'docs/d.md')
+    doc, = scheduler.due()
+    assert scheduler.due() == []
+    intervals = []
+    for _ in range(4):
+        scheduler.done(doc, changed=False)
+        intervals.append(doc.interval)
+        clock.now = doc.due
+        assert scheduler.due() == [doc]
+    assert intervals == [20, 40, 40, 40]
+    scheduler.done(doc, changed=True)
+    assert doc.interval == 10
+
+def test_failed_syncs_retry_on_their_own_backoff(tmp_path, capsys):
+    clock = FakeClock()
+    docs = EmulatedDocsService()
+    docs.add(generate_document('d', 20))
+    scheduler = Scheduler(min_interval=10, max_interval=40, jitter=0, clock=clock)
+    daemon = SyncDaemon(docs, scheduler, {}, str(tmp_path / 'state.json'),
+                        str(tmp_path / 'changes.jsonl'))
+    daemon.add('d', str(tmp_path / 'd.md'))
+    docs.fail_next(500, count=3)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        retries = []
+        for _ in range(3):
+            assert daemon.run_round(pool) == []
+            doc = scheduler.docs['d']
+            retries.append(doc.due - clock.now)
+            clock.now = doc.due
+        # Not mistaken for unchanged polls: the polling interval is untouched
+        assert retries == [10, 20, 40] and doc.interval == 10
+        assert 'syncing d failed (3 in a row)' in capsys.readouterr().out
+        assert daemon.run_round(pool) == [str(tmp_path / 'd.md')]
+    assert doc.failures == 0 and daemon.syncs == 1 and daemon.failures == 3
+
+def test_unauthenticated_receiver_only_on_loopback():
+    scheduler = Scheduler()
+    with pytest.raises(ValueError):
+        start_receiver(scheduler, host='0.0.0.0', port=0)
+    for host in ('127.0.0.1', 'localhost', '::1'):
+        assert is_loopback(host)
+    server = start_receiver(scheduler, host='0.0.0.0', port=0, secret='s3cret')
+    server.shutdown()
+
+def test_push_notification_makes_doc_due():
+    docs = EmulatedDocsService()
+    docs.add(generate_document('d', 20))
+    drive = EmulatedDriveService(docs)
+    scheduler = Scheduler(min_interval=30)
+    doc = scheduler.add('d', 'docs/d.md')
+    scheduler.due()
+    scheduler.done(doc, changed=False)
+    server = start_receiver(scheduler, port=0, secret='s3cret')
+    try:
+        host, port = server.server_address[:2]
+        renew = ChannelRenewer(drive, ['d'], f'http://{host}:{port}/', 's3cret')
+        renew()
+        assert wait_for(lambda: drive.delivered[200] == 1)  # the "sync" message
+        assert scheduler.due() == []
+        docs.documents().batchUpdate(documentId='d', body={'requests': [
+            {'insertText': {'location': {'index': 1}, 'text': 'x'}}]}).execute()
+        assert wait_for(lambda: scheduler.due() == [doc])
+        renew.stop()
+        assert drive.watches == {}
+    finally:
+        server.shutdown()
+
+def test_channels_are_renewed_before_they_expire():
+    docs = EmulatedDocsService()
+    docs.add(generate_document('d', 20))
+    drive = EmulatedDriveService(docs)
+    scheduler = Scheduler(min_interval=30)
+    server = start_receiver(scheduler, port=0)
+    try:
+        host, port = server.server_address[:2]
+        renew = ChannelRenewer(drive, ['d'], f'http://{host}:{port}/', ttl=2, margin=1.7)
+        daemon = SyncDaemon(docs, scheduler, {}, 'state.json')
+        daemon.run(duration=1.0, renew=renew)
+        # One initial channel plus a renewal every 0.3 seconds
+        assert drive.calls['files.watch'] >= 3
+        assert drive.calls['channels.stop'] == drive.calls['files.watch'] - 1
+        assert list(drive.watches) == [renew.channels['d']['id']]
+        renew.stop()
+    finally:
+        server.shutdown()
+
+def test_failed_push_is_retried_next_round(tmp_path, monkeypatch):
+    remote = tmp_path / 'remote.git'
+    work = tmp_path / 'work'
+    git(tmp_path, 'init', '-q', '--bare', str(remote))
+    git(tmp_path, 'init', '-q', str(work))
+    git(work, 'config', 'user.name', 'Test')
+    git(work, 'config', 'user.email', 'test@example.com')
+    monkeypatch.chdir(work)
+    docs = EmulatedDocsService()
+    docs.add(generate_document('d', 20))
+    scheduler = Scheduler(min_interval=0, jitter=0)
+    daemon = SyncDaemon(docs, scheduler, {}, 'docs/.sync_state.json', 'docs/changes.jsonl',
+                        commit=True)
+    daemon.add('d', 'docs/d.md')
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # No remote yet: the commit lands but the push fails without raising
+        assert 'docs/d.md' in daemon.run_round(pool)
+        assert daemon.unpushed and not daemon.pending
+        git(work, 'remote', 'add', 'origin', str(remote))
+        assert daemon.run_round(pool) == []
+    assert not daemon.unpushed
+    log = subprocess.run(['git', 'log', '--format=%s', 'HEAD'], cwd=remote,
+                         capture_output=True, text=True, check=True).stdout
+    assert log.splitlines() == ['Update 1 doc(s)']
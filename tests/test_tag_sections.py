@@ -0,0 +1,45 @@
+from doc_fields import MASKS
+from doc_index import fetch_index
+from doc_plan import Plan
+from docs_emulator import EmulatedDocsService, EmulatedDocument
+from tag_sections import plan_tags
+
+def tag(service, doc_id):
+    plan = Plan(fetch_index(service, doc_id, MASKS['tags']))
+    mapping = plan_tags(plan)
+    if plan.requests:
+        plan.execute(service, doc_id)
+    return mapping, plan.requests
+
+def test_duplicate_tag_names_converge_in_one_run():
+    service = EmulatedDocsService()
+    doc = service.add(EmulatedDocument.from_paragraphs('d', [
+        ('Intro', 'HEADING_1'), ('x', 'NORMAL_TEXT'),
+        ('Intro', 'HEADING_1'), ('y', 'NORMAL_TEXT'),
+    ]))
+    # Both headings carry a range named "section:intro", e.g. after a copy and paste
+    doc.create_named_range('section:intro', 1, 7)
+    doc.create_named_range('section:intro', 9, 15)
+    mapping, requests = tag(service, 'd')
+    assert sum('deleteNamedRange' in r for r in requests) == 1
+    assert sorted(tuple(r) for r in doc.named_ranges.values()) == [
+        ('section:intro', 1, 7), ('section:intro-1', 9, 15)]
+    assert sorted(mapping) == ['intro', 'intro-1']
+    _, requests = tag(service, 'd')
+    assert requests == []
+
+def test_ranges_without_the_prefix_are_left_alone():
+    service = EmulatedDocsService()
+    doc = service.add(EmulatedDocument.from_paragraphs('d', [
+        ('Todo', 'HEADING_1'), ('x', 'NORMAL_TEXT'),
+    ]))
+    # Someone else's ranges, named like slugs and starting inside the heading
+    doc.create_named_range('todo', 2, 7)
+    doc.create_named_range('notes', 1, 3)
+    mapping, requests = tag(service, 'd')
+    assert not any('deleteNamedRange' in r for r in requests)
+    assert sorted(tuple(r) for r in doc.named_ranges.values()) == [
+        ('notes', 1, 3), ('section:todo', 1, 6), ('todo', 2, 7)]
+    assert list(mapping) == ['todo']
+    _, requests = tag(service, 'd')
+    assert requests == []